@@ -1,23 +1,42 @@
-from fastapi import APIRouter, Depends, Response, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer
+from datetime import datetime
 from typing import Optional
 from app.services.learning_path_services import (
     process_file_logic,
     generate_roadmap_logic,
-    generate_questions_logic,
+    regenerate_roadmap_node_logic,
     related_topics_logic
 )
 from app.services.db_services import (
     save_conversation,
     get_conversations_by_user,
-    get_roadmaps_by_user
+    get_roadmaps_by_user,
+    get_roadmap_by_id,
+    save_roadmap_with_conversation_atomic,
+    update_roadmap_with_log_atomic
 )
+from app.services import cache_services, export_services, job_services, question_bank_services, usage_services
+from app.services.batch_services import stream_topic_batch
+from app.services.bundle_services import learning_bundle_logic
 from app.schemas.requests import (
     ProcessFileRequest,
     TopicRequest, 
+    QuestionsRequest,
+    RoadmapNodeRequest,
+    TopicBatchRequest,
+    RoadmapJobRequest,
+    DocumentsJobRequest,
 )
-from app.core.security import get_current_user
+from app.core.security import auth_report, get_current_user
+from app.core import metrics, responses
+from app.core.circuit_breaker import CircuitOpenError, breakers_report
+from app.core.deadline import DeadlineExceeded
+from app.db.transactions import WriteConflict
+from app.services.ai_services import routing_report
 import os
+from urllib.parse import quote
 
 router = APIRouter()
 security = HTTPBearer()
@@ -25,6 +44,13 @@ security = HTTPBearer()
 # Key para servicios internos
 INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY", "internal_service_key_123")
 
+def _matched_headers(cache_status: str, served_topic: str) -> dict:
+    """X-Cache y, si se sirvió un tema casi igual, X-Matched-Topic (URL-encoded)"""
+    headers = {"X-Cache": cache_status}
+    if cache_status == "similar":
+        headers["X-Matched-Topic"] = quote(served_topic)
+    return headers
+
 @router.post("/documents")
 async def process_file(
     request: ProcessFileRequest,
@@ -57,30 +83,202 @@ async def generate_roadmap(
     ):
     """
     Generar una roadmap a partir de los temas
+    Los temas populares se sirven desde el caché compartido (header X-Cache);
+    un tema casi igual a uno ya generado recibe ese roadmap (X-Matched-Topic),
+    salvo que se pida exact
+    El roadmap queda guardado para el usuario; su ID va en el header X-Roadmap-ID
+    (para editarlo con PATCH /roadmaps/{roadmap_id}). Si no se puede guardar, falla
     """
-    response = await generate_roadmap_logic(request, email["email"])
+    response, cache_status, served_topic = await cache_services.resolve(
+        cache_services.ROADMAP,
+        request.topic,
+        lambda: generate_roadmap_logic(request, email["email"]),
+        exact=request.exact
+    )
     
     user_email = email["email"]
+    headers = _matched_headers(cache_status, served_topic)
     
-    await save_conversation(
+    # Si no se puede guardar, la petición falla (5xx) y el cliente reintenta:
+    # un 200 sin X-Roadmap-ID dejaría un roadmap que no se puede editar
+    saved = await save_roadmap_with_conversation_atomic(
         user_email=user_email,
-        route="/roadmaps",
+        roadmap_title=request.topic,
+        roadmap_content=response,
         prompt=f"Generar roadmap del tema: {request.topic}",
         response=str(response)
     )
+    headers["X-Roadmap-ID"] = saved["roadmap_id"]
     
-    return response
+    # Los aciertos de caché ya tienen el JSON serializado
+    return responses.json_response(
+        cache_services.encoded(cache_services.ROADMAP, served_topic, response),
+        headers=headers
+    )
+
+
+@router.patch("/roadmaps/{roadmap_id}")
+async def regenerate_roadmap_node(
+    roadmap_id: str,
+    request: RoadmapNodeRequest,
+    email: dict = Depends(get_current_user)
+    ):
+    """
+    Regenerar ("regenerate") o ampliar ("enrich") un solo nodo de un roadmap guardado
+    Una llamada pequeña al modelo en lugar de regenerar todo el roadmap;
+    el cambio queda registrado en learning_logs y también se ve en la
+    conversación del roadmap (GET /roadmaps/user/...). Si el roadmap cambió
+    mientras se generaba el nodo, responde 409
+    """
+    user_email = email["email"]
+    roadmap = await get_roadmap_by_id(roadmap_id)
+    if roadmap is None or roadmap.get("user") != user_email:
+        raise HTTPException(status_code=404, detail="Roadmap no encontrado")
+    
+    content, changes = await regenerate_roadmap_node_logic(
+        roadmap.get("title", ""),
+        roadmap.get("content") or {},
+        request.node,
+        request.mode,
+        request.instruction
+    )
+    
+    action = "ampliado" if request.mode == "enrich" else "regenerado"
+    try:
+        result = await update_roadmap_with_log_atomic(
+            roadmap_id,
+            user_email,
+            {"content": content},
+            log_message=f"Nodo '{changes['node']}' {action}",
+            changes=changes,
+            expected_update_time=roadmap.get("_update_time"),
+            conversation_id=roadmap.get("conversation_id")
+        )
+    except WriteConflict:
+        # Otro cambio se guardó mientras se generaba este: no se pisa
+        raise HTTPException(status_code=409, detail="El roadmap cambió mientras se editaba; reintentar")
+    
+    return {
+        "roadmap_id": roadmap_id,
+        "log_id": result["log_id"],
+        "node": changes["node"],
+        **content
+    }
+
+
+@router.post("/roadmaps/batch")
+async def generate_roadmaps_batch(
+    request: TopicBatchRequest,
+    email: dict = Depends(get_current_user)
+    ):
+    """
+    Generar roadmaps para varios temas en una sola llamada
+    Responde NDJSON: una línea por tema (sin repetidos) a medida que termina cada uno
+    """
+    user_email = email["email"]
+    return StreamingResponse(
+        stream_topic_batch(
+            request.topics,
+            cache_services.ROADMAP,
+            lambda topic_request: generate_roadmap_logic(topic_request, user_email),
+            user_email=user_email,
+            route="/roadmaps",
+            prompt_prefix="Generar roadmap del tema: "
+        ),
+        media_type="application/x-ndjson"
+    )
+
+
+def _job_accepted(http_request: Request, job: dict):
+    """202 con el job y su URL de estado (también en el header Location)"""
+    status_url = http_request.url_for("get_job", job_id=job["job_id"]).path
+    return responses.json_response(
+        responses.dumps({**job, "status_url": status_url}),
+        status_code=202,
+        headers={"Location": status_url}
+    )
+
+
+@router.post("/jobs/roadmaps", status_code=202)
+async def submit_roadmap_job(
+    request: RoadmapJobRequest,
+    http_request: Request,
+    email: dict = Depends(get_current_user)
+    ):
+    """
+    Generar un roadmap en segundo plano: responde 202 con el ID del job sin
+    esperar al modelo. El resultado (el mismo que POST /roadmaps, más el
+    roadmap_id guardado) se consulta con GET /jobs/{job_id}; con callback_url
+    se envía por POST al terminar (422 si apunta a una red interna o a un host
+    no permitido). 503 con Retry-After si hay demasiados jobs en curso
+    """
+    job = await job_services.submit_job(
+        job_services.ROADMAP,
+        email["email"],
+        payload=request.model_dump(exclude={"callback_url"}),
+        summary={"topic": request.topic, "exact": request.exact},
+        callback_url=request.callback_url
+    )
+    return _job_accepted(http_request, job)
+
+
+@router.post("/jobs/documents", status_code=202)
+async def submit_documents_job(
+    request: DocumentsJobRequest,
+    http_request: Request,
+    email: dict = Depends(get_current_user)
+    ):
+    """
+    Procesar un archivo en segundo plano (como POST /documents): responde 202
+    con el ID del job. El archivo no se guarda en el job, solo su nombre
+    """
+    job = await job_services.submit_job(
+        job_services.DOCUMENTS,
+        email["email"],
+        payload=request.model_dump(exclude={"callback_url"}),
+        summary={"fileName": request.fileName},
+        callback_url=request.callback_url
+    )
+    return _job_accepted(http_request, job)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    email: dict = Depends(get_current_user)
+    ):
+    """
+    Estado de un job: queued, running, succeeded (con result), failed (con
+    error) o cancelled. Solo lo ve el usuario que lo creó (404 para los demás)
+    """
+    job = await job_services.get_job(job_id, email["email"])
+    return responses.json_response(responses.dumps(job))
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(
+    job_id: str,
+    email: dict = Depends(get_current_user)
+    ):
+    """
+    Cancelar un job en espera o en curso; el resultado que llegue después se
+    descarta. 409 si ya terminó
+    """
+    job = await job_services.cancel_job(job_id, email["email"])
+    return responses.json_response(responses.dumps(job))
 
 
 @router.get("/roadmaps/user/{user_email}")
 async def get_user_roadmaps(
     user_email: str,
     limit: int = 20,
-    x_api_key: Optional[str] = Header(None)
+    x_api_key: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
 ):
     """
     Obtener todos los roadmaps de un usuario
     Permite acceso con API key para servicios internos
+    Responde con ETag; con If-None-Match de la misma versión responde 304
     """
     # Verificar si viene con API key de servicio interno
     if x_api_key != INTERNAL_API_KEY:
@@ -90,11 +288,17 @@ async def get_user_roadmaps(
         # Usar nueva función que filtra primero
         roadmaps = await get_roadmaps_by_user(user_email, limit)
         
-        return {
-            "success": True,
-            "count": len(roadmaps),
-            "data": roadmaps
-        }
+        return responses.conditional_response(
+            responses.documents_etag(f"roadmaps:{user_email}:{limit}", roadmaps),
+            if_none_match,
+            lambda: {
+                "success": True,
+                "count": len(roadmaps),
+                "data": roadmaps
+            }
+        )
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -102,11 +306,13 @@ async def get_user_roadmaps(
 @router.get("/roadmaps/user/{user_email}/latest")
 async def get_latest_roadmap(
     user_email: str,
-    x_api_key: Optional[str] = Header(None)
+    x_api_key: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
 ):
     """
     Obtener el último roadmap generado por un usuario
     Permite acceso con API key para servicios internos
+    Responde con ETag; con If-None-Match de la misma versión responde 304
     """
     # Verificar si viene con API key de servicio interno
     if x_api_key != INTERNAL_API_KEY:
@@ -121,26 +327,70 @@ async def get_latest_roadmap(
                 "message": "No roadmaps found for this user"
             }
         
-        return {
-            "success": True,
-            "data": roadmaps[0]
-        }
+        return responses.conditional_response(
+            responses.documents_etag(f"roadmaps-latest:{user_email}", roadmaps),
+            if_none_match,
+            lambda: {
+                "success": True,
+                "data": roadmaps[0]
+            }
+        )
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+
+@router.get("/conversations/user/{user_email}/export")
+async def export_user_conversations(
+    user_email: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    route: Optional[str] = None,
+    gzip: bool = False,
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    Exportar el historial completo de conversaciones de un usuario (GDPR, analítica)
+    Responde NDJSON en streaming, de la más reciente a la más antigua; se puede
+    filtrar por fechas (since inclusive, until exclusivo) y por ruta.
+    Con gzip=true el cuerpo va comprimido (Content-Encoding: gzip)
+    Solo para servicios internos con API key
+    """
+    if x_api_key != INTERNAL_API_KEY:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+    try:
+        body = await export_services.open_export(user_email, since, until, route, gzip)
+    except (HTTPException, DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    headers = {"Content-Disposition": f'attachment; filename="conversations.ndjson{".gz" if gzip else ""}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
+
     
 @router.post("/questions")
 async def generate_questions(
-    request: TopicRequest,
+    request: QuestionsRequest,
     email: dict = Depends(get_current_user)
     ):
     """
-    Generar un conjunto de preguntas a partir del contenido de los temas relacionados
+    Devolver preguntas del banco del tema (y nodo), priorizando las que el usuario no vio
     """
-    response = await generate_questions_logic(request)
-    
     user_email = email["email"]
-    
+
+    response = await question_bank_services.sample_questions(
+        request.topic,
+        user_email=user_email,
+        node=request.node,
+        count=request.count
+    )
+
     await save_conversation(
         user_email=user_email,
         route="/questions",
@@ -158,7 +408,12 @@ async def related_topics(
     """
     Obtener temas relacionados a un tema principal
     """
-    response = await related_topics_logic(request)
+    response, cache_status, served_topic = await cache_services.resolve(
+        cache_services.RELATED_TOPICS,
+        request.topic,
+        lambda: related_topics_logic(request),
+        exact=request.exact
+    )
     
     user_email = email["email"]
     
@@ -169,4 +424,74 @@ async def related_topics(
         response=str(response)
     )
     
-    return response
+    # Los aciertos de caché ya tienen el JSON serializado
+    return responses.json_response(
+        cache_services.encoded(cache_services.RELATED_TOPICS, served_topic, response),
+        headers=_matched_headers(cache_status, served_topic)
+    )
+
+
+@router.post("/related-topics/batch")
+async def related_topics_batch(
+    request: TopicBatchRequest,
+    email: dict = Depends(get_current_user)
+    ):
+    """
+    Obtener temas relacionados para varios temas principales en una sola llamada
+    Responde NDJSON: una línea por tema (sin repetidos) a medida que termina cada uno
+    """
+    return StreamingResponse(
+        stream_topic_batch(
+            request.topics,
+            cache_services.RELATED_TOPICS,
+            related_topics_logic,
+            user_email=email["email"],
+            route="/related-topics",
+            prompt_prefix="Buscar temas relacionados con: "
+        ),
+        media_type="application/x-ndjson"
+    )
+
+
+@router.post("/bundle")
+async def learning_bundle(
+    request: TopicRequest,
+    email: dict = Depends(get_current_user)
+    ):
+    """
+    Roadmap, temas relacionados y preguntas de un tema en una sola llamada
+    Las tres partes se generan en paralelo; si alguna falla se devuelven las demás
+    """
+    return await learning_bundle_logic(request, email["email"])
+
+
+@router.get("/internal/metrics")
+async def internal_metrics(x_api_key: Optional[str] = Header(None)):
+    """
+    Métricas internas del proceso (latencia de publicación a Pub/Sub, outbox,
+    tasa de hedge por tarea de Gemini, estado de los circuit breakers, costo
+    de autenticar, etc.)
+    Solo para servicios internos con API key
+    """
+    if x_api_key != INTERNAL_API_KEY:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+    return {
+        **metrics.snapshot(),
+        "model_routing": routing_report(),
+        "circuit_breakers": breakers_report(),
+        "jobs": job_services.queue_report(),
+        "auth": auth_report(),
+    }
+
+
+@router.get("/internal/usage")
+async def internal_usage(x_api_key: Optional[str] = Header(None)):
+    """
+    Tokens y costo de Gemini aún no guardados en model_usage, y el tope de
+    tokens de salida vigente por tarea. Solo para servicios internos con API key
+    """
+    if x_api_key != INTERNAL_API_KEY:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+    return usage_services.usage_report()
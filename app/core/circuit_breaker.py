@@ -0,0 +1,221 @@
+"""
+Circuit breakers para las dependencias externas (Vertex AI, Firestore).
+
+Cada breaker mira las últimas ``window`` llamadas: si la proporción de errores
+o de llamadas lentas supera el umbral, se abre y durante ``open_seconds`` las
+llamadas fallan de inmediato con ``CircuitOpenError`` (sin ocupar un worker
+esperando a un upstream caído). Pasado ese tiempo queda semiabierto: deja
+pasar unas pocas llamadas de prueba y, según cómo les vaya, se cierra o se
+vuelve a abrir.
+
+Quien llama decide qué hacer con el circuito abierto; por ejemplo
+``cache_services.get_or_generate`` sirve la última respuesta cacheada del tema
+aunque esté vencida.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, Type, TypeVar
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "true").lower() != "false"
+
+
+class CircuitOpenError(Exception):
+    """La dependencia está marcada como caída: no se intentó la llamada"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito '{name}' abierto")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Args:
+        name: Nombre para logs y métricas
+        failure_rate: Proporción de errores que abre el circuito
+        slow_call_seconds: Una llamada más lenta que esto cuenta como lenta
+        slow_rate: Proporción de llamadas lentas que abre el circuito
+        window: Cantidad de llamadas recientes que se evalúan
+        min_calls: Mínimo de llamadas en la ventana antes de evaluar
+        open_seconds: Tiempo que el circuito queda abierto antes de probar
+        half_open_calls: Llamadas de prueba simultáneas en semiabierto
+        ignore: Excepciones que no cuentan como fallo del upstream
+            (errores del cliente, deadline agotado por la propia petición)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 30.0,
+        slow_rate: float = 0.8,
+        window: int = 20,
+        min_calls: int = 10,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 1,
+        ignore: Tuple[Type[BaseException], ...] = ()
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.ignore = ignore
+        self.state = CLOSED
+        # (falló, fue lenta) de las últimas llamadas
+        self._outcomes: Deque[tuple] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _open(self, reason: str) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        metrics.increment(f"breaker.{self.name}.opened")
+        logger.warning(f"🔌 Circuito '{self.name}' abierto: {reason}")
+
+    def before_call(self) -> None:
+        """Lanza CircuitOpenError si la llamada no debe intentarse"""
+        if not BREAKER_ENABLED:
+            return
+        with self._lock:
+            if self.state == OPEN:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.open_seconds:
+                    metrics.increment(f"breaker.{self.name}.rejected")
+                    raise CircuitOpenError(self.name, self.open_seconds - waited)
+                self.state = HALF_OPEN
+                self._probes = 0
+                logger.info(f"🔌 Circuito '{self.name}' semiabierto: probando")
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    metrics.increment(f"breaker.{self.name}.rejected")
+                    raise CircuitOpenError(self.name, 1.0)
+                self._probes += 1
+
+    def record(self, failed: bool, duration: float) -> None:
+        if not BREAKER_ENABLED:
+            return
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if failed or slow:
+                    self._open("falló la llamada de prueba")
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    logger.info(f"🔌 Circuito '{self.name}' cerrado")
+                return
+
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for f, _ in self._outcomes if f) / calls
+            slows = sum(1 for _, s in self._outcomes if s) / calls
+            if failures >= self.failure_rate:
+                self._open(f"{failures:.0%} de errores en las últimas {calls} llamadas")
+            elif slows >= self.slow_rate:
+                self._open(f"{slows:.0%} de llamadas lentas en las últimas {calls} llamadas")
+
+    def record_ignored(self, duration: float) -> None:
+        """
+        La llamada falló con un error de ``ignore``: no es falla del upstream,
+        pero tampoco prueba que se recuperó, así que una llamada de prueba deja
+        el circuito semiabierto (libera su lugar para otra prueba)
+        """
+        if not BREAKER_ENABLED:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                return
+        self.record(failed=False, duration=duration)
+
+    def abandon(self) -> None:
+        """La llamada se canceló sin resultado: libera su lugar de prueba"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """Ejecuta ``await func(*args, **kwargs)`` a través del breaker"""
+        self.before_call()
+        start = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except self.ignore:
+            self.record_ignored(time.monotonic() - start)
+            raise
+        except Exception:
+            self.record(failed=True, duration=time.monotonic() - start)
+            raise
+        except BaseException:
+            # Una cancelación (p. ej. perder contra un hedge) no dice nada del upstream
+            self.abandon()
+            raise
+        self.record(failed=False, duration=time.monotonic() - start)
+        return result
+
+    def call_sync(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Versión bloqueante de ``call``"""
+        self.before_call()
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except self.ignore:
+            self.record_ignored(time.monotonic() - start)
+            raise
+        except Exception:
+            self.record(failed=True, duration=time.monotonic() - start)
+            raise
+        self.record(failed=False, duration=time.monotonic() - start)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            outcomes = list(self._outcomes)
+        return {
+            "state": self.state,
+            "recent_calls": len(outcomes),
+            "recent_failures": sum(1 for f, _ in outcomes if f),
+            "recent_slow": sum(1 for _, s in outcomes if s),
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str, **options: Any) -> CircuitBreaker:
+    """Breaker con ese nombre (se crea con ``options`` la primera vez)"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _registry_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name, **options))
+    return breaker
+
+
+def breakers_report() -> Dict[str, Dict[str, Any]]:
+    return {name: breaker.snapshot() for name, breaker in list(_breakers.items())}
+
+
+def is_open(name: str) -> Optional[bool]:
+    breaker = _breakers.get(name)
+    return None if breaker is None else breaker.state == OPEN
@@ -0,0 +1,125 @@
+"""
+Compresión de respuestas negociada con ``Accept-Encoding``.
+
+Siempre hay gzip; zstd y brotli se ofrecen si los paquetes ``zstandard`` o
+``brotli`` están instalados. Solo se comprimen cuerpos JSON/texto enviados en
+un solo mensaje y de al menos ``COMPRESSION_MIN_BYTES``: las respuestas en
+streaming (NDJSON de los endpoints por lotes) y las que ya traen
+``Content-Encoding`` pasan sin tocar.
+"""
+import gzip
+import logging
+import os
+from typing import Callable, Dict, Optional
+from starlette.datastructures import Headers, MutableHeaders
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() != "false"
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+
+_COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def _gzip(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _available_codecs() -> Dict[str, Callable[[bytes], bytes]]:
+    """Codificaciones disponibles, en orden de preferencia del servidor"""
+    codecs: Dict[str, Callable[[bytes], bytes]] = {}
+    try:
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        codecs["zstd"] = compressor.compress
+    except ImportError:
+        pass
+    try:
+        import brotli
+        codecs["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+    except ImportError:
+        pass
+    codecs["gzip"] = _gzip
+    return codecs
+
+
+CODECS = _available_codecs()
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Codificación a usar según ``Accept-Encoding`` (None si ninguna sirve)"""
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for name in CODECS:
+        quality = accepted.get(name, wildcard)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+class CompressionMiddleware:
+    """Middleware ASGI que comprime las respuestas según lo que acepta el cliente"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = None
+        if scope["type"] == "http" and COMPRESSION_ENABLED:
+            encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def compress_send(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            content_type = headers.get("content-type", "")
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not content_type.startswith(_COMPRESSIBLE_TYPES)
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = CODECS[encoding](body)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, compress_send)
@@ -0,0 +1,142 @@
+"""
+Deadline por petición, propagado a todas las llamadas a Gemini y Firestore.
+
+``DeadlineMiddleware`` fija al inicio de cada petición un instante límite
+(header ``X-Request-Timeout`` en segundos, o el default de la ruta) en un
+contextvar. Las llamadas hacia afuera pasan por ``with_deadline`` /
+``run_sync``, que usan como timeout el presupuesto que queda; si se agota se
+lanza ``DeadlineExceeded`` y la app responde 504 en lugar de dejar la petición
+colgada ocupando un worker.
+
+Las llamadas síncronas del SDK de Firestore corren en un hilo: al vencer el
+plazo la petición se libera, aunque el hilo termine por su cuenta.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+REQUEST_TIMEOUT_HEADER = b"x-request-timeout"
+ROUTE_PREFIX = "/learning_path"
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+
+# Default por ruta (sin el prefijo del router). El header solo puede acortarlos.
+ROUTE_DEADLINES = {
+    "/documents": 60.0,
+    "/roadmaps": 90.0,
+    "/questions": 45.0,
+    "/related-topics": 30.0,
+    "/bundle": 90.0,
+    "/roadmaps/batch": 300.0,
+    "/related-topics/batch": 300.0,
+}
+
+# Rutas con parámetros en el path, por sufijo
+ROUTE_DEADLINE_SUFFIXES = {
+    "/export": float(os.getenv("EXPORT_DEADLINE_SECONDS", "1800")),
+}
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el tiempo de la petición antes de terminar una llamada"""
+
+    def __init__(self, operation: str = ""):
+        super().__init__(f"Deadline excedido en {operation}" if operation else "Deadline excedido")
+        self.operation = operation
+
+
+def route_deadline(path: str) -> float:
+    if path.startswith(ROUTE_PREFIX):
+        path = path[len(ROUTE_PREFIX):]
+    if path in ROUTE_DEADLINES:
+        return ROUTE_DEADLINES[path]
+    for suffix, seconds in ROUTE_DEADLINE_SUFFIXES.items():
+        if path.endswith(suffix):
+            return seconds
+    return REQUEST_DEADLINE_SECONDS
+
+
+def remaining() -> Optional[float]:
+    """Segundos que le quedan a la petición actual (None si no hay deadline)"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _budget(timeout: Optional[float]) -> Optional[float]:
+    left = remaining()
+    if left is None:
+        return timeout
+    return left if timeout is None else min(left, timeout)
+
+
+def detached_context(seconds: Optional[float] = None) -> contextvars.Context:
+    """
+    Copia del contexto actual sin el deadline de la petición, para tareas que
+    la sobreviven; con ``seconds``, la tarea tiene su propio deadline
+    """
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None if seconds is None else time.monotonic() + seconds)
+    return context
+
+
+async def with_deadline(awaitable: Awaitable[T], operation: str = "", timeout: Optional[float] = None) -> T:
+    """Espera ``awaitable`` como mucho lo que le queda a la petición (y ``timeout``)"""
+    budget = _budget(timeout)
+    if budget is None:
+        return await awaitable
+    if budget <= 0:
+        # Evita el warning de corrutina nunca esperada
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        metrics.increment("deadline.exceeded")
+        raise DeadlineExceeded(operation)
+    try:
+        return await asyncio.wait_for(awaitable, budget)
+    except asyncio.TimeoutError:
+        metrics.increment("deadline.exceeded")
+        logger.warning(f"⏱️ Deadline excedido en {operation or 'llamada'} ({budget:.2f}s)")
+        raise DeadlineExceeded(operation) from None
+
+
+async def run_sync(func: Callable[..., T], *args: Any, operation: str = "", timeout: Optional[float] = None, **kwargs: Any) -> T:
+    """Corre una función bloqueante en un hilo, respetando el deadline de la petición"""
+    return await with_deadline(asyncio.to_thread(func, *args, **kwargs), operation or func.__name__, timeout)
+
+
+class DeadlineMiddleware:
+    """Middleware ASGI que fija el deadline de cada petición HTTP"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        seconds = route_deadline(scope["path"])
+        for name, value in scope.get("headers", []):
+            if name == REQUEST_TIMEOUT_HEADER:
+                try:
+                    requested = float(value.decode("latin-1"))
+                except ValueError:
+                    break
+                if requested > 0:
+                    seconds = min(seconds, requested)
+                break
+
+        token = _deadline.set(time.monotonic() + seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
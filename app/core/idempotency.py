@@ -0,0 +1,311 @@
+"""
+Soporte de ``Idempotency-Key`` para los POST de ``/learning_path``.
+
+Los clientes móviles reintentan POSTs cuando la red falla; sin esto cada
+reintento cuesta una generación completa de Gemini y una conversación
+duplicada. Con el header ``Idempotency-Key``:
+
+- la primera petición con esa key ejecuta la ruta y su respuesta (status,
+  headers y cuerpo) se guarda por ``IDEMPOTENCY_TTL_SECONDS``;
+- los duplicados que llegan mientras la original sigue en curso la esperan
+  (en la misma instancia, por un future; en otra, consultando Firestore);
+- los duplicados posteriores reciben la respuesta guardada con el header
+  ``Idempotent-Replayed: true``;
+- reusar la key con otro cuerpo responde 422.
+
+La key se asocia al header Authorization y a la ruta, así que dos usuarios no
+pueden ver la respuesta del otro. Las respuestas 5xx no se guardan (el cliente
+puede reintentar). Con ``IDEMPOTENCY_STORE=firestore`` (por defecto) los
+registros viven en la colección ``idempotency_keys``; su campo ``expires_at``
+sirve para una política de TTL de Firestore.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from starlette.responses import JSONResponse
+from app.db.firestore_client import get_db, run_firestore, Collections
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = b"idempotent-replayed"
+IDEMPOTENCY_PATH_PREFIX = "/learning_path"
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "firestore").lower()
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# Una petición "en curso" más vieja que esto se considera abandonada
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "300"))
+# Cuánto espera un duplicado a que termine la original antes de responder 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120"))
+IDEMPOTENCY_POLL_SECONDS = 0.5
+# Respuestas más grandes no se guardan (límite de documento de Firestore)
+IDEMPOTENCY_MAX_BODY_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BODY_BYTES", "900000"))
+IDEMPOTENCY_LOCAL_SIZE = int(os.getenv("IDEMPOTENCY_LOCAL_SIZE", "5000"))
+MAX_KEY_LENGTH = 255
+
+# Headers de la respuesta original que se devuelven al repetirla
+_REPLAYED_HEADERS = {b"content-type", b"x-cache", b"x-roadmap-id", b"x-matched-topic", b"location"}
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+# Registros completados recientes (key -> registro)
+_local: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+# Peticiones originales en curso en esta instancia
+_inflight: Dict[str, "asyncio.Future"] = {}
+
+
+def _shared() -> bool:
+    return IDEMPOTENCY_STORE == "firestore"
+
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value
+    return None
+
+
+def _scoped_key(scope, key: bytes) -> str:
+    authorization = _header(scope, b"authorization") or b""
+    return hashlib.sha256(b"|".join([authorization, scope["path"].encode(), key])).hexdigest()
+
+
+def _fingerprint(scope, body: bytes) -> str:
+    return hashlib.sha256(scope["method"].encode() + scope["path"].encode() + b"|" + body).hexdigest()
+
+
+def _remember(key: str, record: Dict[str, Any]) -> None:
+    _local[key] = record
+    _local.move_to_end(key)
+    while len(_local) > IDEMPOTENCY_LOCAL_SIZE:
+        _local.popitem(last=False)
+
+
+def _doc(key: str):
+    return get_db().collection(Collections.IDEMPOTENCY_KEYS).document(key)
+
+
+async def _load(key: str) -> Optional[Dict[str, Any]]:
+    record = _local.get(key)
+    if record is not None:
+        if time.time() - record["created_at"] < IDEMPOTENCY_TTL_SECONDS:
+            return record
+        _local.pop(key, None)
+    if not _shared():
+        return None
+
+    snapshot = await run_firestore(_doc(key).get)
+    if not snapshot.exists:
+        return None
+    record = snapshot.to_dict()
+    if time.time() - record["created_at"] >= IDEMPOTENCY_TTL_SECONDS:
+        return None
+    if record["status"] == COMPLETED:
+        _remember(key, record)
+    return record
+
+
+def _is_abandoned(record: Dict[str, Any]) -> bool:
+    return record["status"] == IN_PROGRESS and time.time() - record["created_at"] >= IDEMPOTENCY_LOCK_SECONDS
+
+
+def _expires_at() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+
+
+async def _claim(key: str, fingerprint: str, previous: Optional[Dict[str, Any]]) -> bool:
+    """Marca la key como en curso; False si otra instancia se adelantó"""
+    if not _shared():
+        return True
+    from google.api_core.exceptions import AlreadyExists
+
+    data = {
+        "status": IN_PROGRESS,
+        "fingerprint": fingerprint,
+        "created_at": time.time(),
+        "expires_at": _expires_at(),
+    }
+    try:
+        if previous is None:
+            await run_firestore(_doc(key).create, data)
+        else:
+            # Registro abandonado (o vencido): se pisa
+            await run_firestore(_doc(key).set, data)
+    except AlreadyExists:
+        return False
+    return True
+
+
+async def _complete(key: str, fingerprint: str, response: Optional[Dict[str, Any]]) -> None:
+    """Guarda la respuesta, o libera la key si no se puede repetir (5xx, muy grande, error)"""
+    if response is None:
+        if _shared():
+            await run_firestore(_doc(key).delete)
+        return
+
+    record = {
+        "status": COMPLETED,
+        "fingerprint": fingerprint,
+        "created_at": time.time(),
+        "expires_at": _expires_at(),
+        "response": response,
+    }
+    _remember(key, record)
+    if _shared():
+        await run_firestore(_doc(key).set, record)
+
+
+async def _read_body(receive) -> bytes:
+    chunks: List[bytes] = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+async def _replay(record: Dict[str, Any], send) -> None:
+    response = record["response"]
+    headers = [(h["name"].encode("latin-1"), h["value"].encode("latin-1")) for h in response["headers"]]
+    headers.append((REPLAYED_HEADER, b"true"))
+    await send({"type": "http.response.start", "status": response["status_code"], "headers": headers})
+    await send({"type": "http.response.body", "body": bytes(response["body"])})
+
+
+class IdempotencyMiddleware:
+    """Middleware ASGI que aplica ``Idempotency-Key`` a los POST del servicio"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        raw_key = _header(scope, IDEMPOTENCY_HEADER) if scope["type"] == "http" else None
+        if (
+            raw_key is None
+            or scope["method"] != "POST"
+            or not scope["path"].startswith(IDEMPOTENCY_PATH_PREFIX)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        if not raw_key or len(raw_key) > MAX_KEY_LENGTH:
+            await JSONResponse(
+                {"detail": f"Idempotency-Key debe tener entre 1 y {MAX_KEY_LENGTH} caracteres"},
+                status_code=400
+            )(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        key = _scoped_key(scope, raw_key)
+        fingerprint = _fingerprint(scope, body)
+        give_up_at = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+
+        while True:
+            remaining = give_up_at - time.monotonic()
+            pending = _inflight.get(key)
+            if pending is not None:
+                # La original corre en esta instancia: esperarla sin cancelarla
+                try:
+                    await asyncio.wait_for(asyncio.shield(pending), max(remaining, 0))
+                except asyncio.TimeoutError:
+                    await self._conflict(scope, receive, send)
+                    return
+                continue
+
+            future = asyncio.get_running_loop().create_future()
+            _inflight[key] = future
+            try:
+                record = await _load(key)
+                claimed = (record is None or _is_abandoned(record)) and await _claim(key, fingerprint, record)
+            except Exception as e:
+                # Sin almacén no hay garantía, pero la petición se atiende igual
+                logger.warning(f"⚠️ Almacén de idempotencia no disponible, se procesa sin él: {e}")
+                self._release(key, future)
+                await self.app(scope, self._replay_receive(body, receive), send)
+                return
+
+            if claimed:
+                try:
+                    await self._run_and_store(scope, body, receive, send, key, fingerprint)
+                finally:
+                    self._release(key, future)
+                return
+
+            self._release(key, future)
+            if record is not None and record["fingerprint"] != fingerprint:
+                await JSONResponse(
+                    {"detail": "Idempotency-Key ya usada con otra petición"}, status_code=422
+                )(scope, receive, send)
+                return
+            if record is not None and record["status"] == COMPLETED:
+                logger.info("🔁 Respuesta repetida por Idempotency-Key", extra={"path": scope["path"]})
+                await _replay(record, send)
+                return
+            # En curso en otra instancia (o perdimos la carrera al crearla)
+            if remaining <= 0:
+                await self._conflict(scope, receive, send)
+                return
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+    @staticmethod
+    def _release(key: str, future: "asyncio.Future") -> None:
+        _inflight.pop(key, None)
+        if not future.done():
+            future.set_result(None)
+
+    @staticmethod
+    async def _conflict(scope, receive, send) -> None:
+        await JSONResponse(
+            {"detail": "La petición original con esta Idempotency-Key sigue en curso"}, status_code=409
+        )(scope, receive, send)
+
+    @staticmethod
+    def _replay_receive(body: bytes, receive):
+        sent = False
+
+        async def replay_receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replay_receive
+
+    async def _run_and_store(self, scope, body: bytes, receive, send, key: str, fingerprint: str) -> None:
+        captured: Dict[str, Any] = {"status_code": 500, "headers": [], "body": []}
+        size = 0
+
+        async def capture_send(message):
+            nonlocal size
+            if message["type"] == "http.response.start":
+                captured["status_code"] = message["status"]
+                captured["headers"] = [
+                    {"name": k.decode("latin-1"), "value": v.decode("latin-1")}
+                    for k, v in message.get("headers", []) if k.lower() in _REPLAYED_HEADERS
+                ]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size <= IDEMPOTENCY_MAX_BODY_BYTES:
+                    captured["body"].append(chunk)
+            await send(message)
+
+        response = None
+        try:
+            await self.app(scope, self._replay_receive(body, receive), capture_send)
+            if captured["status_code"] < 500 and size <= IDEMPOTENCY_MAX_BODY_BYTES:
+                response = {**captured, "body": b"".join(captured["body"])}
+        finally:
+            try:
+                await _complete(key, fingerprint, response)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo guardar la respuesta idempotente: {e}")
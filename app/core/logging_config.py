@@ -0,0 +1,211 @@
+"""
+Logging estructurado y no bloqueante.
+
+Los módulos registran con ``logging.getLogger(__name__)``; este módulo configura
+el logger raíz para que cada registro se encole (sin bloquear el event loop) y
+un hilo aparte lo escriba en stdout como una línea JSON con el request ID activo.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+from app.core import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Payloads (prompts, respuestas del modelo, documentos) solo se registran en DEBUG
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+# Los payloads más grandes que este umbral se registran solo en una fracción de llamadas
+LOG_PAYLOAD_SAMPLE_THRESHOLD = int(os.getenv("LOG_PAYLOAD_SAMPLE_THRESHOLD", "8000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.1"))
+
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_listener: Optional[QueueListener] = None
+
+# Atributos estándar de LogRecord; todo lo demás viene de ``extra=`` y va al JSON
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como una línea JSON compatible con Cloud Logging"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Adjunta el request ID del contexto actual al registro (en el hilo que loguea)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler que nunca bloquea: si la cola está llena descarta el registro
+    y lleva la cuenta en ``dropped``.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Igual que QueueHandler.prepare pero conservando los campos extra y el traceback aparte
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: str = LOG_LEVEL) -> None:
+    """
+    Configura el logger raíz con el handler en cola y arranca el hilo escritor.
+    Es idempotente: llamadas posteriores solo ajustan el nivel.
+    """
+    global _listener
+
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Vacía la cola y detiene el hilo escritor"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_payload(
+    logger: logging.Logger,
+    message: str,
+    payload: Any,
+    level: int = logging.DEBUG,
+    **fields: Any
+) -> None:
+    """
+    Registra un payload grande (prompt, respuesta del modelo, documento) sin
+    pagar su costo cuando el nivel está deshabilitado.
+
+    El texto se trunca a LOG_PAYLOAD_MAX_CHARS y los payloads mayores a
+    LOG_PAYLOAD_SAMPLE_THRESHOLD solo se registran con probabilidad
+    LOG_PAYLOAD_SAMPLE_RATE.
+    """
+    if not logger.isEnabledFor(level):
+        return
+
+    text = payload if isinstance(payload, str) else repr(payload)
+    size = len(text)
+    if size > LOG_PAYLOAD_SAMPLE_THRESHOLD and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+
+    logger.log(level, message, extra={
+        **fields,
+        "payload": text[:LOG_PAYLOAD_MAX_CHARS],
+        "payload_size": size,
+        "payload_truncated": size > LOG_PAYLOAD_MAX_CHARS,
+    })
+
+
+class RequestIdMiddleware:
+    """
+    Middleware ASGI que fija el request ID de cada petición (del header
+    X-Request-ID si viene, o uno nuevo) y lo devuelve en la respuesta.
+    También mide la duración de las peticiones autenticadas (las que pasaron
+    por ``get_current_user``), para comparar con el costo de autenticar.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == REQUEST_ID_HEADER.encode():
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.encode(), request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+            # request.state vive en scope["state"]
+            if "auth_ms" in scope.get("state", {}):
+                metrics.observe_latency("http.authenticated", (time.perf_counter() - start) * 1000)
@@ -0,0 +1,100 @@
+"""
+Métricas en memoria del proceso: contadores y latencias.
+
+Pensadas para observar componentes internos (publicador de Pub/Sub, etc.)
+sin dependencias externas. Son thread-safe porque varios clientes de Google
+completan sus futures en hilos propios. Se exponen en
+``GET /learning_path/internal/metrics``.
+"""
+import threading
+from collections import Counter, deque
+from typing import Deque, Dict, Optional
+
+# Cantidad de muestras recientes usadas para calcular percentiles
+LATENCY_WINDOW = 2048
+
+_lock = threading.Lock()
+_counters: Counter = Counter()
+_latencies: Dict[str, "LatencyRecorder"] = {}
+
+
+def _percentile(ordered, pct: float) -> Optional[float]:
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LatencyRecorder:
+    """Latencias (ms) de una operación: totales acumulados y percentiles de una ventana reciente"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        with self._lock:
+            self._samples.append(ms)
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            ordered = sorted(self._samples)
+        return _percentile(ordered, pct)
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            ordered = sorted(self._samples)
+            count, total, maximum = self.count, self.total_ms, self.max_ms
+
+        def rounded(value):
+            return None if value is None else round(value, 2)
+
+        return {
+            "count": count,
+            "mean_ms": rounded(total / count) if count else None,
+            "p50_ms": rounded(_percentile(ordered, 50)),
+            "p95_ms": rounded(_percentile(ordered, 95)),
+            "p99_ms": rounded(_percentile(ordered, 99)),
+            "max_ms": rounded(maximum) if count else None,
+        }
+
+
+def increment(name: str, amount: int = 1) -> None:
+    with _lock:
+        _counters[name] += amount
+
+
+def latency(name: str) -> LatencyRecorder:
+    """Recorder de latencias con ese nombre (se crea en el primer uso)"""
+    recorder = _latencies.get(name)
+    if recorder is None:
+        with _lock:
+            recorder = _latencies.setdefault(name, LatencyRecorder())
+    return recorder
+
+
+def observe_latency(name: str, ms: float) -> None:
+    latency(name).observe(ms)
+
+
+def snapshot() -> Dict[str, Dict]:
+    with _lock:
+        counters = dict(_counters)
+        recorders = dict(_latencies)
+    return {
+        "counters": counters,
+        "latencies": {name: recorder.snapshot() for name, recorder in recorders.items()},
+    }
+
+
+def reset() -> None:
+    """Vacía todas las métricas (útil entre corridas de benchmarks)"""
+    with _lock:
+        _counters.clear()
+        _latencies.clear()
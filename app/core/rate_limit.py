@@ -0,0 +1,39 @@
+"""
+Limitador de tasa asíncrono (token bucket) para trabajos en lote que llaman al modelo.
+"""
+import asyncio
+import time
+
+
+class AsyncRateLimiter:
+    """
+    Permite como máximo ``rate`` adquisiciones por segundo, con ráfagas de
+    hasta ``burst``. ``acquire`` espera sin bloquear el event loop.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
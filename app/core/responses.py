@@ -0,0 +1,95 @@
+"""
+Serialización JSON con orjson y respuestas condicionales (ETag / If-None-Match).
+
+Las rutas de lectura que consultan los servicios internos (``/roadmaps/user/...``)
+calculan un ETag a partir de los IDs y timestamps de los documentos: si el
+cliente ya tiene esa versión se responde 304 sin cuerpo, y si no, el cuerpo
+serializado se guarda por ETag para no volver a serializar la misma respuesta
+en el siguiente sondeo.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional
+import orjson
+from starlette.responses import Response
+from app.core import metrics
+
+ENCODED_CACHE_SIZE = int(os.getenv("ENCODED_CACHE_SIZE", "512"))
+# Los servicios internos pueden cachear, pero siempre revalidando con el ETag
+READ_CACHE_CONTROL = "private, no-cache"
+
+# ETag -> cuerpo ya serializado
+_encoded: "OrderedDict[str, bytes]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def dumps(content: Any) -> bytes:
+    """JSON compacto en UTF-8; lo que orjson no conoce (p. ej. timestamps de Firestore) va como str"""
+    return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+def loads(data) -> Any:
+    return orjson.loads(data)
+
+
+def json_response(body: bytes, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Respuesta con un cuerpo JSON ya serializado"""
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+def make_etag(*parts: Any) -> str:
+    """ETag débil: la misma versión de los datos puede viajar con distinto Content-Encoding"""
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode()).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+def documents_etag(scope: str, documents: Iterable[Dict[str, Any]]) -> str:
+    """ETag de una lista de documentos según sus IDs y timestamps (y la última edición)"""
+    return make_etag(
+        scope, *(f"{doc.get('_id')}@{doc.get('timestamp')}@{doc.get('updated_at')}" for doc in documents)
+    )
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil de If-None-Match (lista separada por comas o ``*``)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _encode_cached(etag: str, build: Callable[[], Any]) -> bytes:
+    with _lock:
+        body = _encoded.get(etag)
+        if body is not None:
+            _encoded.move_to_end(etag)
+            metrics.increment("responses.encoded_hit")
+            return body
+    body = dumps(build())
+    with _lock:
+        _encoded[etag] = body
+        while len(_encoded) > ENCODED_CACHE_SIZE:
+            _encoded.popitem(last=False)
+    return body
+
+
+def conditional_response(etag: str, if_none_match: Optional[str], build: Callable[[], Any]) -> Response:
+    """
+    304 si el cliente ya tiene ``etag``; si no, 200 con ``build()`` serializado
+    (reutilizando el cuerpo si esa versión ya se serializó antes)
+    """
+    headers = {"ETag": etag, "Cache-Control": READ_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        metrics.increment("responses.not_modified")
+        return Response(status_code=304, headers=headers)
+    return json_response(_encode_cached(etag, build), headers=headers)
@@ -1,34 +1,146 @@
+import hashlib
 import jwt
 import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
 from jwt import ExpiredSignatureError, InvalidTokenError
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from app.core import metrics, shared_cache
 
 security = HTTPBearer()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
+# Cuánto se reutiliza un token ya verificado (nunca más allá de su exp)
+JWT_CACHE_TTL_SECONDS = float(os.getenv("JWT_CACHE_TTL_SECONDS", "300"))
+# Tokens verificados que recuerda cada proceso (LRU), antes de ir al caché del nodo
+JWT_LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("JWT_LOCAL_CACHE_MAX_ENTRIES", "10000"))
+
+# hash del token -> (payload, vence en epoch)
+_verified: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+_verified_lock = threading.Lock()
+
+
+def _cached_payload(token_hash: str) -> Optional[Dict[str, Any]]:
+    now = time.time()
+    with _verified_lock:
+        entry = _verified.get(token_hash)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        if expires_at <= now:
+            del _verified[token_hash]
+            return None
+        _verified.move_to_end(token_hash)
+        return payload
+
+
+def _remember(token_hash: str, payload: Dict[str, Any], ttl: float) -> None:
+    if ttl <= 0:
+        return
+    with _verified_lock:
+        _verified[token_hash] = (payload, time.time() + ttl)
+        _verified.move_to_end(token_hash)
+        while len(_verified) > JWT_LOCAL_CACHE_MAX_ENTRIES:
+            _verified.popitem(last=False)
+
+
+def _cache_ttl(payload: Dict[str, Any]) -> float:
+    exp = payload.get("exp")
+    return JWT_CACHE_TTL_SECONDS if exp is None else min(JWT_CACHE_TTL_SECONDS, exp - time.time())
+
 
 def decode_access_token(token: str):
     """
     Decodifica un token JWT usando PyJWT (misma librería que lo creó).
+    El payload de un token ya verificado se reutiliza (por hash del token) hasta
+    ``JWT_CACHE_TTL_SECONDS`` y nunca más allá de su ``exp``: primero en la
+    memoria del proceso y, con varios workers, en ``shared_cache``.
+    Los tokens inválidos no se cachean.
     """
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    payload = _cached_payload(token_hash)
+    if payload is not None:
+        metrics.increment("auth.cache.local_hit")
+        return payload
+
+    cached = shared_cache.get_json("jwt", token_hash)
+    if cached is not None and cached.get("exp", float("inf")) > time.time():
+        metrics.increment("auth.cache.shared_hit")
+        _remember(token_hash, cached, _cache_ttl(cached))
+        return cached
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except ExpiredSignatureError:
+        metrics.increment("auth.rejected")
         raise HTTPException(status_code=401, detail="Token expirado")
     except InvalidTokenError:
+        metrics.increment("auth.rejected")
         raise HTTPException(status_code=403, detail="Token inválido")
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    metrics.increment("auth.cache.decode")
+    ttl = _cache_ttl(payload)
+    _remember(token_hash, payload, ttl)
+    shared_cache.set_json("jwt", token_hash, payload, ttl)
+    return payload
+
+
+async def get_current_user(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> dict:
     """
     Dependencia que valida el JWT y retorna los datos del usuario autenticado.
+    Se resuelve una vez por petición: queda en ``request.state.user`` para las
+    dependencias que vengan después, y su costo en ``request.state.auth_ms``.
+    Es async para no pasar por el threadpool en cada petición (la verificación
+    suele ser un acierto de caché en memoria).
     """
-    token = credentials.credentials
-    payload = decode_access_token(token)
-    user_id = payload.get("user_id")
-    email = payload.get("email")
-    if not user_id or not email:
-        raise HTTPException(status_code=403, detail="Token inválido")
-    return {"user_id": user_id, "email": email}
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
+
+    start = time.perf_counter()
+    try:
+        payload = decode_access_token(credentials.credentials)
+        user_id = payload.get("user_id")
+        email = payload.get("email")
+        if not user_id or not email:
+            metrics.increment("auth.rejected")
+            raise HTTPException(status_code=403, detail="Token inválido")
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        metrics.observe_latency("auth.verify", elapsed_ms)
+        request.state.auth_ms = elapsed_ms
+
+    request.state.user = {"user_id": user_id, "email": email}
+    return request.state.user
+
+
+def request_user(request: Request) -> Optional[dict]:
+    """Usuario ya autenticado en esta petición (None si la ruta no pidió autenticación)"""
+    return getattr(request.state, "user", None)
+
+
+def auth_report() -> Dict[str, Any]:
+    """
+    Costo de la autenticación: latencia de la verificación, de dónde salió el
+    payload y qué parte del tiempo total de las peticiones autenticadas se fue en ella
+    """
+    snapshot = metrics.snapshot()
+    counters = snapshot["counters"]
+    verify = metrics.latency("auth.verify")
+    requests = metrics.latency("http.authenticated")
+    return {
+        "verify": snapshot["latencies"].get("auth.verify"),
+        "local_hits": counters.get("auth.cache.local_hit", 0),
+        "shared_hits": counters.get("auth.cache.shared_hit", 0),
+        "decodes": counters.get("auth.cache.decode", 0),
+        "rejected": counters.get("auth.rejected", 0),
+        "local_cache_entries": len(_verified),
+        "share_of_request_time": round(verify.total_ms / requests.total_ms, 4) if requests.total_ms else None,
+    }
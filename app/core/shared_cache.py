@@ -0,0 +1,168 @@
+"""
+Caché compartido entre los workers de un mismo nodo.
+
+Con varios workers (``app.serve``), cada proceso tiene su propia memoria: sin
+un nivel común, una sesión creada en un worker no existe en otro y cada uno
+vuelve a leer de Firestore las mismas respuestas cacheadas. Este módulo es un
+key-value con TTL sobre SQLite en ``/dev/shm`` (memoria compartida, sin disco)
+que todos los workers del nodo leen y escriben; lo usan las sesiones, el caché
+de temas y la verificación de JWT.
+
+Es best-effort: cualquier error se registra y se trata como miss, nunca se
+propaga a la petición. Se activa con ``SHARED_CACHE_ENABLED=true`` (``app.serve``
+lo activa cuando hay más de un worker). Las entradas vencidas se limpian de a
+poco en las escrituras y el total se acota a ``SHARED_CACHE_MAX_ENTRIES``.
+"""
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Optional
+from app.core import metrics, responses
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(_DEFAULT_DIR, "learning_path_cache.sqlite3"))
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "100000"))
+# Espera máxima por el lock de escritura de SQLite antes de darlo por miss
+SHARED_CACHE_BUSY_TIMEOUT_MS = int(os.getenv("SHARED_CACHE_BUSY_TIMEOUT_MS", "50"))
+# Probabilidad de limpiar entradas vencidas en cada escritura
+_PRUNE_PROBABILITY = 0.001
+
+_local = threading.local()
+
+
+def is_enabled() -> bool:
+    return os.getenv("SHARED_CACHE_ENABLED", "false").lower() == "true"
+
+
+def _connect() -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        SHARED_CACHE_PATH,
+        timeout=SHARED_CACHE_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False
+    )
+    connection.execute("PRAGMA journal_mode=WAL")
+    # Está en memoria: no hace falta sobrevivir a un corte de luz
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS entries ("
+        " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at)")
+    return connection
+
+
+def _connection() -> sqlite3.Connection:
+    # Una conexión por hilo y por proceso (los workers no heredan conexiones)
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        _local.connection = _connect()
+        _local.pid = pid
+    return _local.connection
+
+
+def _key(namespace: str, key: str) -> str:
+    return f"{namespace}:{key}"
+
+
+def get(namespace: str, key: str) -> Optional[bytes]:
+    """Valor vigente o None (también si el caché está desactivado o falla)"""
+    if not is_enabled():
+        return None
+    try:
+        row = _connection().execute(
+            "SELECT value FROM entries WHERE key = ? AND expires_at > ?",
+            (_key(namespace, key), time.time())
+        ).fetchone()
+    except sqlite3.Error as e:
+        metrics.increment("shared_cache.errors")
+        logger.warning(f"⚠️ Error leyendo caché compartido ({namespace}): {e}")
+        return None
+    metrics.increment(f"shared_cache.{namespace}.{'hit' if row else 'miss'}")
+    return row[0] if row else None
+
+
+def set(namespace: str, key: str, value: bytes, ttl: float) -> None:
+    if not is_enabled() or ttl <= 0:
+        return
+    try:
+        connection = _connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+            (_key(namespace, key), value, time.time() + ttl)
+        )
+        if random.random() < _PRUNE_PROBABILITY:
+            prune(connection)
+    except sqlite3.Error as e:
+        metrics.increment("shared_cache.errors")
+        logger.warning(f"⚠️ Error escribiendo caché compartido ({namespace}): {e}")
+
+
+def add(namespace: str, key: str, value: bytes, ttl: float) -> bytes:
+    """
+    Guarda ``value`` solo si no hay un valor vigente; retorna el que quedó.
+    Sirve para que dos workers que crean lo mismo a la vez (p. ej. una sesión)
+    terminen usando el mismo valor.
+    """
+    if not is_enabled():
+        return value
+    full_key = _key(namespace, key)
+    now = time.time()
+    try:
+        connection = _connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT value FROM entries WHERE key = ? AND expires_at > ?", (full_key, now)
+            ).fetchone()
+            if row is None:
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+                    (full_key, value, now + ttl)
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        metrics.increment("shared_cache.errors")
+        logger.warning(f"⚠️ Error escribiendo caché compartido ({namespace}): {e}")
+        return value
+    return row[0] if row is not None else value
+
+
+def delete(namespace: str, key: str) -> None:
+    if not is_enabled():
+        return
+    try:
+        _connection().execute("DELETE FROM entries WHERE key = ?", (_key(namespace, key),))
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ Error borrando del caché compartido ({namespace}): {e}")
+
+
+def get_json(namespace: str, key: str) -> Optional[Any]:
+    value = get(namespace, key)
+    return None if value is None else responses.loads(value)
+
+
+def set_json(namespace: str, key: str, value: Any, ttl: float) -> None:
+    set(namespace, key, responses.dumps(value), ttl)
+
+
+def prune(connection: Optional[sqlite3.Connection] = None) -> int:
+    """Borra las entradas vencidas y, si sobran, las que vencen antes"""
+    connection = connection or _connection()
+    removed = connection.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),)).rowcount
+    count = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    if count > SHARED_CACHE_MAX_ENTRIES:
+        removed += connection.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires_at LIMIT ?)",
+            (count - SHARED_CACHE_MAX_ENTRIES,)
+        ).rowcount
+    return removed
@@ -0,0 +1,59 @@
+"""
+Warm-up de arranque y estado de readiness.
+
+Los clientes pesados (Firestore, Vertex AI) se construyen de forma perezosa.
+Al arrancar, ``warm_up`` los inicializa en paralelo en hilos aparte, sin
+bloquear al servidor: ``/health`` responde de inmediato y ``/ready`` recién
+cuando el warm-up terminó.
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_warmups: List[Tuple[str, Callable[[], object]]] = []
+_status: Dict[str, str] = {}
+_finished = False
+_started_at = time.monotonic()
+_ready_after: float = 0.0
+
+
+def register_warmup(name: str, func: Callable[[], object]) -> None:
+    """Registra una inicialización síncrona que se corre en el warm-up"""
+    _warmups.append((name, func))
+    _status[name] = "pending"
+
+
+async def _run(name: str, func: Callable[[], object]) -> None:
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(func)
+        _status[name] = "ok"
+        logger.info(f"🔥 Warm-up de {name} listo en {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        # Un componente caído no impide servir: se reintentará en el primer uso
+        _status[name] = f"error: {e}"
+        logger.warning(f"⚠️ Warm-up de {name} falló: {e}")
+
+
+async def warm_up() -> None:
+    """Corre todos los warm-ups registrados en paralelo y marca el arranque como terminado"""
+    global _finished, _ready_after
+    await asyncio.gather(*(_run(name, func) for name, func in _warmups))
+    _ready_after = time.monotonic() - _started_at
+    _finished = True
+
+
+def is_ready() -> bool:
+    """Listo cuando terminó el warm-up y todos los componentes quedaron OK"""
+    return _finished and all(status == "ok" for status in _status.values())
+
+
+def readiness_report() -> Dict[str, object]:
+    return {
+        "status": "ready" if is_ready() else ("degraded" if _finished else "starting"),
+        "components": dict(_status),
+        "warmup_s": round(_ready_after, 3) if _finished else None,
+    }
@@ -0,0 +1,160 @@
+"""
+Captura opcional de la forma del tráfico real para reproducirlo offline.
+
+Con TRAFFIC_CAPTURE_PATH definido, cada petición a la API agrega una línea
+NDJSON con la ruta, un hash del tema (nunca el texto ni el email), el tamaño
+del archivo, las llamadas al modelo (latencia y tamaños) y el tamaño de la
+respuesta. La escritura va por una cola a un hilo aparte, igual que los logs.
+
+``benchmarks/replay.py`` reproduce estos archivos contra la app.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueListener
+from typing import List, Optional
+from app.core.logging_config import NonBlockingQueueHandler
+
+CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
+# Sin salt, los hashes de temas comunes se revierten con un diccionario: si no
+# se define, cada captura usa uno aleatorio (los hashes no se comparan entre capturas)
+CAPTURE_SALT = os.getenv("TRAFFIC_CAPTURE_SALT", "")
+CAPTURE_PATH_PREFIX = "/learning_path"
+
+_model_calls: ContextVar[Optional[List[dict]]] = ContextVar("traffic_capture_model_calls", default=None)
+
+logger = logging.getLogger(__name__)
+
+_capture_logger = logging.getLogger("traffic_capture")
+_capture_logger.propagate = False
+_listener: Optional[QueueListener] = None
+
+
+def is_enabled() -> bool:
+    return bool(CAPTURE_PATH)
+
+
+def anonymize_topic(topic: str) -> str:
+    """Hash estable del tema normalizado: repeticiones del mismo tema comparten hash"""
+    normalized = " ".join(topic.lower().split())
+    return hashlib.sha256(f"{CAPTURE_SALT}{normalized}".encode()).hexdigest()[:16]
+
+
+def record_model_call(model: str, latency: float, prompt_chars: int, response_chars: int) -> None:
+    """Registra una llamada al modelo en la petición actual (no-op si no se captura)"""
+    calls = _model_calls.get()
+    if calls is not None:
+        calls.append({
+            "model": model,
+            "latency_ms": round(latency * 1000, 1),
+            "prompt_chars": prompt_chars,
+            "response_chars": response_chars,
+        })
+
+
+def _start_writer() -> None:
+    global _listener, CAPTURE_SALT
+    if _listener is not None:
+        return
+    if not CAPTURE_SALT:
+        CAPTURE_SALT = secrets.token_hex(16)
+        logger.warning(
+            "⚠️ TRAFFIC_CAPTURE_SALT no definido: se generó un salt aleatorio para esta captura "
+            "(con varios workers, definirlo para que el mismo tema tenga el mismo hash en todos)"
+        )
+    file_handler = logging.FileHandler(CAPTURE_PATH, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    capture_queue: queue.Queue = queue.Queue(maxsize=10000)
+    _capture_logger.addHandler(NonBlockingQueueHandler(capture_queue))
+    _capture_logger.setLevel(logging.INFO)
+    _listener = QueueListener(capture_queue, file_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def _request_shape(body: bytes) -> dict:
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    shape = {}
+    topic = data.get("topic")
+    if isinstance(topic, str):
+        shape["topic_hash"] = anonymize_topic(topic)
+        shape["topic_chars"] = len(topic)
+    topics = data.get("topics")
+    if isinstance(topics, list):
+        shape["topic_hashes"] = [anonymize_topic(t) for t in topics if isinstance(t, str)]
+    file_content = data.get("fileBase64")
+    if isinstance(file_content, str):
+        shape["file_bytes"] = len(file_content) * 3 // 4
+    return shape
+
+
+class TrafficCaptureMiddleware:
+    """Middleware ASGI que arma y encola el registro de cada petición"""
+
+    def __init__(self, app):
+        self.app = app
+        _start_writer()
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not scope["path"].startswith(CAPTURE_PATH_PREFIX)
+            or random.random() >= CAPTURE_SAMPLE_RATE
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        body_chunks: List[bytes] = []
+        status = {"code": 500}
+        response_bytes = 0
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                body_chunks.append(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            nonlocal response_bytes
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        calls: List[dict] = []
+        token = _model_calls.set(calls)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            _model_calls.reset(token)
+            # Plantilla de la ruta (sin emails ni IDs); los routers incluidos no traen el prefijo
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            if not route.startswith(CAPTURE_PATH_PREFIX):
+                route = CAPTURE_PATH_PREFIX + route
+            record = {
+                "ts": round(time.time(), 3),
+                "method": scope["method"],
+                "route": route,
+                "status": status["code"],
+                "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                "response_bytes": response_bytes,
+                "model_calls": calls,
+                **_request_shape(b"".join(body_chunks)),
+            }
+            _capture_logger.info(json.dumps(record))
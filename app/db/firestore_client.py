@@ -1,75 +1,97 @@
 """
 Módulo de conexión a Google Cloud Firestore
 Reemplaza la conexión anterior de MongoDB
+
+El SDK de Firebase se importa y el cliente se construye recién en el primer
+``get_db()`` (o en el warm-up de arranque), no al importar el módulo.
 """
+import logging
 import os
+import threading
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, firestore
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Callable, Optional, TypeVar
+from app.core.circuit_breaker import CircuitBreaker, get_breaker
+from app.core.deadline import DeadlineExceeded, run_sync
+
+if TYPE_CHECKING:
+    from google.cloud import firestore
 
 # Cargar variables de entorno
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Variables de configuración
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "leroi-474015")
 CREDENTIALS_PATH = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "./keys/service-account.json")
 IS_PRODUCTION = os.getenv("NODE_ENV") == "production" or os.getenv("K_SERVICE") is not None
+# Una operación de Firestore más lenta que esto cuenta como lenta para el circuit breaker
+FIRESTORE_BREAKER_SLOW_SECONDS = float(os.getenv("FIRESTORE_BREAKER_SLOW_SECONDS", "5"))
+
+T = TypeVar("T")
 
 # Cliente de Firestore (singleton)
-_db: Optional[firestore.Client] = None
+_db: Optional["firestore.Client"] = None
+_init_lock = threading.Lock()
 
 
-def initialize_firestore() -> firestore.Client:
+def initialize_firestore() -> "firestore.Client":
     """
     Inicializa la conexión a Firestore usando el service account en desarrollo
     o Application Default Credentials en producción (Cloud Run)
-    Solo se ejecuta una vez (patrón singleton)
+    Solo se ejecuta una vez (patrón singleton), aunque la llamen varios hilos a la vez
     """
     global _db
-    
+
     if _db is not None:
         return _db
-    
-    try:
-        # Verificar si ya está inicializado
-        if not firebase_admin._apps:
-            if IS_PRODUCTION:
-                # En producción (Cloud Run), usar Application Default Credentials
-                firebase_admin.initialize_app(options={
-                    'projectId': PROJECT_ID,
-                })
-                print(f"✅ Firebase Admin SDK inicializado para proyecto: {PROJECT_ID} (Production - ADC)")
-            else:
-                # En desarrollo, usar archivo JSON de credenciales
-                if not os.path.exists(CREDENTIALS_PATH):
-                    raise FileNotFoundError(
-                        f"❌ Archivo de credenciales no encontrado en: {CREDENTIALS_PATH}\n"
-                        f"   Asegúrate de colocar service-account.json en la carpeta /keys/"
-                    )
-                
-                cred = credentials.Certificate(CREDENTIALS_PATH)
-                firebase_admin.initialize_app(cred, {
-                    'projectId': PROJECT_ID,
-                })
-                print(f"✅ Firebase Admin SDK inicializado para proyecto: {PROJECT_ID} (Development)")
-        
-        # Crear cliente de Firestore
-        _db = firestore.client()
-        print(f"✅ Conexión a Firestore exitosa - Proyecto: {PROJECT_ID}")
-        
-        return _db
-        
-    except Exception as e:
-        print(f"❌ Error al conectar a Firestore: {e}")
-        raise
 
+    with _init_lock:
+        if _db is not None:
+            return _db
+
+        try:
+            import firebase_admin
+            from firebase_admin import credentials, firestore as admin_firestore
+
+            # Verificar si ya está inicializado
+            if not firebase_admin._apps:
+                if IS_PRODUCTION:
+                    # En producción (Cloud Run), usar Application Default Credentials
+                    firebase_admin.initialize_app(options={
+                        'projectId': PROJECT_ID,
+                    })
+                    logger.info(f"✅ Firebase Admin SDK inicializado para proyecto: {PROJECT_ID} (Production - ADC)")
+                else:
+                    # En desarrollo, usar archivo JSON de credenciales
+                    if not os.path.exists(CREDENTIALS_PATH):
+                        raise FileNotFoundError(
+                            f"❌ Archivo de credenciales no encontrado en: {CREDENTIALS_PATH}\n"
+                            f"   Asegúrate de colocar service-account.json en la carpeta /keys/"
+                        )
+
+                    cred = credentials.Certificate(CREDENTIALS_PATH)
+                    firebase_admin.initialize_app(cred, {
+                        'projectId': PROJECT_ID,
+                    })
+                    logger.info(f"✅ Firebase Admin SDK inicializado para proyecto: {PROJECT_ID} (Development)")
+
+            # Crear cliente de Firestore
+            _db = admin_firestore.client()
+            logger.info(f"✅ Conexión a Firestore exitosa - Proyecto: {PROJECT_ID}")
+
+            return _db
 
-def get_db() -> firestore.Client:
+        except Exception as e:
+            logger.error(f"❌ Error al conectar a Firestore: {e}")
+            raise
+
+
+def get_db() -> "firestore.Client":
     """
     Obtiene el cliente de Firestore
     Si no está inicializado, lo inicializa
-    
+
     Returns:
         firestore.Client: Cliente de Firestore
     """
@@ -78,17 +100,37 @@ def get_db() -> firestore.Client:
     return _db
 
 
+def firestore_breaker() -> CircuitBreaker:
+    """
+    Circuit breaker compartido por todas las operaciones de Firestore.
+    Los errores propios de la petición (NotFound, AlreadyExists, precondiciones,
+    argumentos inválidos) y el deadline agotado no cuentan como fallas de
+    Firestore; la cuota agotada (ResourceExhausted, 429) sí.
+    """
+    from google.api_core.exceptions import AlreadyExists, FailedPrecondition, InvalidArgument, NotFound
+    return get_breaker(
+        "firestore",
+        slow_call_seconds=FIRESTORE_BREAKER_SLOW_SECONDS,
+        ignore=(NotFound, AlreadyExists, FailedPrecondition, InvalidArgument, DeadlineExceeded)
+    )
+
+
+async def run_firestore(func: Callable[..., T], *args: Any, operation: str = "", timeout: Optional[float] = None, **kwargs: Any) -> T:
+    """``run_sync`` a través del circuit breaker de Firestore (falla rápido si está abierto)"""
+    return await firestore_breaker().call(run_sync, func, *args, operation=operation, timeout=timeout, **kwargs)
+
+
 # Colecciones disponibles en esta base de datos
 class Collections:
     """Nombres de las colecciones en Firestore para learning path"""
     CONVERSATIONS = "conversations"
+    CONVERSATION_ARCHIVES = "conversation_archives"
     USER_SESSIONS = "user_sessions"
     ROADMAPS = "roadmaps"
     LEARNING_LOGS = "learning_logs"
-
-
-# Inicializar automáticamente al importar el módulo
-try:
-    initialize_firestore()
-except Exception as e:
-    print(f"⚠️  Advertencia: No se pudo inicializar Firestore al importar: {e}")
+    TOPIC_CACHE = "topic_cache"
+    QUESTION_BANKS = "question_banks"
+    QUESTION_HISTORY = "question_history"
+    IDEMPOTENCY_KEYS = "idempotency_keys"
+    MODEL_USAGE = "model_usage"
+    GENERATION_JOBS = "generation_jobs"
@@ -2,12 +2,19 @@
 Módulo de cliente de base de datos
 Migrado de MongoDB a Firestore
 """
+import logging
 from app.db.firestore_client import get_db, Collections
 
-# Cliente principal
-db = get_db()
+logger = logging.getLogger(__name__)
 
 # Para mantener compatibilidad con código existente que usa "db"
-# Ahora db es un cliente de Firestore en lugar de MongoDB
+# Ahora db es un cliente de Firestore en lugar de MongoDB.
+# Se resuelve en el primer acceso a ``mongo_client.db`` y no al importar el módulo.
 
-print(f"🔌 FIRESTORE configurado - Cliente disponible: {type(db)}")
+
+def __getattr__(name: str):
+    if name == "db":
+        client = get_db()
+        logger.debug(f"🔌 FIRESTORE configurado - Cliente disponible: {type(client)}")
+        return client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
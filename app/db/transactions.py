@@ -3,13 +3,41 @@ ACID Transactions Module for Firestore
 Provides atomic operations and rollback capabilities for database operations
 """
 from typing import Callable, Any, Dict, List
-from google.cloud import firestore
 from app.db.firestore_client import get_db
+from app.core import deadline
+from app.core.circuit_breaker import CircuitOpenError
+import asyncio
+import functools
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+
+class WriteConflict(Exception):
+    """A 'last_update_time' precondition failed: the document changed since it was read"""
+
+
+def needs_read(operation: Dict[str, Any]) -> bool:
+    """Updates verify the document exists, unless they carry an update-time precondition"""
+    return operation.get('type') == 'update' and operation.get('last_update_time') is None
+
+
+def is_transient(error: Exception) -> bool:
+    """Firestore errors worth retrying: contention and momentary server failures"""
+    from google.api_core.exceptions import Aborted, InternalServerError, ServiceUnavailable
+
+    return isinstance(error, (Aborted, InternalServerError, ServiceUnavailable))
+
+
+def allocate_id(collection: str) -> str:
+    """
+    Pre-allocate a document ID client-side (no round trip), so related documents
+    can reference each other before the single commit that creates them
+    """
+    return get_db().collection(collection).document().id
+
+
 class FirestoreTransaction:
     """
     Wrapper class for Firestore transactions with ACID guarantees
@@ -35,6 +63,7 @@ class FirestoreTransaction:
             Exception if any operation fails (triggers automatic rollback)
         """
         results = {}
+        snapshots = self._read_phase(transaction, operations)
         
         for idx, operation in enumerate(operations):
             op_type = operation.get('type')
@@ -56,7 +85,7 @@ class FirestoreTransaction:
                         'doc_id': doc_ref.id,
                         'type': 'create'
                     }
-                    logger.info(f"✅ Transaction create: {collection}/{doc_ref.id}")
+                    logger.debug(f"✅ Transaction create: {collection}/{doc_ref.id}")
                 
                 elif op_type == 'update':
                     # Update existing document
@@ -64,19 +93,32 @@ class FirestoreTransaction:
                         raise ValueError("doc_id required for update operation")
                     
                     doc_ref = self.db.collection(collection).document(doc_id)
+                    last_update_time = operation.get('last_update_time')
                     
-                    # Verify document exists before update
-                    snapshot = doc_ref.get(transaction=transaction)
-                    if not snapshot.exists:
-                        raise ValueError(f"Document {collection}/{doc_id} does not exist")
-                    
-                    transaction.update(doc_ref, data)
+                    if last_update_time is not None:
+                        # Firestore rejects the commit if the document changed (or is gone)
+                        transaction.update(doc_ref, data, option=self.db.write_option(last_update_time=last_update_time))
+                    else:
+                        # Verify document exists before update (read in the batched read phase)
+                        snapshot = snapshots.get(doc_ref.path)
+                        if snapshot is None or not snapshot.exists:
+                            if operation.get('if_exists'):
+                                # Optional companion update: a missing document is not an error
+                                results[f'operation_{idx}'] = {
+                                    'status': 'skipped',
+                                    'doc_id': doc_id,
+                                    'type': 'update'
+                                }
+                                logger.debug(f"⏭️ Transaction update skipped, missing: {collection}/{doc_id}")
+                                continue
+                            raise ValueError(f"Document {collection}/{doc_id} does not exist")
+                        transaction.update(doc_ref, data)
                     results[f'operation_{idx}'] = {
                         'status': 'success',
                         'doc_id': doc_id,
                         'type': 'update'
                     }
-                    logger.info(f"✅ Transaction update: {collection}/{doc_id}")
+                    logger.debug(f"✅ Transaction update: {collection}/{doc_id}")
                 
                 elif op_type == 'delete':
                     # Delete document
@@ -90,7 +132,7 @@ class FirestoreTransaction:
                         'doc_id': doc_id,
                         'type': 'delete'
                     }
-                    logger.info(f"✅ Transaction delete: {collection}/{doc_id}")
+                    logger.debug(f"✅ Transaction delete: {collection}/{doc_id}")
                 
                 else:
                     raise ValueError(f"Unknown operation type: {op_type}")
@@ -101,10 +143,46 @@ class FirestoreTransaction:
         
         return results
     
+    def _read_phase(self, transaction, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Fetch every document the operations need to check in a single get_all
+        inside the transaction: one read round trip however many updates there are
+        """
+        refs = {}
+        for operation in operations:
+            if needs_read(operation):
+                if not operation.get('doc_id'):
+                    raise ValueError("doc_id required for update operation")
+                doc_ref = self.db.collection(operation.get('collection')).document(operation['doc_id'])
+                refs[doc_ref.path] = doc_ref
+        if not refs:
+            return {}
+        
+        logger.debug(f"📖 Transaction read phase: {len(refs)} documents")
+        return {snapshot.reference.path: snapshot for snapshot in transaction.get_all(list(refs.values()))}
+    
+    def _execute_blind(self, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Nothing to read (creates, deletes and updates with an update-time
+        precondition), so a single atomic batch commit (one round trip)
+        replaces begin + commit of a transaction
+        """
+        batch = self.db.batch()
+        results = self._execute_transaction_logic(batch, operations)
+        batch.commit()
+        logger.info(f"✅ Atomic batch completed successfully: {len(operations)} operations")
+        return {
+            'success': True,
+            'operations': results,
+            'total_operations': len(operations)
+        }
+
     def execute(self, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
         Execute multiple Firestore operations atomically
         All operations succeed or all fail (ACID guarantee)
+        Updates are existence-checked with one batched read; with nothing to read
+        (see needs_read) it commits a batch instead of a transaction
         
         Args:
             operations: List of operation dictionaries with format:
@@ -112,7 +190,9 @@ class FirestoreTransaction:
                     'type': 'create' | 'update' | 'delete',
                     'collection': 'collection_name',
                     'data': {...},  # For create/update
-                    'doc_id': 'doc_id'  # Optional for create, required for update/delete
+                    'doc_id': 'doc_id',  # Optional for create, required for update/delete
+                    'last_update_time': ts,  # Optional for update: precondition instead of a read
+                    'if_exists': True  # Optional for update: skip it if the document is missing
                 }
         
         Returns:
@@ -135,7 +215,12 @@ class FirestoreTransaction:
             >>> result = tx.execute(operations)
         """
         try:
-            logger.info(f"🔄 Starting transaction with {len(operations)} operations")
+            if not any(needs_read(op) for op in operations):
+                return self._execute_blind(operations)
+
+            from google.cloud import firestore  # Lazy: the SDK is heavy and only needed here
+
+            logger.debug(f"🔄 Starting transaction with {len(operations)} operations")
             
             # Create a transactional function
             @firestore.transactional
@@ -154,10 +239,19 @@ class FirestoreTransaction:
             }
             
         except Exception as e:
-            logger.error(f"❌ Transaction failed and rolled back: {e}")
+            from google.api_core.exceptions import FailedPrecondition
+
+            conflict = isinstance(e, FailedPrecondition)
+            if conflict:
+                # Expected under concurrent edits: the caller decides (e.g. 409)
+                logger.warning(f"⚠️ Transaction precondition failed, nothing written: {e}")
+            else:
+                logger.error(f"❌ Transaction failed and rolled back: {e}")
             return {
                 'success': False,
                 'error': str(e),
+                'exception': e,
+                'conflict': conflict,
                 'message': 'All operations rolled back due to failure'
             }
 
@@ -183,7 +277,7 @@ class BatchWriter:
         
         self.batch.set(doc_ref, data)
         self.operations_count += 1
-        logger.info(f"📝 Batch create queued: {collection}/{doc_ref.id}")
+        logger.debug(f"📝 Batch create queued: {collection}/{doc_ref.id}")
         return doc_ref.id
     
     def add_update(self, collection: str, doc_id: str, data: Dict[str, Any]):
@@ -191,14 +285,21 @@ class BatchWriter:
         doc_ref = self.db.collection(collection).document(doc_id)
         self.batch.update(doc_ref, data)
         self.operations_count += 1
-        logger.info(f"📝 Batch update queued: {collection}/{doc_id}")
+        logger.debug(f"📝 Batch update queued: {collection}/{doc_id}")
+    
+    def add_upsert(self, collection: str, doc_id: str, data: Dict[str, Any]):
+        """Add a merge write (creates the document if missing; supports Increment)"""
+        doc_ref = self.db.collection(collection).document(doc_id)
+        self.batch.set(doc_ref, data, merge=True)
+        self.operations_count += 1
+        logger.debug(f"📝 Batch upsert queued: {collection}/{doc_id}")
     
     def add_delete(self, collection: str, doc_id: str):
         """Add a delete operation to the batch"""
         doc_ref = self.db.collection(collection).document(doc_id)
         self.batch.delete(doc_ref)
         self.operations_count += 1
-        logger.info(f"📝 Batch delete queued: {collection}/{doc_id}")
+        logger.debug(f"📝 Batch delete queued: {collection}/{doc_id}")
     
     def commit(self) -> Dict[str, Any]:
         """
@@ -206,7 +307,7 @@ class BatchWriter:
         All operations succeed or all fail
         """
         try:
-            logger.info(f"🔄 Committing batch with {self.operations_count} operations")
+            logger.debug(f"🔄 Committing batch with {self.operations_count} operations")
             self.batch.commit()
             logger.info(f"✅ Batch committed successfully: {self.operations_count} operations")
             
@@ -223,33 +324,68 @@ class BatchWriter:
             }
 
 
-def with_retry(max_attempts: int = 3, backoff_multiplier: float = 2.0):
+def with_retry(
+    max_attempts: int = 3,
+    backoff_multiplier: float = 2.0,
+    initial_delay: float = 1.0,
+    no_retry: tuple = (deadline.DeadlineExceeded, CircuitOpenError),
+    retry_if: Callable[[Exception], bool] = None
+):
     """
     Decorator for automatic retry with exponential backoff
-    Useful for handling transient failures
+    Useful for handling transient failures. Works on both sync and async functions
+    (async ones wait with asyncio.sleep, without blocking the event loop)
     
     Args:
         max_attempts: Maximum number of retry attempts
         backoff_multiplier: Multiplier for exponential backoff delay
+        initial_delay: Delay in seconds before the first retry
+        no_retry: Exceptions raised immediately (an exhausted deadline or an
+            open circuit won't get better by retrying)
+        retry_if: If given, only errors it accepts are retried (e.g. is_transient);
+            anything else is raised immediately
     """
     import time
-    
+
+    def next_delay(attempt: int, delay: float, error: Exception) -> float:
+        """Raise if there's no retry left; otherwise log and return the delay"""
+        if isinstance(error, no_retry) or (retry_if is not None and not retry_if(error)):
+            raise error
+        if attempt >= max_attempts:
+            logger.error(f"❌ Max retry attempts ({max_attempts}) reached: {error}")
+            raise error
+        left = deadline.remaining()
+        if left is not None and left <= delay:
+            logger.error(f"❌ No time left in the request deadline to retry: {error}")
+            raise error
+        logger.warning(f"⚠️  Attempt {attempt} failed, retrying in {delay}s: {error}")
+        return delay
+
     def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                attempt = 0
+                delay = initial_delay
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        attempt += 1
+                        await asyncio.sleep(next_delay(attempt, delay, e))
+                        delay *= backoff_multiplier
+            return async_wrapper
+
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
             attempt = 0
-            delay = 1  # Initial delay in seconds
-            
-            while attempt < max_attempts:
+            delay = initial_delay
+            while True:
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
                     attempt += 1
-                    if attempt >= max_attempts:
-                        logger.error(f"❌ Max retry attempts ({max_attempts}) reached: {e}")
-                        raise
-                    
-                    logger.warning(f"⚠️  Attempt {attempt} failed, retrying in {delay}s: {e}")
-                    time.sleep(delay)
+                    time.sleep(next_delay(attempt, delay, e))
                     delay *= backoff_multiplier
             
         return wrapper
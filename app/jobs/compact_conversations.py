@@ -0,0 +1,176 @@
+"""
+Job de retención: compacta las conversaciones viejas en archivos comprimidos.
+
+Recorre ``conversations`` con timestamp anterior a ``--older-than-days`` (por
+páginas, con cursores), agrupa por usuario y mes, y guarda cada grupo como
+bloques NDJSON comprimidos con gzip en el sink elegido (ver
+``archive_services``). Cada bloque deja un documento de índice en
+``conversation_archives`` y se borran sus originales en el mismo batch de
+escritura, así un bloque queda archivado y borrado o no se toca.
+
+Pensado para correr como Cloud Run Job / cron fuera del horario pico:
+    python -m app.jobs.compact_conversations --older-than-days 180 --sink firestore
+"""
+import argparse
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.logging_config import setup_logging
+from app.db.firestore_client import get_db, Collections
+from app.db.transactions import BatchWriter
+from app.services import archive_services
+
+logger = logging.getLogger(__name__)
+
+GroupKey = Tuple[str, str]
+
+
+def _month(timestamp: Any) -> str:
+    return timestamp.strftime("%Y-%m") if hasattr(timestamp, "strftime") else "unknown"
+
+
+def iter_old_conversations(cutoff: datetime, page_size: int):
+    """Páginas de conversaciones con timestamp < cutoff, de la más vieja a la más nueva"""
+    base = (get_db().collection(Collections.CONVERSATIONS)
+            .where("timestamp", "<", cutoff)
+            .order_by("timestamp")
+            .limit(page_size))
+    cursor = None
+    while True:
+        query = base if cursor is None else base.start_after(cursor)
+        page = list(query.stream())
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        cursor = page[-1]
+
+
+def archive_bundle(
+    sink: archive_services.ArchiveSink,
+    user_email: str,
+    month: str,
+    records: List[Dict[str, Any]],
+    dry_run: bool = False
+) -> int:
+    """Guarda un bloque y borra sus originales; retorna los bytes comprimidos"""
+    ids = [record["_id"] for record in records]
+    data = archive_services.encode_bundle(records)
+    if dry_run:
+        return len(data)
+
+    bundle_id = archive_services.archive_id(user_email, month, ids)
+    location = sink.write(bundle_id, user_email, month, data)
+    timestamps = [record["timestamp"] for record in records if record.get("timestamp") is not None]
+
+    writer = BatchWriter()
+    writer.add_upsert(Collections.CONVERSATION_ARCHIVES, bundle_id, {
+        "user": user_email,
+        "month": month,
+        "count": len(records),
+        "conversation_ids": ids,
+        "routes": sorted({record.get("route") or "" for record in records}),
+        "first_timestamp": min(timestamps) if timestamps else None,
+        "last_timestamp": max(timestamps) if timestamps else None,
+        "sink": sink.name,
+        "bytes": len(data),
+        "archived_at": datetime.utcnow(),
+        **location,
+    })
+    for conversation_id in ids:
+        writer.add_delete(Collections.CONVERSATIONS, conversation_id)
+    result = writer.commit()
+    if not result["success"]:
+        raise Exception(f"Batch failed: {result.get('error')}")
+    return len(data)
+
+
+def flush_groups(
+    groups: Dict[GroupKey, List[Dict[str, Any]]],
+    sink: archive_services.ArchiveSink,
+    summary: Counter,
+    dry_run: bool = False
+) -> None:
+    for (user_email, month), records in groups.items():
+        for bundle in archive_services.split_bundles(records):
+            try:
+                summary["bytes"] += archive_bundle(sink, user_email, month, bundle, dry_run)
+                summary["archived"] += len(bundle)
+                summary["bundles"] += 1
+            except Exception as e:
+                summary["failed"] += len(bundle)
+                logger.error(f"❌ No se pudo archivar {len(bundle)} conversaciones de {month}: {e}")
+    groups.clear()
+
+
+def run(
+    older_than_days: int = 180,
+    sink: str = "firestore",
+    archive_dir: Optional[str] = None,
+    page_size: int = 1000,
+    buffer_limit: int = 20000,
+    dry_run: bool = False
+) -> Dict[str, int]:
+    """
+    Args:
+        older_than_days: Se archivan las conversaciones más viejas que esto
+        sink: "firestore" (bloque dentro del índice) o "local" (archivos en archive_dir)
+        page_size: Conversaciones por lectura
+        buffer_limit: Conversaciones en memoria como máximo antes de escribir los grupos
+        dry_run: Solo reporta cuánto se archivaría (sin escribir ni borrar)
+    """
+    started = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    options = {"directory": archive_dir} if sink == archive_services.LocalFileArchiveSink.name and archive_dir else {}
+    archive_sink = archive_services.get_sink(sink, **options)
+    logger.info(f"🗜️ Compactando conversaciones anteriores a {cutoff:%Y-%m-%d} (sink: {archive_sink.name})")
+
+    summary: Counter = Counter()
+    groups: Dict[GroupKey, List[Dict[str, Any]]] = defaultdict(list)
+    buffered = 0
+    for page in iter_old_conversations(cutoff, page_size):
+        for doc in page:
+            record = doc.to_dict() or {}
+            record["_id"] = doc.id
+            groups[(record.get("user") or "", _month(record.get("timestamp")))].append(record)
+        summary["scanned"] += len(page)
+        buffered += len(page)
+        if buffered >= buffer_limit:
+            flush_groups(groups, archive_sink, summary, dry_run)
+            buffered = 0
+    flush_groups(groups, archive_sink, summary, dry_run)
+
+    summary = dict(summary)
+    logger.info(
+        f"✅ Compactación terminada en {time.perf_counter() - started:.1f}s",
+        extra={"summary": summary, "dry_run": dry_run}
+    )
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-days", type=int, default=180)
+    parser.add_argument("--sink", choices=sorted(archive_services.SINKS), default="firestore")
+    parser.add_argument("--archive-dir", help=f"Directorio del sink local (default {archive_services.ARCHIVE_DIR})")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--buffer-limit", type=int, default=20000,
+                        help="Conversaciones en memoria como máximo antes de escribir")
+    parser.add_argument("--dry-run", action="store_true", help="Solo reporta qué se archivaría")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    return run(
+        older_than_days=args.older_than_days,
+        sink=args.sink,
+        archive_dir=args.archive_dir,
+        page_size=args.page_size,
+        buffer_limit=args.buffer_limit,
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    main()
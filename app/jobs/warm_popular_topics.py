@@ -0,0 +1,193 @@
+"""
+Job de pre-generación para los temas más pedidos.
+
+Mina la colección ``conversations`` para encontrar los N temas más frecuentes
+de los últimos días y genera (o refresca, si la entrada es vieja) su roadmap y
+temas relacionados en el caché compartido de ``cache_services``, y rellena su
+banco de preguntas de ``question_bank_services`` si tiene pocas, con
+concurrencia acotada y límite de llamadas por segundo al modelo.
+
+Pensado para correr como Cloud Run Job / cron antes del pico de tráfico:
+    python -m app.jobs.warm_popular_topics --top-n 300 --concurrency 8 --rate 2
+"""
+import argparse
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from app.core.logging_config import setup_logging
+from app.core.rate_limit import AsyncRateLimiter
+from app.db.firestore_client import get_db, Collections
+from app.schemas.requests import TopicRequest
+from app.services import cache_services, question_bank_services
+from app.services.learning_path_services import (
+    generate_roadmap_logic,
+    related_topics_logic
+)
+
+logger = logging.getLogger(__name__)
+
+JOB_USER = "system:warm_popular_topics"
+
+# Prefijos de los prompts que learning_path_routes guarda en cada conversación
+PROMPT_PREFIXES = {
+    "/roadmaps": "Generar roadmap del tema: ",
+    "/related-topics": "Buscar temas relacionados con: ",
+    "/questions": "Generar preguntas del tema: ",
+}
+
+GENERATORS = {
+    cache_services.ROADMAP: lambda request: generate_roadmap_logic(request, JOB_USER),
+    cache_services.RELATED_TOPICS: related_topics_logic,
+}
+QUESTIONS = "questions"
+KINDS = [*GENERATORS, QUESTIONS]
+
+
+def extract_topic(route: str, prompt: str) -> Optional[str]:
+    prefix = PROMPT_PREFIXES.get(route)
+    if not prefix or not prompt or not prompt.startswith(prefix):
+        return None
+    topic = prompt[len(prefix):].strip()
+    return topic or None
+
+
+def mine_popular_topics(top_n: int, lookback_days: int) -> List[Tuple[str, int]]:
+    """
+    Cuenta temas por frecuencia en las conversaciones recientes.
+    Solo trae los campos ``route`` y ``prompt`` de cada documento.
+    Retorna [(tema, frecuencia)] usando la grafía más común de cada tema.
+    """
+    since = datetime.utcnow() - timedelta(days=lookback_days)
+    query = (get_db().collection(Collections.CONVERSATIONS)
+             .where("timestamp", ">=", since)
+             .select(["route", "prompt"]))
+
+    counts: Counter = Counter()
+    spellings: Dict[str, Counter] = defaultdict(Counter)
+    scanned = 0
+    for doc in query.stream():
+        scanned += 1
+        data = doc.to_dict() or {}
+        topic = extract_topic(data.get("route"), data.get("prompt"))
+        if topic is None:
+            continue
+        normalized = cache_services.normalize_topic(topic)
+        counts[normalized] += 1
+        spellings[normalized][topic] += 1
+
+    logger.info(f"📊 Conversaciones analizadas: {scanned}, temas distintos: {len(counts)}")
+    return [
+        (spellings[normalized].most_common(1)[0][0], count)
+        for normalized, count in counts.most_common(top_n)
+    ]
+
+
+async def warm_topic(
+    kind: str,
+    topic: str,
+    refresh_after: float,
+    limiter: AsyncRateLimiter,
+    semaphore: asyncio.Semaphore,
+    dry_run: bool = False
+) -> str:
+    """Genera o refresca una entrada; retorna 'fresh', 'generated', 'skipped' o 'failed'"""
+    if kind == QUESTIONS:
+        return await warm_question_bank(topic, limiter, semaphore, dry_run)
+
+    entry = await cache_services.get_entry(kind, topic)
+    if entry is not None and time.time() - entry["generated_at"] < refresh_after:
+        return "fresh"
+    if dry_run:
+        return "skipped"
+
+    async with semaphore:
+        await limiter.acquire()
+        try:
+            payload = await GENERATORS[kind](TopicRequest(topic=topic))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo pre-generar {kind} para '{topic}': {e}")
+            return "failed"
+    await cache_services.store(kind, topic, payload, source="warm_popular_topics")
+    return "generated"
+
+
+async def warm_question_bank(
+    topic: str,
+    limiter: AsyncRateLimiter,
+    semaphore: asyncio.Semaphore,
+    dry_run: bool = False
+) -> str:
+    """Rellena el banco de preguntas del tema si tiene menos del mínimo"""
+    if dry_run:
+        return "skipped"
+    async with semaphore:
+        await limiter.acquire()
+        try:
+            generated = await question_bank_services.ensure_bank(topic)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo rellenar el banco de preguntas de '{topic}': {e}")
+            return "failed"
+    return "generated" if generated else "fresh"
+
+
+async def run(
+    top_n: int = 300,
+    lookback_days: int = 14,
+    concurrency: int = 8,
+    rate: float = 2.0,
+    kinds: Optional[List[str]] = None,
+    refresh_after_hours: float = 24.0,
+    dry_run: bool = False
+) -> Dict[str, int]:
+    kinds = kinds or KINDS
+    started = time.perf_counter()
+
+    topics = await asyncio.to_thread(mine_popular_topics, top_n, lookback_days)
+    logger.info(f"🔥 Pre-generando {len(topics)} temas populares ({', '.join(kinds)})")
+
+    limiter = AsyncRateLimiter(rate, burst=max(1, int(rate)))
+    semaphore = asyncio.Semaphore(concurrency)
+    refresh_after = refresh_after_hours * 3600
+
+    results = await asyncio.gather(*(
+        warm_topic(kind, topic, refresh_after, limiter, semaphore, dry_run)
+        for topic, _ in topics
+        for kind in kinds
+    ))
+    summary = dict(Counter(results))
+    logger.info(
+        f"✅ Pre-generación terminada en {time.perf_counter() - started:.1f}s",
+        extra={"summary": summary, "topics": len(topics)}
+    )
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-n", type=int, default=300)
+    parser.add_argument("--lookback-days", type=int, default=14)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=2.0, help="Generaciones por segundo como máximo")
+    parser.add_argument("--kinds", nargs="*", choices=KINDS)
+    parser.add_argument("--refresh-after-hours", type=float, default=24.0,
+                        help="Regenerar entradas más viejas que esto")
+    parser.add_argument("--dry-run", action="store_true", help="Solo reporta qué se generaría")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    return asyncio.run(run(
+        top_n=args.top_n,
+        lookback_days=args.lookback_days,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        kinds=args.kinds,
+        refresh_after_hours=args.refresh_after_hours,
+        dry_run=args.dry_run,
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,110 @@
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import math
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.api import learning_path_routes
+from app.core.logging_config import setup_logging, RequestIdMiddleware
+from app.core import startup, traffic_capture
+from app.core.idempotency import IdempotencyMiddleware
+from app.core.compression import CompressionMiddleware
+from app.core.circuit_breaker import CircuitOpenError
+from app.core.deadline import DeadlineExceeded, DeadlineMiddleware
+from app.db.firestore_client import initialize_firestore
+from app.services.ai_services import init_vertex
+from app.services import cache_services, job_services, pubsub_services, usage_services
 import os
 import uvicorn 
 
-app = FastAPI(title="Learning path Service", version="1.0")
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Clientes pesados: se inicializan en paralelo después de arrancar
+startup.register_warmup("firestore", initialize_firestore)
+startup.register_warmup("vertex_ai", init_vertex)
+startup.register_warmup("pubsub_outbox", pubsub_services.replay_outbox)
+startup.register_warmup("topic_index", cache_services.load_topic_index)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup_task = asyncio.create_task(startup.warm_up())
+    usage_task = asyncio.create_task(usage_services.run_flush_loop())
+    yield
+    if not warmup_task.done():
+        warmup_task.cancel()
+    usage_task.cancel()
+    # Los jobs que no alcanzan a terminar quedan como failed para reenviarlos
+    await job_services.shutdown()
+    try:
+        await asyncio.to_thread(usage_services.flush_usage)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo guardar el uso de Gemini al apagar: {e}")
+    await asyncio.to_thread(pubsub_services.shutdown_publisher)
+
+
+app = FastAPI(title="Learning path Service", version="1.0", lifespan=lifespan)
 
 ALLOWED_ORIGINS = ["http://localhost:5173","http://localhost:3000","http://localhost:3001","https://leroi-front-next.vercel.app"]
 
-# CORS
+# Captura de tráfico opcional (TRAFFIC_CAPTURE_PATH) para benchmarks/replay.py
+if traffic_capture.is_enabled():
+    app.add_middleware(traffic_capture.TrafficCaptureMiddleware)
+
+# Deadline por petición (X-Request-Timeout o default de la ruta) para Gemini y Firestore
+app.add_middleware(DeadlineMiddleware)
+
+# Idempotency-Key en los POST: los reintentos no vuelven a generar ni a guardar
+app.add_middleware(IdempotencyMiddleware)
+
+# Compresión gzip/br/zstd (por fuera de idempotencia: también comprime las respuestas repetidas)
+app.add_middleware(CompressionMiddleware)
+
+# CORS por fuera de idempotencia y compresión: las respuestas repetidas y los
+# errores de Idempotency-Key también llevan Access-Control-Allow-Origin
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "X-Cache", "Idempotent-Replayed", "ETag", "X-Roadmap-ID", "X-Matched-Topic", "Location"],
 )
 
+# Request ID para los logs estructurados (el más externo, se agrega al final)
+app.add_middleware(RequestIdMiddleware)
+
 app.include_router(learning_path_routes.router, prefix="/learning_path", tags=["learning_path"])
 
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    return JSONResponse({"detail": "La petición excedió su tiempo límite", "operation": exc.operation}, status_code=504)
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request, exc: CircuitOpenError):
+    # Sin respuesta cacheada que servir: se avisa cuándo vale la pena reintentar
+    return JSONResponse(
+        {"detail": "Servicio temporalmente no disponible", "dependency": exc.name},
+        status_code=503,
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    )
+
+
 @app.get("/health")
 def health():
+    """Liveness: el proceso responde (no verifica dependencias)"""
     return {"status": "healthy"}
 
+
+@app.get("/ready")
+def ready():
+    """Readiness: los clientes de Firestore y Vertex AI ya están inicializados"""
+    report = startup.readiness_report()
+    return JSONResponse(report, status_code=200 if startup.is_ready() else 503)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080)) 
     uvicorn.run(app, host="0.0.0.0", port=port)
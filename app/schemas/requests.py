@@ -1,4 +1,8 @@
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+
+MAX_BATCH_TOPICS = 50
+MAX_QUESTIONS_PER_REQUEST = 20
 
 class ProcessFileRequest(BaseModel):
     fileName: str
@@ -6,3 +10,25 @@ class ProcessFileRequest(BaseModel):
 
 class TopicRequest(BaseModel):
     topic: str
+    # Sin exact, un tema casi igual ya generado se sirve en su lugar (header X-Matched-Topic)
+    exact: bool = False
+
+class QuestionsRequest(TopicRequest):
+    node: Optional[str] = None
+    count: int = Field(5, ge=1, le=MAX_QUESTIONS_PER_REQUEST)
+
+class RoadmapNodeRequest(BaseModel):
+    node: str = Field(..., min_length=1)
+    mode: Literal["regenerate", "enrich"] = "regenerate"
+    instruction: Optional[str] = Field(None, max_length=500)
+
+class TopicBatchRequest(BaseModel):
+    topics: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_TOPICS)
+
+# callback_url (solo http/https): al terminar el job se le envía el estado final por POST.
+# El destino se valida en job_services.validate_callback_url (hosts públicos o permitidos)
+class RoadmapJobRequest(TopicRequest):
+    callback_url: Optional[str] = Field(None, max_length=2048, pattern=r"^https?://")
+
+class DocumentsJobRequest(ProcessFileRequest):
+    callback_url: Optional[str] = Field(None, max_length=2048, pattern=r"^https?://")
@@ -0,0 +1,67 @@
+"""
+Servidor de producción con varios workers.
+
+Levanta ``WEB_CONCURRENCY`` procesos de uvicorn (por defecto uno por core)
+que comparten el socket. Cada worker se recicla tras ``WORKER_MAX_REQUESTS``
+peticiones (más un jitter aleatorio, para que no se reinicien todos juntos):
+termina las peticiones en curso durante hasta ``GRACEFUL_TIMEOUT_SECONDS`` y
+el supervisor levanta uno nuevo (``kill -HUP`` al proceso principal recicla
+todos). Con más de un worker se activa el caché compartido del nodo
+(``app.core.shared_cache``); con uno solo no hay reciclado.
+
+    python -m app.serve --workers 4
+"""
+import argparse
+import logging
+import os
+import uvicorn
+from app.core.logging_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+WORKER_MAX_REQUESTS = int(os.getenv("WORKER_MAX_REQUESTS", "10000"))
+WORKER_MAX_REQUESTS_JITTER = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "1000"))
+GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "30"))
+KEEP_ALIVE_SECONDS = int(os.getenv("KEEP_ALIVE_SECONDS", "5"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app.main:app", help="Aplicación ASGI (módulo:atributo)")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--max-requests", type=int, default=WORKER_MAX_REQUESTS,
+                        help="Peticiones por worker antes de reciclarlo (0 = nunca)")
+    parser.add_argument("--max-requests-jitter", type=int, default=WORKER_MAX_REQUESTS_JITTER)
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_TIMEOUT_SECONDS)
+    args = parser.parse_args(argv)
+
+    if args.workers > 1:
+        # Los workers heredan el entorno: todos usan el mismo caché del nodo
+        os.environ.setdefault("SHARED_CACHE_ENABLED", "true")
+    else:
+        # Con un solo worker no hay supervisor que lo vuelva a levantar
+        args.max_requests = 0
+
+    setup_logging()
+    logger.info(
+        f"🚀 Sirviendo {args.app} en {args.host}:{args.port} con {args.workers} workers "
+        f"(reciclado cada {args.max_requests or '∞'} peticiones)"
+    )
+    uvicorn.run(
+        args.app,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        limit_max_requests=args.max_requests or None,
+        limit_max_requests_jitter=args.max_requests_jitter if args.max_requests else 0,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=KEEP_ALIVE_SECONDS,
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
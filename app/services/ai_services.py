@@ -15,25 +15,288 @@ async def ask_gemini(prompt: str):
     return response.text
 """
 
-from vertexai.preview.generative_models import GenerativeModel
-import vertexai
+import asyncio
+import json
+import logging
 import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional
+from app.core import metrics
+from app.core.circuit_breaker import CircuitBreaker, get_breaker
+from app.core.deadline import DeadlineExceeded, with_deadline, remaining as deadline_remaining
+from app.core.logging_config import log_payload
+from app.core.traffic_capture import record_model_call
+from app.services import usage_services
+
+logger = logging.getLogger(__name__)
 
 API_KEY = os.getenv("GOOGLE_API_KEY")
 PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 
-vertexai.init(api_key=API_KEY, project=PROJECT_ID, location=LOCATION)
+# Cadena de modelos por tarea: el primero es el primario, los siguientes se usan
+# como hedge (si el primario tarda más que su p95) o como fallback si falla
+MODEL_CHAINS: Dict[str, List[str]] = json.loads(os.getenv("MODEL_CHAINS", "null")) or {
+    "documents": ["gemini-2.5-flash-lite", "gemini-2.5-flash"],
+    "roadmap": ["gemini-2.5-flash", "gemini-2.5-flash-lite"],
+    "roadmap_details": ["gemini-2.5-flash", "gemini-2.5-flash-lite"],
+    "roadmap_node": ["gemini-2.5-flash", "gemini-2.5-flash-lite"],
+    "questions": ["gemini-2.5-flash", "gemini-2.5-flash-lite"],
+    "related_topics": ["gemini-2.5-flash", "gemini-2.5-flash-lite"],
+    "default": ["gemini-2.5-flash", "gemini-2.5-flash-lite"],
+}
+# Tope por llamada, aunque la petición no tenga deadline (jobs, tareas de fondo)
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "120"))
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "true").lower() != "false"
+# Muestras de latencia del primario necesarias antes de hacer hedge
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.5"))
+# Fracción máxima de peticiones recientes con hedge (tope al gasto extra)
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))
+# Una llamada más lenta que esto cuenta como lenta para el circuit breaker del modelo
+VERTEX_BREAKER_SLOW_SECONDS = float(os.getenv("VERTEX_BREAKER_SLOW_SECONDS", "60"))
 
-async def ask_gemini(prompt: str, model: str = "gemini-2.5-flash"):
-    model_instance = GenerativeModel(model)
-    response = model_instance.generate_content(
-        [prompt],
-        generation_config={
-            "temperature": 0.3,
-            "max_output_tokens": 10000,
-            "response_mime_type": "application/json"
-        }
+# El SDK de Vertex tarda segundos en importarse: se carga e inicializa en el
+# warm-up de arranque o en la primera llamada, no al importar este módulo
+_vertex_lock = threading.Lock()
+_vertex_initialized = False
+_models = {}
+# tarea -> si las peticiones recientes hicieron hedge (1) o no (0)
+_recent_hedges: Dict[str, Deque[int]] = defaultdict(lambda: deque(maxlen=200))
+
+
+def init_vertex() -> None:
+    """Importa e inicializa Vertex AI una sola vez (thread-safe)"""
+    global _vertex_initialized
+    if _vertex_initialized:
+        return
+    with _vertex_lock:
+        if _vertex_initialized:
+            return
+        import vertexai
+        vertexai.init(api_key=API_KEY, project=PROJECT_ID, location=LOCATION)
+        _vertex_initialized = True
+        logger.info(f"✅ Vertex AI inicializado - Proyecto: {PROJECT_ID} ({LOCATION})")
+
+
+def get_model(model: str):
+    """Instancia de GenerativeModel reutilizada entre llamadas"""
+    instance = _models.get(model)
+    if instance is None:
+        init_vertex()
+        from vertexai.preview.generative_models import GenerativeModel
+        instance = _models.setdefault(model, GenerativeModel(model))
+    return instance
+
+
+def _usage(response):
+    """(tokens de prompt, tokens de salida incluyendo thinking, ¿se cortó por tope?)"""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = (getattr(usage, "candidates_token_count", 0) or 0) + (getattr(usage, "thoughts_token_count", 0) or 0)
+    candidates = getattr(response, "candidates", None) or []
+    finish_reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+    truncated = getattr(finish_reason, "name", str(finish_reason)) == "MAX_TOKENS"
+    return prompt_tokens, output_tokens, truncated
+
+
+async def _generate(prompt: str, model: str, task: str) -> str:
+    """Una llamada a un modelo con el perfil de la tarea, registrando uso y latencia"""
+    model_instance = get_model(model)
+    profile = usage_services.get_profile(task)
+    max_tokens = usage_services.max_output_tokens(task)
+
+    while True:
+        start = time.perf_counter()
+        try:
+            response = await with_deadline(
+                model_instance.generate_content_async(
+                    [prompt],
+                    generation_config={
+                        "temperature": profile["temperature"],
+                        "max_output_tokens": max_tokens,
+                        "response_mime_type": "application/json"
+                    }
+                ),
+                operation=f"gemini {model} ({task})",
+                timeout=GEMINI_TIMEOUT_SECONDS
+            )
+        except asyncio.CancelledError:
+            # Perdió contra un hedge: su latencia es al menos esto, y sin la
+            # muestra el p95 del modelo quedaría sesgado hacia abajo
+            metrics.observe_latency(f"gemini.{task}.{model}", (time.perf_counter() - start) * 1000)
+            raise
+        latency = time.perf_counter() - start
+        prompt_tokens, output_tokens, truncated = _usage(response)
+        usage_services.record_usage(task, model, prompt_tokens, output_tokens, latency, truncated)
+        metrics.observe_latency(f"gemini.{task}.{model}", latency * 1000)
+        if not truncated or max_tokens >= profile["max_output_tokens"]:
+            break
+        # El tope adaptativo quedó corto para esta respuesta: reintentar con el del perfil
+        logger.warning(f"⚠️ Respuesta de {task} cortada en {max_tokens} tokens, reintentando con {profile['max_output_tokens']}")
+        max_tokens = profile["max_output_tokens"]
+
+    text = strip_fences(response.text)
+    record_model_call(model, latency, len(prompt), len(text))
+    log_payload(logger, "Respuesta de Gemini", text, model=model, task=task, output_tokens=output_tokens)
+    if not _is_valid(text):
+        metrics.increment(f"gemini.{task}.{model}.invalid")
+        raise InvalidModelOutput(f"Respuesta inválida de {model} para {task}")
+    return text
+
+
+class InvalidModelOutput(ValueError):
+    """
+    El modelo respondió, pero no con JSON válido. La cadena prueba el siguiente
+    modelo, pero no cuenta como caída de Vertex para el circuit breaker
+    """
+
+
+_FENCE = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+
+
+def strip_fences(text: str) -> str:
+    """Quita el bloque ```json ... ``` que a veces envuelve la respuesta"""
+    text = text.strip()
+    match = _FENCE.match(text)
+    return match.group(1) if match else text
+
+
+def _is_valid(text: str) -> bool:
+    """Se pidió response_mime_type JSON: una respuesta que no parsea no sirve"""
+    try:
+        json.loads(text)
+    except ValueError:
+        return False
+    return True
+
+
+def vertex_breaker(model: str) -> CircuitBreaker:
+    """
+    Circuit breaker de un modelo: con el circuito abierto la cadena pasa
+    directo al siguiente modelo, y si están todos abiertos ask_gemini falla
+    con CircuitOpenError sin esperar a Vertex
+    """
+    return get_breaker(
+        f"vertex.{model}",
+        slow_call_seconds=VERTEX_BREAKER_SLOW_SECONDS,
+        ignore=(DeadlineExceeded, InvalidModelOutput)
     )
-    print("ESTA ES LA RESPUESTAAAAA", response)
-    return response.text.strip()
+
+
+def model_chain(task: str, model: Optional[str] = None) -> List[str]:
+    """Modelos a usar para la tarea, en orden; ``model`` fuerza el primario"""
+    chain = MODEL_CHAINS.get(task, MODEL_CHAINS["default"])
+    if model is None:
+        return list(chain)
+    return [model] + [m for m in chain if m != model]
+
+
+def hedge_delay(task: str, model: str) -> Optional[float]:
+    """
+    Segundos a esperar a ``model`` antes de lanzar el hedge: su p95 observado.
+    None si todavía no hay muestras suficientes o ya se usó el presupuesto de hedges.
+    """
+    if not HEDGING_ENABLED:
+        return None
+    recent = _recent_hedges[task]
+    if len(recent) >= HEDGE_MIN_SAMPLES and sum(recent) / len(recent) >= HEDGE_MAX_RATE:
+        return None
+    recorder = metrics.latency(f"gemini.{task}.{model}")
+    if recorder.count < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY_SECONDS, recorder.percentile(95) / 1000)
+
+
+async def ask_gemini(prompt: str, model: Optional[str] = None, task: str = "default"):
+    """
+    Llama a Gemini con el perfil de generación de ``task`` (ver usage_services)
+    usando la cadena de modelos de la tarea:
+
+    - si el modelo en curso (el primario, o al que se pasó tras una falla) no
+      respondió en su p95 observado, se lanza la misma petición al siguiente
+      modelo de la cadena (hedge) y gana la primera respuesta válida; la otra
+      se cancela;
+    - si un modelo falla o tiene el circuito abierto, se pasa al siguiente.
+    """
+    chain = model_chain(task, model)
+    metrics.increment(f"gemini.{task}.requests")
+
+    running: Dict["asyncio.Task", str] = {}
+    started: Dict["asyncio.Task", float] = {}
+    next_model = 0
+    hedged = False
+    last_error: Optional[BaseException] = None
+
+    def launch() -> None:
+        nonlocal next_model
+        current = chain[next_model]
+        call = asyncio.create_task(vertex_breaker(current).call(_generate, prompt, current, task))
+        running[call] = current
+        started[call] = time.monotonic()
+        next_model += 1
+
+    launch()
+    try:
+        while running:
+            timeout = None
+            # El modelo que está corriendo (el primario, o al que se pasó tras una
+            # falla): el hedge se mide con su p95 desde que arrancó
+            current_call = next(iter(running))
+            if not hedged and next_model < len(chain):
+                delay = hedge_delay(task, running[current_call])
+                if delay is not None:
+                    timeout = max(0.0, delay - (time.monotonic() - started[current_call]))
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                # El modelo en curso va lento: hedge con el siguiente
+                hedged = True
+                metrics.increment(f"gemini.{task}.hedges")
+                logger.info(f"🏁 Hedge de {task}: {running[current_call]} superó su p95, lanzando {chain[next_model]}")
+                launch()
+                continue
+
+            for task_done in done:
+                used_model = running.pop(task_done)
+                started.pop(task_done, None)
+                if task_done.exception() is None:
+                    if used_model != chain[0]:
+                        metrics.increment(f"gemini.{task}.{'hedge_wins' if hedged else 'fallbacks'}")
+                    return task_done.result()
+                last_error = task_done.exception()
+                logger.warning(f"⚠️ {used_model} falló para {task}: {last_error}")
+                left = deadline_remaining()
+                if isinstance(last_error, DeadlineExceeded) and left is not None and left <= 0:
+                    # Se acabó el tiempo de la petición: no tiene sentido probar otro modelo
+                    raise last_error
+
+            if not running and next_model < len(chain):
+                launch()
+    finally:
+        _recent_hedges[task].append(int(hedged))
+        for pending in running:
+            pending.cancel()
+
+    raise last_error
+
+
+def routing_report() -> Dict[str, Any]:
+    """Tasa de hedge y de victorias del hedge por tarea"""
+    counters = metrics.snapshot()["counters"]
+    report = {}
+    for task in MODEL_CHAINS:
+        requests = counters.get(f"gemini.{task}.requests", 0)
+        hedges = counters.get(f"gemini.{task}.hedges", 0)
+        wins = counters.get(f"gemini.{task}.hedge_wins", 0)
+        report[task] = {
+            "chain": MODEL_CHAINS[task],
+            "requests": requests,
+            "hedge_rate": round(hedges / requests, 4) if requests else None,
+            "hedge_win_rate": round(wins / hedges, 4) if hedges else None,
+            "fallbacks": counters.get(f"gemini.{task}.fallbacks", 0),
+        }
+    return report
@@ -0,0 +1,158 @@
+"""
+Archivo de conversaciones compactadas.
+
+El job ``app.jobs.compact_conversations`` agrupa las conversaciones viejas por
+usuario y mes y guarda cada grupo como un bloque NDJSON comprimido con gzip.
+Dónde queda el bloque lo decide el sink:
+
+- ``FirestoreArchiveSink``: dentro del mismo documento de índice (campo ``blob``)
+- ``LocalFileArchiveSink``: un archivo ``.ndjson.gz`` en un directorio local
+
+En ambos casos queda un documento liviano en ``conversation_archives`` con el
+usuario, el mes, los IDs de las conversaciones y dónde está el bloque; con él
+``find_archived_conversation`` recupera una conversación archivada por su ID.
+"""
+import gzip
+import hashlib
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional
+from app.core import responses
+from app.core.deadline import run_sync
+from app.db.firestore_client import get_db, run_firestore, Collections
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/conversation_archives")
+# El blob y la lista de IDs van en un documento de Firestore (máximo 1 MiB)
+ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_BYTES", str(800 * 1024)))
+# Con el documento de índice, un bloque cabe en un batch de 500 escrituras
+ARCHIVE_MAX_CONVERSATIONS = int(os.getenv("ARCHIVE_MAX_CONVERSATIONS", "499"))
+
+
+def user_key(user_email: str) -> str:
+    """Prefijo estable por usuario para IDs de archivo y rutas (sin el email en claro)"""
+    return hashlib.sha256(user_email.encode()).hexdigest()[:16]
+
+
+def archive_id(user_email: str, month: str, conversation_ids: Iterable[str]) -> str:
+    """
+    ID determinista del bloque: si el job se corta después de escribirlo y
+    antes de borrar los originales, la próxima corrida lo sobrescribe en vez de duplicarlo
+    """
+    digest = hashlib.sha256("\n".join(sorted(conversation_ids)).encode()).hexdigest()[:16]
+    return f"{user_key(user_email)}_{month}_{digest}"
+
+
+def encode_bundle(records: List[Dict[str, Any]]) -> bytes:
+    return gzip.compress(b"".join(responses.dumps(record) + b"\n" for record in records))
+
+
+def decode_bundle(data: bytes) -> List[Dict[str, Any]]:
+    return [responses.loads(line) for line in gzip.decompress(data).splitlines() if line]
+
+
+class ArchiveSink:
+    """Dónde se guardan los bloques comprimidos"""
+
+    name = "base"
+
+    def write(self, bundle_id: str, user_email: str, month: str, data: bytes) -> Dict[str, Any]:
+        """Guarda el bloque; retorna los campos a agregar al documento de índice"""
+        raise NotImplementedError
+
+    def read(self, index: Dict[str, Any]) -> bytes:
+        """Bloque comprimido a partir de su documento de índice"""
+        raise NotImplementedError
+
+
+class FirestoreArchiveSink(ArchiveSink):
+    """El bloque va en el mismo documento de ``conversation_archives``"""
+
+    name = "firestore"
+
+    def write(self, bundle_id: str, user_email: str, month: str, data: bytes) -> Dict[str, Any]:
+        return {"blob": data}
+
+    def read(self, index: Dict[str, Any]) -> bytes:
+        return index["blob"]
+
+
+class LocalFileArchiveSink(ArchiveSink):
+    """Un archivo por bloque: ``{directory}/{usuario}/{mes}/{bundle_id}.ndjson.gz``"""
+
+    name = "local"
+
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+
+    def write(self, bundle_id: str, user_email: str, month: str, data: bytes) -> Dict[str, Any]:
+        folder = os.path.join(self.directory, user_key(user_email), month)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{bundle_id}.ndjson.gz")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return {"location": path}
+
+    def read(self, index: Dict[str, Any]) -> bytes:
+        with open(index["location"], "rb") as f:
+            return f.read()
+
+
+SINKS = {
+    FirestoreArchiveSink.name: FirestoreArchiveSink,
+    LocalFileArchiveSink.name: LocalFileArchiveSink,
+}
+
+
+def get_sink(name: str, **options) -> ArchiveSink:
+    if name not in SINKS:
+        raise ValueError(f"Sink de archivo desconocido: {name} (disponibles: {', '.join(SINKS)})")
+    return SINKS[name](**options)
+
+
+def split_bundles(records: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Parte un grupo en bloques de como mucho ARCHIVE_MAX_CONVERSATIONS y ARCHIVE_MAX_BYTES comprimidos"""
+    pending = [
+        records[start:start + ARCHIVE_MAX_CONVERSATIONS]
+        for start in range(0, len(records), ARCHIVE_MAX_CONVERSATIONS)
+    ]
+    bundles = []
+    while pending:
+        part = pending.pop(0)
+        if len(part) > 1 and len(encode_bundle(part)) > ARCHIVE_MAX_BYTES:
+            middle = len(part) // 2
+            pending[:0] = [part[:middle], part[middle:]]
+            continue
+        bundles.append(part)
+    return bundles
+
+
+def _find_index(conversation_id: str) -> Optional[Dict[str, Any]]:
+    query = (get_db().collection(Collections.CONVERSATION_ARCHIVES)
+             .where("conversation_ids", "array_contains", conversation_id)
+             .limit(1))
+    for doc in query.stream():
+        return doc.to_dict()
+    return None
+
+
+async def find_archived_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Conversación archivada por su ID original (con ``archived: True``), o None.
+    Lee solo el bloque que la contiene.
+    """
+    index = await run_firestore(_find_index, conversation_id, operation="firestore archive index lookup")
+    if index is None:
+        return None
+
+    sink = get_sink(index.get("sink", FirestoreArchiveSink.name))
+    data = await run_sync(sink.read, index, operation="archive bundle read")
+    for record in decode_bundle(data):
+        if record.get("_id") == conversation_id:
+            record["archived"] = True
+            return record
+    logger.warning(f"⚠️ Conversación {conversation_id} indexada pero ausente de su bloque")
+    return None
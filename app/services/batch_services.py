@@ -0,0 +1,133 @@
+"""
+Generación en lote: varios temas en una sola petición.
+
+Los temas se deduplican (por tema normalizado), se generan en el servidor con
+concurrencia acotada pasando por el caché compartido, y cada resultado se
+emite como una línea NDJSON apenas termina. Las conversaciones se guardan al
+final en un solo batch de escritura; con roadmaps, cada uno va en el mismo
+batch junto a su conversación, como en POST /roadmaps. Sus IDs se reservan en
+el cliente, así que cada línea ya trae su ``roadmap_id``.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+from fastapi import HTTPException
+from app.core.circuit_breaker import CircuitOpenError
+from app.core.deadline import DeadlineExceeded
+from app.db.transactions import allocate_id
+from app.schemas.requests import TopicRequest
+from app.services import cache_services
+from app.services.db_services import save_conversations_batch
+
+logger = logging.getLogger(__name__)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+
+def dedupe_topics(topics: List[str]) -> Dict[str, List[int]]:
+    """Tema (primera grafía vista) -> posiciones en la lista original"""
+    first_spelling: Dict[str, str] = {}
+    positions: Dict[str, List[int]] = {}
+    for index, topic in enumerate(topics):
+        normalized = cache_services.normalize_topic(topic)
+        if not normalized:
+            continue
+        topic = first_spelling.setdefault(normalized, topic.strip())
+        positions.setdefault(topic, []).append(index)
+    return positions
+
+
+def error_detail(error: Exception) -> Dict[str, Any]:
+    if isinstance(error, HTTPException):
+        return {"status_code": error.status_code, "detail": error.detail}
+    if isinstance(error, DeadlineExceeded):
+        return {"status_code": 504, "detail": str(error)}
+    if isinstance(error, CircuitOpenError):
+        return {"status_code": 503, "detail": str(error)}
+    return {"status_code": 500, "detail": str(error)}
+
+
+async def stream_topic_batch(
+    topics: List[str],
+    kind: str,
+    generate: Callable[[TopicRequest], Awaitable[Any]],
+    user_email: str,
+    route: str,
+    prompt_prefix: str
+) -> AsyncIterator[str]:
+    """
+    Genera cada tema y emite una línea NDJSON por tema en orden de finalización:
+    ``{"topic", "indices", "status": "ok", "cache", "result"}`` (más
+    ``roadmap_id`` si son roadmaps) o ``{"topic", "indices", "status": "error", "error": {...}}``.
+    Si al final no se puede guardar el lote, se agrega una última línea
+    ``{"status": "error", "saved": false, "roadmap_ids": [...], "error": {...}}``:
+    esos roadmaps no quedaron guardados (reintentarlos es un acierto de caché).
+    """
+    positions = dedupe_topics(topics)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(topic: str) -> Dict[str, Any]:
+        item: Dict[str, Any] = {"topic": topic, "indices": positions[topic]}
+        async with semaphore:
+            try:
+                payload, cache_status = await cache_services.get_or_generate(
+                    kind, topic, lambda: generate(TopicRequest(topic=topic))
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Error generando '{topic}' en lote {route}: {e}")
+                return {**item, "status": "error", "error": error_detail(e)}
+        item.update(status="ok", cache=cache_status, result=payload)
+        if kind == cache_services.ROADMAP:
+            # Como POST /roadmaps: el roadmap queda guardado (y editable con PATCH)
+            item["roadmap_id"] = allocate_id('roadmaps')
+        return item
+
+    async def save(conversations: List[Dict[str, Any]]) -> Any:
+        """Guarda el lote en un solo batch; retorna el error (o None)"""
+        if not conversations:
+            return None
+        try:
+            await save_conversations_batch(user_email, conversations)
+        except Exception as e:
+            logger.error(f"❌ Error guardando conversaciones del lote {route}: {e}")
+            return error_detail(e)
+        return None
+
+    tasks = [asyncio.create_task(run(topic)) for topic in positions]
+    conversations = []
+    pending = True
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            if item["status"] == "ok":
+                conversation = {
+                    "route": route,
+                    "prompt": f"{prompt_prefix}{item['topic']}",
+                    "response": str(item["result"]),
+                    "metadata": {"batch": True}
+                }
+                if "roadmap_id" in item:
+                    conversation["roadmap"] = {
+                        "roadmap_id": item["roadmap_id"],
+                        "title": item["topic"],
+                        "content": item["result"]
+                    }
+                conversations.append(conversation)
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+        pending = False
+        error = await save(conversations)
+        if error is not None:
+            roadmap_ids = [c["roadmap"]["roadmap_id"] for c in conversations if "roadmap" in c]
+            yield json.dumps(
+                {"status": "error", "saved": False, "roadmap_ids": roadmap_ids, "error": error},
+                ensure_ascii=False
+            ) + "\n"
+    finally:
+        # Si el cliente se desconecta, no seguir generando para nadie
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        if pending:
+            await save(conversations)
@@ -0,0 +1,95 @@
+"""
+"Learning bundle": roadmap, temas relacionados y preguntas de un tema en una
+sola petición. Las preguntas salen del banco de ``question_bank_services``.
+Las tres partes corren en paralelo (el tiempo total es el
+de la más lenta) y un fallo parcial no tumba a las otras dos. Las
+conversaciones se guardan en un solo batch de escritura, y el roadmap va en el
+mismo commit junto a la suya, como en POST /roadmaps (editable con PATCH).
+"""
+import asyncio
+import logging
+from typing import Any, Dict
+from fastapi import HTTPException
+from app.core.circuit_breaker import CircuitOpenError
+from app.core.deadline import DeadlineExceeded
+from app.db.transactions import allocate_id
+from app.schemas.requests import TopicRequest
+from app.services import cache_services, question_bank_services
+from app.services.batch_services import error_detail
+from app.services.db_services import save_conversations_batch
+from app.services.learning_path_services import (
+    generate_roadmap_logic,
+    related_topics_logic
+)
+
+logger = logging.getLogger(__name__)
+
+# parte del bundle -> (ruta y prefijo del prompt para el historial)
+BUNDLE_PARTS = {
+    "roadmap": ("/roadmaps", "Generar roadmap del tema: "),
+    "related_topics": ("/related-topics", "Buscar temas relacionados con: "),
+    "questions": ("/questions", "Generar preguntas del tema: "),
+}
+
+
+async def learning_bundle_logic(request: TopicRequest, user_email: str) -> Dict[str, Any]:
+    """
+    Retorna ``{"topic", "roadmap", "roadmap_id", "related_topics", "questions", "cache", "errors"}``.
+    Las partes que fallan quedan en None y su error en ``errors``; si fallan
+    las tres se lanza HTTPException 502.
+    """
+    async def questions():
+        return await question_bank_services.sample_questions(request.topic, user_email=user_email), "bank"
+
+    parts = {
+        "roadmap": cache_services.get_or_generate(
+            cache_services.ROADMAP, request.topic, lambda: generate_roadmap_logic(request, user_email),
+            exact=request.exact
+        ),
+        "related_topics": cache_services.get_or_generate(
+            cache_services.RELATED_TOPICS, request.topic, lambda: related_topics_logic(request),
+            exact=request.exact
+        ),
+        "questions": questions(),
+    }
+    results = await asyncio.gather(*(parts[part] for part in BUNDLE_PARTS), return_exceptions=True)
+
+    bundle: Dict[str, Any] = {"topic": request.topic, "cache": {}, "errors": {}}
+    conversations = []
+    for part, result in zip(BUNDLE_PARTS, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            logger.warning(f"⚠️ Parte '{part}' del bundle falló para '{request.topic}': {result}")
+            bundle[part] = None
+            bundle["errors"][part] = error_detail(result)
+            continue
+
+        payload, cache_status = result
+        bundle[part] = payload
+        bundle["cache"][part] = cache_status
+        route, prompt_prefix = BUNDLE_PARTS[part]
+        conversations.append({
+            "route": route,
+            "prompt": f"{prompt_prefix}{request.topic}",
+            "response": str(payload),
+            "metadata": {"bundle": True}
+        })
+
+    if not conversations:
+        upstream_errors = [r for r in results if isinstance(r, (DeadlineExceeded, CircuitOpenError))]
+        if upstream_errors:
+            raise upstream_errors[0]
+        raise HTTPException(status_code=502, detail={"message": "No se pudo generar el bundle", "errors": bundle["errors"]})
+
+    bundle["roadmap_id"] = None
+    for conversation in conversations:
+        if conversation["route"] == "/roadmaps":
+            bundle["roadmap_id"] = allocate_id('roadmaps')
+            conversation["roadmap"] = {
+                "roadmap_id": bundle["roadmap_id"],
+                "title": request.topic,
+                "content": bundle["roadmap"]
+            }
+    await save_conversations_batch(user_email, conversations)
+    return bundle
@@ -0,0 +1,313 @@
+"""
+Caché compartido de respuestas generadas por tema.
+
+Guarda roadmaps y temas relacionados por (tipo, tema normalizado)
+en niveles: un LRU en memoria por worker, el caché compartido entre los workers
+del nodo (``shared_cache``, si está activo) y la colección ``topic_cache``
+de Firestore, compartida entre instancias y poblada también por el job
+``app.jobs.warm_popular_topics``. Cada entrada en memoria guarda también su
+JSON ya serializado, que las rutas devuelven tal cual (``encoded``).
+
+Si un tema no está pero hay uno casi igual ya generado ("Aprender Python" y
+"Python"), se sirve ese (estado "similar"), salvo que se pida ``exact``.
+Ver ``topic_index_services``.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from app.core import metrics, responses, shared_cache
+from app.core.deadline import DeadlineExceeded
+from app.db.firestore_client import get_db, run_firestore, Collections
+from app.services.topic_index_services import TopicIndex
+
+logger = logging.getLogger(__name__)
+
+TOPIC_CACHE_TTL_SECONDS = int(os.getenv("TOPIC_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+TOPIC_CACHE_LOCAL_SIZE = int(os.getenv("TOPIC_CACHE_LOCAL_SIZE", "1000"))
+TOPIC_CACHE_ENABLED = os.getenv("TOPIC_CACHE_ENABLED", "true").lower() != "false"
+TOPIC_SIMILARITY_ENABLED = os.getenv("TOPIC_SIMILARITY_ENABLED", "true").lower() != "false"
+# Jaccard mínimo entre n-gramas de los temas canónicos para reutilizar una respuesta
+TOPIC_SIMILARITY_THRESHOLD = float(os.getenv("TOPIC_SIMILARITY_THRESHOLD", "0.8"))
+TOPIC_INDEX_MAX_SIZE = int(os.getenv("TOPIC_INDEX_MAX_SIZE", "50000"))
+
+# Tipos de respuesta cacheables
+ROADMAP = "roadmap"
+RELATED_TOPICS = "related_topics"
+
+SHARED_NAMESPACE = "topic"
+
+# key -> (generated_at, payload, payload serializado)
+_local: "OrderedDict[str, Tuple[float, Any, bytes]]" = OrderedDict()
+# Generaciones en curso por key, para que peticiones simultáneas compartan una sola
+_inflight: Dict[str, "asyncio.Future"] = {}
+
+
+def normalize_topic(topic: str) -> str:
+    """Minúsculas, sin tildes y con espacios colapsados"""
+    decomposed = unicodedata.normalize("NFKD", topic.lower())
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(without_accents.split())
+
+
+_indexes: Dict[str, TopicIndex] = {
+    kind: TopicIndex(normalize_topic, TOPIC_SIMILARITY_THRESHOLD, TOPIC_INDEX_MAX_SIZE)
+    for kind in (ROADMAP, RELATED_TOPICS)
+}
+
+
+def _add_to_index(kind: str, topic: str) -> None:
+    if TOPIC_SIMILARITY_ENABLED and kind in _indexes:
+        _indexes[kind].add(topic)
+
+
+def cache_key(kind: str, topic: str) -> str:
+    digest = hashlib.sha256(normalize_topic(topic).encode()).hexdigest()[:32]
+    return f"{kind}_{digest}"
+
+
+def _remember(key: str, generated_at: float, payload: Any, encoded: bytes) -> None:
+    _local[key] = (generated_at, payload, encoded)
+    _local.move_to_end(key)
+    while len(_local) > TOPIC_CACHE_LOCAL_SIZE:
+        _local.popitem(last=False)
+
+
+def _share(key: str, generated_at: float, encoded: bytes) -> None:
+    """Publica la entrada para los demás workers del nodo mientras siga fresca"""
+    ttl = TOPIC_CACHE_TTL_SECONDS - (time.time() - generated_at)
+    shared_cache.set(SHARED_NAMESPACE, key, struct.pack("!d", generated_at) + encoded, ttl)
+
+
+def _from_shared(key: str) -> Optional[Tuple[float, bytes]]:
+    value = shared_cache.get(SHARED_NAMESPACE, key)
+    if value is None:
+        return None
+    return struct.unpack("!d", value[:8])[0], value[8:]
+
+
+def _is_fresh(generated_at: float, max_age: Optional[float] = None) -> bool:
+    return time.time() - generated_at < (TOPIC_CACHE_TTL_SECONDS if max_age is None else max_age)
+
+
+def _read_entry(key: str) -> Optional[Dict[str, Any]]:
+    doc = get_db().collection(Collections.TOPIC_CACHE).document(key).get()
+    return doc.to_dict() if doc.exists else None
+
+
+async def get_entry(kind: str, topic: str) -> Optional[Dict[str, Any]]:
+    """
+    Entrada cruda del caché (``payload``, ``generated_at``, ``topic``), fresca o no.
+    Consulta primero la memoria local y luego Firestore.
+    """
+    key = cache_key(kind, topic)
+    local = _local.get(key)
+    if local is not None:
+        _local.move_to_end(key)
+        return {"payload": local[1], "generated_at": local[0], "topic": topic}
+
+    shared = _from_shared(key)
+    if shared is not None:
+        generated_at, encoded = shared
+        payload = responses.loads(encoded)
+        _remember(key, generated_at, payload, encoded)
+        return {"payload": payload, "generated_at": generated_at, "topic": topic}
+
+    try:
+        entry = await run_firestore(_read_entry, key, operation="firestore topic cache read")
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"⚠️ Error leyendo caché de temas {key}: {e}")
+        return None
+    if not entry:
+        return None
+
+    encoded = entry["payload_json"].encode()
+    payload = responses.loads(encoded)
+    _remember(key, entry["generated_at"], payload, encoded)
+    _share(key, entry["generated_at"], encoded)
+    _add_to_index(kind, entry.get("topic", topic))
+    return {"payload": payload, "generated_at": entry["generated_at"], "topic": entry.get("topic", topic)}
+
+
+async def get_cached(kind: str, topic: str, allow_stale: bool = False) -> Optional[Any]:
+    """Payload cacheado si existe y no expiró (o aunque haya expirado, con allow_stale)"""
+    if not TOPIC_CACHE_ENABLED:
+        return None
+    entry = await get_entry(kind, topic)
+    if entry is None:
+        return None
+    if allow_stale or _is_fresh(entry["generated_at"]):
+        return entry["payload"]
+    return None
+
+
+async def store(kind: str, topic: str, payload: Any, source: str = "request") -> None:
+    """Guarda un payload en memoria y en Firestore (los errores de escritura no se propagan)"""
+    key = cache_key(kind, topic)
+    generated_at = time.time()
+    encoded = responses.dumps(payload)
+    _remember(key, generated_at, payload, encoded)
+    _share(key, generated_at, encoded)
+    _add_to_index(kind, topic)
+
+    data = {
+        "kind": kind,
+        "topic": topic,
+        "normalized_topic": normalize_topic(topic),
+        "payload_json": encoded.decode(),
+        "generated_at": generated_at,
+        "source": source,
+    }
+    try:
+        await run_firestore(
+            get_db().collection(Collections.TOPIC_CACHE).document(key).set, data,
+            operation="firestore topic cache write"
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Error guardando caché de temas {key}: {e}")
+
+
+def encoded(kind: str, topic: str, payload: Any) -> bytes:
+    """JSON de ``payload``: el ya serializado del caché si es esa misma entrada"""
+    local = _local.get(cache_key(kind, topic))
+    if local is not None and local[1] is payload:
+        return local[2]
+    return responses.dumps(payload)
+
+
+async def find_similar(kind: str, topic: str) -> Optional[Tuple[str, Any]]:
+    """``(tema, payload)`` del tema casi igual más parecido con respuesta vigente"""
+    if not TOPIC_SIMILARITY_ENABLED or kind not in _indexes:
+        return None
+    normalized = normalize_topic(topic)
+    for matched, score in _indexes[kind].similar(topic):
+        if normalize_topic(matched) == normalized:
+            continue
+        payload = await get_cached(kind, matched)
+        if payload is not None:
+            metrics.increment(f"topic_cache.{kind}.similar")
+            logger.info(f"🔎 '{topic}' servido con la respuesta de '{matched}' (similitud {score:.2f})")
+            return matched, payload
+    return None
+
+
+async def resolve(
+    kind: str,
+    topic: str,
+    generate: Callable[[], Awaitable[Any]],
+    exact: bool = False
+) -> Tuple[Any, str, str]:
+    """
+    Como ``get_or_generate`` pero retorna también el tema cuya respuesta se
+    sirvió: ``(payload, estado, tema)``. Con estado "similar" el tema es el
+    casi igual que ya estaba en el caché.
+    """
+    if not TOPIC_CACHE_ENABLED:
+        return await generate(), "miss", topic
+
+    cached = await get_cached(kind, topic)
+    if cached is not None:
+        return cached, "hit", topic
+
+    if not exact:
+        similar = await find_similar(kind, topic)
+        if similar is not None:
+            matched, payload = similar
+            return payload, "similar", matched
+
+    try:
+        payload, status = await _generate_shared(kind, topic, generate)
+        return payload, status, topic
+    except Exception as e:
+        stale = await _get_stale(kind, topic)
+        if stale is None:
+            raise
+        metrics.increment(f"topic_cache.{kind}.stale")
+        logger.warning(f"♻️ Sirviendo {kind} vencido para '{topic}' tras error al generar: {e}")
+        return stale, "stale", topic
+
+
+async def get_or_generate(
+    kind: str,
+    topic: str,
+    generate: Callable[[], Awaitable[Any]],
+    exact: bool = False
+) -> Tuple[Any, str]:
+    """
+    Devuelve ``(payload, estado)`` donde estado es "hit", "similar", "miss", "coalesced" o "stale".
+    En un miss genera con ``generate()`` y guarda el resultado; peticiones
+    simultáneas por el mismo tema esperan a la misma generación ("coalesced").
+    Sin ``exact``, un tema casi igual ya cacheado se sirve en lugar de generar ("similar").
+    Si la generación falla (p. ej. circuito de Vertex abierto) y hay una
+    respuesta vencida del tema, se sirve esa ("stale").
+    """
+    payload, status, _ = await resolve(kind, topic, generate, exact)
+    return payload, status
+
+
+def load_topic_index() -> int:
+    """Llena el índice de similitud con los temas vigentes de ``topic_cache`` (warm-up de arranque)"""
+    if not (TOPIC_CACHE_ENABLED and TOPIC_SIMILARITY_ENABLED):
+        return 0
+    query = (
+        get_db().collection(Collections.TOPIC_CACHE)
+        .select(["kind", "topic", "generated_at"])
+        .limit(TOPIC_INDEX_MAX_SIZE * len(_indexes))
+    )
+    loaded = 0
+    for doc in query.stream():
+        data = doc.to_dict()
+        if data.get("kind") in _indexes and data.get("topic") and _is_fresh(data.get("generated_at", 0)):
+            _indexes[data["kind"]].add(data["topic"])
+            loaded += 1
+    logger.info(f"🔎 Índice de temas cargado: {loaded} temas")
+    return loaded
+
+
+async def _get_stale(kind: str, topic: str) -> Optional[Any]:
+    try:
+        return await get_cached(kind, topic, allow_stale=True)
+    except Exception:
+        return None
+
+
+async def _generate_shared(
+    kind: str,
+    topic: str,
+    generate: Callable[[], Awaitable[Any]]
+) -> Tuple[Any, str]:
+    key = cache_key(kind, topic)
+    pending = _inflight.get(key)
+    if pending is not None:
+        try:
+            return await asyncio.shield(pending), "coalesced"
+        except asyncio.CancelledError:
+            # Si se canceló la generación original (y no esta petición), generar aquí
+            if not pending.cancelled():
+                raise
+            return await generate(), "miss"
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        payload = await generate()
+        await store(kind, topic, payload)
+        future.set_result(payload)
+        return payload, "miss"
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Evita el warning de "exception was never retrieved" si nadie esperaba
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
@@ -5,22 +5,30 @@ Mantiene compatibilidad con código existente
 from app.services.db_services_firestore import (
     get_or_create_session,
     save_conversation,
+    save_conversations_batch,
     get_conversations_by_user,
     get_roadmaps_by_user,
     delete_conversation,
     get_conversation_by_id,
     count_user_conversations,
-    get_conversations_by_session
+    get_conversations_by_session,
+    get_roadmap_by_id,
+    save_roadmap_with_conversation_atomic,
+    update_roadmap_with_log_atomic
 )
 
 # Re-exportar todas las funciones para mantener compatibilidad
 __all__ = [
     'get_or_create_session',
     'save_conversation',
+    'save_conversations_batch',
     'get_conversations_by_user',
     'get_roadmaps_by_user',
     'delete_conversation',
     'get_conversation_by_id',
     'count_user_conversations',
-    'get_conversations_by_session'
+    'get_conversations_by_session',
+    'get_roadmap_by_id',
+    'save_roadmap_with_conversation_atomic',
+    'update_roadmap_with_log_atomic'
 ]
@@ -5,29 +5,28 @@ learning_path_be
 UPDATED: Now includes ACID transaction support
 """
 from datetime import datetime
-import uuid
-from app.db.firestore_client import get_db
-from app.db.transactions import FirestoreTransaction, with_retry
+from app.db.firestore_client import get_db, run_firestore
+from app.db.transactions import FirestoreTransaction, BatchWriter, WriteConflict, allocate_id, is_transient, with_retry
+from app.core.circuit_breaker import CircuitOpenError
+from app.core.deadline import DeadlineExceeded
+from app.services.archive_services import find_archived_conversation
+from app.services.session_services import registry as session_registry
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Cache en memoria para sesiones de usuarios
-_user_sessions = {}
+# Máximo de escrituras por batch de Firestore
+BATCH_WRITE_LIMIT = 500
 
 
-def get_or_create_session(user_email: str) -> str:
+async def get_or_create_session(user_email: str) -> str:
     """
     Retorna el session_id actual de un usuario o crea uno nuevo si no existe.
-    Permite agrupar todas las conversaciones del usuario en una misma sesión.
+    Permite agrupar todas las conversaciones del usuario en una misma sesión;
+    la sesión rota tras un periodo de inactividad (ver session_services).
+    Las lecturas y escrituras de la sesión en Firestore no bloquean el event loop.
     """
-    if user_email not in _user_sessions:
-        session_id = str(uuid.uuid4()) 
-        _user_sessions[user_email] = session_id
-        print(f"🆕 Nueva sesión creada para {user_email}: {session_id}")
-    else:
-        session_id = _user_sessions[user_email]
-    return session_id
+    return await session_registry.get_or_create_async(user_email)
 
 
 async def save_conversation(
@@ -41,7 +40,7 @@ async def save_conversation(
     Guarda una conversación asociada a un usuario y sesión activa.
     Si el usuario no tiene sesión activa, se genera un session_id.
     """
-    session_id = get_or_create_session(user_email)
+    session_id = await get_or_create_session(user_email)
 
     data = {
         "session_id": session_id,
@@ -57,17 +56,146 @@ async def save_conversation(
         db = get_db()
         # Crear documento en Firestore
         doc_ref = db.collection("conversations").document()
-        doc_ref.set(data)
+        await run_firestore(doc_ref.set, data, operation="firestore save_conversation")
         
-        print(f"✅ Conversación guardada correctamente en sesión {session_id} - Doc ID: {doc_ref.id}")
+        logger.info(f"✅ Conversación guardada correctamente en sesión {session_id} - Doc ID: {doc_ref.id}")
     except Exception as e:
-        print(f"❌ Error al guardar conversación en Firestore: {e}")
+        logger.error(f"❌ Error al guardar conversación en Firestore: {e}")
         raise
 
 
+async def save_conversations_batch(user_email: str, conversations: list) -> int:
+    """
+    Guarda varias conversaciones del mismo usuario en un solo batch de escritura
+    (una ida a Firestore cada 500 documentos en lugar de una por conversación).
+    Una conversación con ``roadmap`` (``{"roadmap_id", "title", "content"}``,
+    con el ID reservado antes con ``allocate_id('roadmaps')``) se escribe junto
+    con su roadmap en ``roadmaps``, ya enlazados, como en
+    ``save_roadmap_with_conversation_atomic``: el roadmap y su conversación
+    siempre quedan en el mismo commit.
+
+    Args:
+        user_email: Email del usuario
+        conversations: Lista de dicts con route, prompt, response y metadata/roadmap opcionales
+
+    Returns:
+        int: Cantidad de conversaciones guardadas
+    """
+    if not conversations:
+        return 0
+
+    session_id = await get_or_create_session(user_email)
+    timestamp = datetime.utcnow()
+
+    writers = [BatchWriter()]
+    for conversation in conversations:
+        roadmap = conversation.get("roadmap")
+        if writers[-1].operations_count + (2 if roadmap else 1) > BATCH_WRITE_LIMIT:
+            writers.append(BatchWriter())
+        writer = writers[-1]
+        if roadmap:
+            conversation_id = allocate_id('conversations')
+            roadmap_data, conversation_data = _roadmap_documents(
+                session_id, user_email, timestamp,
+                roadmap_id=roadmap["roadmap_id"],
+                conversation_id=conversation_id,
+                roadmap_title=roadmap["title"],
+                roadmap_content=roadmap["content"],
+                prompt=conversation["prompt"],
+                response=conversation["response"],
+                metadata=conversation.get("metadata")
+            )
+            writer.add_create("roadmaps", roadmap_data, doc_id=roadmap["roadmap_id"])
+            writer.add_create("conversations", conversation_data, doc_id=conversation_id)
+            continue
+        writer.add_create("conversations", {
+            "session_id": session_id,
+            "user": user_email,
+            "route": conversation["route"],
+            "prompt": conversation["prompt"],
+            "response": conversation["response"],
+            "metadata": conversation.get("metadata") or {},
+            "timestamp": timestamp
+        })
+
+    for writer in writers:
+        result = await run_firestore(writer.commit, operation="firestore save_conversations_batch")
+        if not result["success"]:
+            logger.error(f"❌ Error al guardar lote de conversaciones: {result.get('error')}")
+            raise Exception(f"Batch failed: {result.get('error')}")
+
+    logger.info(f"✅ {len(conversations)} conversaciones guardadas en lote en sesión {session_id}")
+    return len(conversations)
+
+
 # ==================== ACID TRANSACTION FUNCTIONS ====================
 
-@with_retry(max_attempts=3)
+@with_retry(
+    max_attempts=3,
+    initial_delay=0.25,
+    no_retry=(DeadlineExceeded, CircuitOpenError, WriteConflict),
+    retry_if=is_transient
+)
+async def _execute_atomic(operations: list, operation: str) -> dict:
+    """
+    Runs the operations atomically, retrying transient failures only
+    (Aborted, ServiceUnavailable, InternalServerError): a missing document or a
+    bad operation fails on the first attempt.
+    Every document ID is fixed before the first attempt, so a retry after an
+    ambiguous commit rewrites the same documents instead of duplicating them.
+    A failed update-time precondition raises WriteConflict (not retried).
+    """
+    tx = FirestoreTransaction()
+    result = await run_firestore(tx.execute, operations, operation=operation)
+    if not result['success']:
+        if result.get('conflict'):
+            raise WriteConflict(result.get('error'))
+        if result.get('exception') is not None:
+            # The original error keeps its type, which decides whether it is retried
+            raise result['exception']
+        raise Exception(f"Transaction failed: {result.get('error')}")
+    return result
+
+
+def _roadmap_documents(
+    session_id: str,
+    user_email: str,
+    timestamp: datetime,
+    roadmap_id: str,
+    conversation_id: str,
+    roadmap_title: str,
+    roadmap_content: dict,
+    prompt: str,
+    response: str,
+    metadata: dict = None
+) -> tuple:
+    """Roadmap and conversation documents, already linked to each other"""
+    roadmap_data = {
+        "session_id": session_id,
+        "user": user_email,
+        "title": roadmap_title,
+        "content": roadmap_content,
+        "route": "/roadmaps",
+        "timestamp": timestamp,
+        "conversation_id": conversation_id,
+        "metadata": metadata or {}
+    }
+    conversation_data = {
+        "session_id": session_id,
+        "user": user_email,
+        "route": "/roadmaps",
+        "prompt": prompt,
+        "response": response,
+        "metadata": {
+            **(metadata or {}),
+            "roadmap_title": roadmap_title,
+            "roadmap_id": roadmap_id
+        },
+        "timestamp": timestamp
+    }
+    return roadmap_data, conversation_data
+
+
 async def save_roadmap_with_conversation_atomic(
     user_email: str,
     roadmap_title: str,
@@ -81,7 +209,9 @@ async def save_roadmap_with_conversation_atomic(
     If either operation fails, both are rolled back
     
     This ensures data consistency - you'll never have orphaned roadmaps
-    without their associated conversations
+    without their associated conversations. Both IDs are allocated client-side,
+    so the documents are written already linked to each other in a single
+    commit (blind creates: no transaction reads)
     
     Args:
         user_email: User's email
@@ -103,91 +233,76 @@ async def save_roadmap_with_conversation_atomic(
         ...     response="Here's your roadmap..."
         ... )
     """
-    session_id = get_or_create_session(user_email)
+    session_id = await get_or_create_session(user_email)
     timestamp = datetime.utcnow()
+    roadmap_id = allocate_id('roadmaps')
+    conversation_id = allocate_id('conversations')
+    roadmap_data, conversation_data = _roadmap_documents(
+        session_id, user_email, timestamp,
+        roadmap_id=roadmap_id,
+        conversation_id=conversation_id,
+        roadmap_title=roadmap_title,
+        roadmap_content=roadmap_content,
+        prompt=prompt,
+        response=response,
+        metadata=metadata
+    )
     
-    # Prepare roadmap document
-    roadmap_data = {
-        "session_id": session_id,
-        "user": user_email,
-        "title": roadmap_title,
-        "content": roadmap_content,
-        "route": "/roadmaps",
-        "timestamp": timestamp,
-        "metadata": metadata or {}
-    }
-    
-    # Prepare conversation document
-    conversation_data = {
-        "session_id": session_id,
-        "user": user_email,
-        "route": "/roadmaps",
-        "prompt": prompt,
-        "response": response,
-        "metadata": {
-            **(metadata or {}),
-            "roadmap_title": roadmap_title,
-            "roadmap_id": None  # Will be set after roadmap creation
-        },
-        "timestamp": timestamp
-    }
-    
-    # Execute atomic transaction
-    tx = FirestoreTransaction()
     operations = [
         {
             'type': 'create',
             'collection': 'roadmaps',
+            'doc_id': roadmap_id,
             'data': roadmap_data
         },
         {
             'type': 'create',
             'collection': 'conversations',
+            'doc_id': conversation_id,
             'data': conversation_data
         }
     ]
     
-    result = tx.execute(operations)
+    try:
+        await _execute_atomic(operations, operation="firestore save_roadmap commit")
+    except Exception as e:
+        logger.error(f"❌ ACID Transaction failed for {user_email}: {e}")
+        raise
     
-    if result['success']:
-        # Now update the conversation with the roadmap_id
-        roadmap_id = result['operations']['operation_0']['doc_id']
-        conversation_id = result['operations']['operation_1']['doc_id']
-        
-        # Update conversation with roadmap_id
-        db = get_db()
-        db.collection('conversations').document(conversation_id).update({
-            'metadata.roadmap_id': roadmap_id
-        })
-        
-        logger.info(f"✅ ACID Transaction successful: Roadmap + Conversation saved for {user_email}")
-        return {
-            'success': True,
-            'session_id': session_id,
-            'roadmap_id': roadmap_id,
-            'conversation_id': conversation_id,
-            'timestamp': timestamp
-        }
-    else:
-        logger.error(f"❌ ACID Transaction failed for {user_email}: {result.get('error')}")
-        raise Exception(f"Transaction failed: {result.get('error')}")
+    logger.info(f"✅ ACID Transaction successful: Roadmap + Conversation saved for {user_email}")
+    return {
+        'success': True,
+        'session_id': session_id,
+        'roadmap_id': roadmap_id,
+        'conversation_id': conversation_id,
+        'timestamp': timestamp
+    }
 
 
-@with_retry(max_attempts=3)
 async def update_roadmap_with_log_atomic(
     roadmap_id: str,
     user_email: str,
     updates: dict,
-    log_message: str
+    log_message: str,
+    changes: dict = None,
+    expected_update_time=None,
+    conversation_id: str = None
 ) -> dict:
     """
-    ACID Transaction: Updates roadmap and creates a learning log atomically
+    ACID Transaction: Updates roadmap and creates a learning log atomically.
+    A new content is also written to the roadmap's linked conversation, which
+    is what the read endpoints serve (skipped if it was archived)
     
     Args:
         roadmap_id: ID of the roadmap to update
         user_email: User's email
         updates: Dictionary of fields to update
         log_message: Log message describing the update
+        changes: What the log records as the change (defaults to updates)
+        expected_update_time: update_time of the roadmap as read by the caller;
+            the write fails with WriteConflict if it changed since (and skips
+            the transaction read)
+        conversation_id: The roadmap's linked conversation (roadmap["conversation_id"])
     
     Returns:
         dict: Transaction result
@@ -206,38 +321,78 @@ async def update_roadmap_with_log_atomic(
         "roadmap_id": roadmap_id,
         "message": log_message,
         "timestamp": timestamp,
-        "changes": updates
+        "changes": updates if changes is None else changes
     }
     
-    # Execute atomic transaction
-    tx = FirestoreTransaction()
+    # The log ID is fixed up front so a retried transaction doesn't duplicate the log
+    log_id = allocate_id('learning_logs')
     operations = [
         {
             'type': 'update',
             'collection': 'roadmaps',
             'doc_id': roadmap_id,
-            'data': update_data
+            'data': update_data,
+            'last_update_time': expected_update_time
         },
         {
             'type': 'create',
             'collection': 'learning_logs',
+            'doc_id': log_id,
             'data': log_data
         }
     ]
+    if conversation_id and "content" in updates:
+        operations.append({
+            'type': 'update',
+            'collection': 'conversations',
+            'doc_id': conversation_id,
+            'data': {
+                "response": str(updates["content"]),
+                "updated_at": timestamp
+            },
+            'if_exists': True
+        })
     
-    result = tx.execute(operations)
+    try:
+        await _execute_atomic(operations, operation="firestore update_roadmap transaction")
+    except Exception as e:
+        logger.error(f"❌ ACID Transaction failed for roadmap {roadmap_id}: {e}")
+        raise
     
-    if result['success']:
-        logger.info(f"✅ ACID Transaction successful: Roadmap updated + Log created for {roadmap_id}")
-        return {
-            'success': True,
-            'roadmap_id': roadmap_id,
-            'log_id': result['operations']['operation_1']['doc_id'],
-            'timestamp': timestamp
-        }
-    else:
-        logger.error(f"❌ ACID Transaction failed for roadmap {roadmap_id}: {result.get('error')}")
-        raise Exception(f"Transaction failed: {result.get('error')}")
+    logger.info(f"✅ ACID Transaction successful: Roadmap updated + Log created for {roadmap_id}")
+    return {
+        'success': True,
+        'roadmap_id': roadmap_id,
+        'log_id': log_id,
+        'timestamp': timestamp
+    }
+
+
+async def get_roadmap_by_id(roadmap_id: str):
+    """
+    Obtiene un roadmap (colección roadmaps) por su ID
+    """
+    try:
+        db = get_db()
+        doc = await run_firestore(
+            db.collection("roadmaps").document(roadmap_id).get,
+            operation="firestore get_roadmap_by_id"
+        )
+        
+        if doc.exists:
+            roadmap_dict = doc.to_dict()
+            roadmap_dict["_id"] = doc.id
+            # Para escribir con precondición (update_roadmap_with_log_atomic)
+            roadmap_dict["_update_time"] = doc.update_time
+            return roadmap_dict
+        else:
+            return None
+            
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error obteniendo roadmap: {e}")
+        return None
 
 
 async def delete_roadmap_cascade_atomic(roadmap_id: str, user_email: str) -> dict:
@@ -259,7 +414,9 @@ async def delete_roadmap_cascade_atomic(roadmap_id: str, user_email: str) -> dic
                              .where("user", "==", user_email)
                              .where("metadata.roadmap_id", "==", roadmap_id))
         
-        conversation_docs = list(conversations_query.stream())
+        conversation_docs = await run_firestore(
+            lambda: list(conversations_query.stream()), operation="firestore cascade query"
+        )
         
         # Build operations list
         operations = [
@@ -280,7 +437,7 @@ async def delete_roadmap_cascade_atomic(roadmap_id: str, user_email: str) -> dic
         
         # Execute atomic transaction
         tx = FirestoreTransaction()
-        result = tx.execute(operations)
+        result = await run_firestore(tx.execute, operations, operation="firestore cascade delete transaction")
         
         if result['success']:
             logger.info(f"✅ ACID Transaction successful: Deleted roadmap {roadmap_id} and {len(conversation_docs)} conversations")
@@ -305,8 +462,7 @@ async def get_conversations_by_user(user_email: str, limit: int = 10):
     Obtiene las últimas conversaciones de un usuario desde Firestore.
     """
     try:
-        print(f"🔍 Buscando conversaciones para: {user_email}")
-        print(f"📊 Límite: {limit}")
+        logger.debug(f"🔍 Buscando conversaciones para: {user_email} (límite: {limit})")
         
         db = get_db()
         
@@ -316,7 +472,7 @@ async def get_conversations_by_user(user_email: str, limit: int = 10):
                 .order_by("timestamp", direction="DESCENDING")
                 .limit(limit))
         
-        docs = query.stream()
+        docs = await run_firestore(lambda: list(query.stream()), operation="firestore get_conversations_by_user")
         
         conversations = []
         for doc in docs:
@@ -329,11 +485,13 @@ async def get_conversations_by_user(user_email: str, limit: int = 10):
             
             conversations.append(conv_dict)
         
-        print(f"✅ Conversaciones obtenidas: {len(conversations)}")
+        logger.debug(f"✅ Conversaciones obtenidas: {len(conversations)}")
         return conversations
         
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
-        print(f"❌ Error al obtener conversaciones: {e}")
+        logger.error(f"❌ Error al obtener conversaciones: {e}")
         return []
 
 
@@ -342,7 +500,7 @@ async def get_roadmaps_by_user(user_email: str, limit: int = 20):
     Obtiene los roadmaps de un usuario (filtra por route='/roadmaps' ANTES de limitar).
     """
     try:
-        print(f"📚 Buscando roadmaps para: {user_email}")
+        logger.debug(f"📚 Buscando roadmaps para: {user_email}")
         
         db = get_db()
         
@@ -353,7 +511,7 @@ async def get_roadmaps_by_user(user_email: str, limit: int = 20):
                 .order_by("timestamp", direction="DESCENDING")
                 .limit(limit))
         
-        docs = query.stream()
+        docs = await run_firestore(lambda: list(query.stream()), operation="firestore get_roadmaps_by_user")
         
         roadmaps = []
         for doc in docs:
@@ -366,11 +524,13 @@ async def get_roadmaps_by_user(user_email: str, limit: int = 20):
             
             roadmaps.append(roadmap_dict)
         
-        print(f"✅ Roadmaps encontrados: {len(roadmaps)}")
+        logger.debug(f"✅ Roadmaps encontrados: {len(roadmaps)}")
         return roadmaps
         
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
-        print(f"❌ Error al obtener roadmaps: {e}")
+        logger.error(f"❌ Error al obtener roadmaps: {e}")
         return []
 
 
@@ -380,31 +540,45 @@ async def delete_conversation(conversation_id: str):
     """
     try:
         db = get_db()
-        db.collection("conversations").document(conversation_id).delete()
-        print(f"✅ Conversación eliminada: {conversation_id}")
+        await run_firestore(
+            db.collection("conversations").document(conversation_id).delete,
+            operation="firestore delete_conversation"
+        )
+        logger.debug(f"✅ Conversación eliminada: {conversation_id}")
         return True
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
-        print(f"❌ Error eliminando conversación: {e}")
+        logger.error(f"❌ Error eliminando conversación: {e}")
         return False
 
 
-async def get_conversation_by_id(conversation_id: str):
+async def get_conversation_by_id(conversation_id: str, include_archived: bool = True):
     """
     Obtiene una conversación específica por su ID
+    Si ya fue compactada por el job de retención, la busca en su archivo
+    (viene con ``archived: True``)
     """
     try:
         db = get_db()
-        doc = db.collection("conversations").document(conversation_id).get()
+        doc = await run_firestore(
+            db.collection("conversations").document(conversation_id).get,
+            operation="firestore get_conversation_by_id"
+        )
         
         if doc.exists:
             conv_dict = doc.to_dict()
             conv_dict["_id"] = doc.id
             return conv_dict
+        elif include_archived:
+            return await find_archived_conversation(conversation_id)
         else:
             return None
             
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
-        print(f"❌ Error obteniendo conversación: {e}")
+        logger.error(f"❌ Error obteniendo conversación: {e}")
         return None
 
 
@@ -415,12 +589,14 @@ async def count_user_conversations(user_email: str) -> int:
     try:
         db = get_db()
         query = db.collection("conversations").where("user", "==", user_email)
-        docs = list(query.stream())
+        docs = await run_firestore(lambda: list(query.stream()), operation="firestore count_user_conversations")
         count = len(docs)
-        print(f"📊 Total de conversaciones para {user_email}: {count}")
+        logger.debug(f"📊 Total de conversaciones para {user_email}: {count}")
         return count
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
-        print(f"❌ Error contando conversaciones: {e}")
+        logger.error(f"❌ Error contando conversaciones: {e}")
         return 0
 
 
@@ -434,7 +610,7 @@ async def get_conversations_by_session(session_id: str):
                 .where("session_id", "==", session_id)
                 .order_by("timestamp"))
         
-        docs = query.stream()
+        docs = await run_firestore(lambda: list(query.stream()), operation="firestore get_conversations_by_session")
         
         conversations = []
         for doc in docs:
@@ -442,9 +618,11 @@ async def get_conversations_by_session(session_id: str):
             conv_dict["_id"] = doc.id
             conversations.append(conv_dict)
         
-        print(f"✅ Conversaciones de sesión {session_id}: {len(conversations)}")
+        logger.debug(f"✅ Conversaciones de sesión {session_id}: {len(conversations)}")
         return conversations
         
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
-        print(f"❌ Error obteniendo conversaciones de sesión: {e}")
+        logger.error(f"❌ Error obteniendo conversaciones de sesión: {e}")
         return []
@@ -0,0 +1,150 @@
+"""
+Exportación del historial completo de conversaciones de un usuario.
+
+Recorre ``conversations`` por páginas con cursores de Firestore
+(``start_after`` sobre el último documento de la página anterior) y emite
+cada conversación como una línea NDJSON apenas se lee, así la memoria usada
+depende del tamaño de página y no de la cantidad de conversaciones del usuario.
+Se puede filtrar por rango de fechas y por ruta, y comprimir con gzip en streaming.
+"""
+import logging
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Optional
+from fastapi import HTTPException
+from app.core import metrics, responses
+from app.db.firestore_client import get_db, run_firestore, Collections
+
+logger = logging.getLogger(__name__)
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+# Timeout de cada página; el deadline de la ruta cubre la exportación completa
+EXPORT_PAGE_TIMEOUT_SECONDS = float(os.getenv("EXPORT_PAGE_TIMEOUT_SECONDS", "30"))
+
+
+def _as_utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """Las conversaciones guardan ``datetime.utcnow()`` (sin zona horaria)"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _export_query(user_email: str, since: Optional[datetime], until: Optional[datetime], route: Optional[str]):
+    query = get_db().collection(Collections.CONVERSATIONS).where("user", "==", user_email)
+    if route:
+        query = query.where("route", "==", route)
+    if since is not None:
+        query = query.where("timestamp", ">=", since)
+    if until is not None:
+        query = query.where("timestamp", "<", until)
+    return query.order_by("timestamp", direction="DESCENDING").limit(EXPORT_PAGE_SIZE)
+
+
+def _to_record(doc) -> Dict[str, Any]:
+    record = doc.to_dict()
+    record["_id"] = doc.id
+    if hasattr(record.get("timestamp"), "timestamp"):
+        record["timestamp"] = record["timestamp"].timestamp()
+    return record
+
+
+async def iter_user_conversations(
+    user_email: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    route: Optional[str] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Conversaciones del usuario de la más reciente a la más antigua, página a página.
+
+    Args:
+        since: Solo conversaciones con timestamp >= since
+        until: Solo conversaciones con timestamp < until
+        route: Solo conversaciones de esa ruta (p. ej. "/roadmaps")
+    """
+    base = _export_query(user_email, _as_utc_naive(since), _as_utc_naive(until), route)
+    cursor = None
+    while True:
+        query = base if cursor is None else base.start_after(cursor)
+        page = await run_firestore(
+            lambda: list(query.stream()), operation="firestore export page",
+            timeout=EXPORT_PAGE_TIMEOUT_SECONDS
+        )
+        for doc in page:
+            yield _to_record(doc)
+        metrics.increment("export.pages")
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        cursor = page[-1]
+
+
+def _encode(compressor, chunk: bytearray, flush_mode: int) -> bytes:
+    if compressor is None:
+        return bytes(chunk)
+    return compressor.compress(bytes(chunk)) + compressor.flush(flush_mode)
+
+
+async def export_ndjson(
+    user_email: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    route: Optional[str] = None,
+    gzip: bool = False
+) -> AsyncIterator[bytes]:
+    """
+    Cuerpo NDJSON de la exportación (una conversación por línea), en bloques
+    de una página. Con ``gzip`` cada bloque sale ya comprimido (un solo stream gzip).
+    """
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if gzip else None
+    exported = 0
+    chunk = bytearray()
+    try:
+        async for record in iter_user_conversations(user_email, since, until, route):
+            chunk += responses.dumps(record)
+            chunk += b"\n"
+            exported += 1
+            if exported % EXPORT_PAGE_SIZE == 0:
+                yield _encode(compressor, chunk, zlib.Z_SYNC_FLUSH)
+                chunk.clear()
+        if chunk or compressor:
+            yield _encode(compressor, chunk, zlib.Z_FINISH)
+    except Exception as e:
+        # Los headers ya se enviaron: solo queda cortar el stream
+        metrics.increment("export.errors")
+        logger.error(f"❌ Exportación de {user_email} interrumpida tras {exported} conversaciones: {e}")
+        raise
+    metrics.increment("export.conversations", exported)
+    logger.info(f"📦 Exportadas {exported} conversaciones de {user_email}")
+
+
+async def open_export(
+    user_email: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    route: Optional[str] = None,
+    gzip: bool = False
+) -> AsyncIterator[bytes]:
+    """
+    Como ``export_ndjson`` pero lee el primer bloque antes de retornar, para que
+    un error de Firestore al empezar (circuito abierto, deadline) sea una
+    respuesta 503/504 y no un stream 200 vacío.
+    """
+    since, until = _as_utc_naive(since), _as_utc_naive(until)
+    if since is not None and until is not None and since >= until:
+        raise HTTPException(status_code=422, detail="since debe ser anterior a until")
+
+    body = export_ndjson(user_email, since, until, route, gzip)
+    try:
+        first = await body.__anext__()
+    except StopAsyncIteration:
+        first = b""
+
+    async def _chained() -> AsyncIterator[bytes]:
+        if first:
+            yield first
+        async for chunk in body:
+            yield chunk
+
+    return _chained()
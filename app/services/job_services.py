@@ -0,0 +1,563 @@
+"""
+Generación en segundo plano (jobs) para las rutas largas.
+
+``/roadmaps`` y ``/documents`` mantienen la conexión abierta durante toda la
+generación en dos etapas: ocupan conexiones y los clientes y proxies cortan por
+timeout. ``POST /jobs/roadmaps`` y ``POST /jobs/documents`` responden 202 con
+el ID del job apenas lo registran, y la generación corre en un pool acotado de
+``JOB_WORKERS`` workers del proceso. Cada proceso acepta hasta
+``JOB_QUEUE_MAX`` jobs sin terminar; con más responde 503 con Retry-After.
+
+El estado vive en la colección ``generation_jobs`` (queued → running →
+succeeded | failed | cancelled) y se consulta con ``GET /jobs/{job_id}``.
+Cada transición se escribe con precondición sobre el ``update_time`` de la
+anterior: una cancelación, que puede llegar a otro worker o a otra instancia,
+nunca queda pisada por un resultado que llega tarde. Con ``callback_url`` se
+hace un POST con el estado final, firmado con HMAC-SHA256 si está
+``JOB_WEBHOOK_SECRET``. Para que el servidor no sirva de puente a la red
+interna (SSRF), el host se resuelve y se rechaza si alguna de sus IPs no es
+pública, al recibir el job (422) y antes de cada envío; tampoco se siguen
+redirecciones. ``JOB_WEBHOOK_ALLOWED_HOSTS`` limita además los hosts.
+
+El pool es en memoria: si la instancia se apaga, los jobs que no terminan en
+``JOB_SHUTDOWN_GRACE_SECONDS`` quedan como failed (503) para que el cliente los
+reenvíe. El campo ``expires_at`` sirve para una política de TTL de Firestore.
+"""
+import asyncio
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import logging
+import os
+import socket
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+from fastapi import HTTPException
+from app.core import metrics, responses
+from app.core.deadline import detached_context, with_deadline
+from app.db.firestore_client import get_db, run_firestore, Collections
+from app.schemas.requests import ProcessFileRequest, TopicRequest
+from app.services import cache_services
+from app.services.batch_services import error_detail
+from app.services.db_services import save_conversation, save_roadmap_with_conversation_atomic
+from app.services.learning_path_services import generate_roadmap_logic, process_file_logic
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Jobs aceptados y sin terminar (en espera o corriendo) por proceso
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "600"))
+JOB_RETRY_AFTER_SECONDS = int(os.getenv("JOB_RETRY_AFTER_SECONDS", "30"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_SHUTDOWN_GRACE_SECONDS = float(os.getenv("JOB_SHUTDOWN_GRACE_SECONDS", "20"))
+JOB_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("JOB_WEBHOOK_TIMEOUT_SECONDS", "10"))
+JOB_WEBHOOK_MAX_ATTEMPTS = int(os.getenv("JOB_WEBHOOK_MAX_ATTEMPTS", "3"))
+JOB_WEBHOOK_SECRET = os.getenv("JOB_WEBHOOK_SECRET", "")
+# Hosts permitidos para callback_url, separados por coma ("hooks.example.com",
+# ".example.com" para sus subdominios). Vacío: cualquier host público
+JOB_WEBHOOK_ALLOWED_HOSTS = [
+    host.strip().lower() for host in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+# Solo para desarrollo: permite callbacks a localhost y redes privadas
+JOB_WEBHOOK_ALLOW_PRIVATE_NETWORKS = os.getenv("JOB_WEBHOOK_ALLOW_PRIVATE_NETWORKS", "false").lower() == "true"
+SIGNATURE_HEADER = "X-Webhook-Signature"
+
+ROADMAP = "roadmap"
+DOCUMENTS = "documents"
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL = {SUCCEEDED, FAILED, CANCELLED}
+
+# Campos del documento que no se devuelven al cliente
+_PRIVATE_FIELDS = ("user", "expires_at")
+
+
+class _Job:
+    """Un job aceptado por este proceso (el payload completo solo vive en memoria)"""
+
+    def __init__(self, job_id: str, kind: str, user_email: str, payload: Dict[str, Any], callback_url: Optional[str]):
+        self.job_id = job_id
+        self.kind = kind
+        self.user_email = user_email
+        self.payload = payload
+        self.callback_url = callback_url
+        self.enqueued_at = time.monotonic()
+        # update_time de la última transición escrita por este proceso
+        self.update_time = None
+
+
+_queue: Optional["asyncio.Queue[_Job]"] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_workers: List["asyncio.Task"] = []
+_jobs: Dict[str, _Job] = {}
+_running: Dict[str, "asyncio.Task"] = {}
+_background_tasks: Set["asyncio.Task"] = set()
+_stopping = False
+
+
+# ==================== GENERACIÓN ====================
+
+async def _run_roadmap(payload: Dict[str, Any], user_email: str) -> Dict[str, Any]:
+    """Lo mismo que POST /roadmaps: caché de temas, generación y guardado"""
+    request = TopicRequest(**payload)
+    response, cache_status, served_topic = await cache_services.resolve(
+        cache_services.ROADMAP,
+        request.topic,
+        lambda: generate_roadmap_logic(request, user_email),
+        exact=request.exact
+    )
+    outcome = {"result": response, "cache": cache_status}
+    if cache_status == "similar":
+        outcome["matched_topic"] = served_topic
+    # Igual que la ruta síncrona: si no se puede guardar, el job queda failed
+    saved = await save_roadmap_with_conversation_atomic(
+        user_email=user_email,
+        roadmap_title=request.topic,
+        roadmap_content=response,
+        prompt=f"Generar roadmap del tema: {request.topic}",
+        response=str(response)
+    )
+    outcome["roadmap_id"] = saved["roadmap_id"]
+    return outcome
+
+
+async def _run_documents(payload: Dict[str, Any], user_email: str) -> Dict[str, Any]:
+    """Lo mismo que POST /documents"""
+    request = ProcessFileRequest(**payload)
+    response = await process_file_logic(request)
+    await save_conversation(
+        user_email=user_email,
+        route="/documents",
+        prompt=f"Procesar archivo: {request.fileName}",
+        response=str(response)
+    )
+    return {"result": response}
+
+
+RUNNERS: Dict[str, Callable[[Dict[str, Any], str], Awaitable[Dict[str, Any]]]] = {
+    ROADMAP: _run_roadmap,
+    DOCUMENTS: _run_documents,
+}
+
+
+# ==================== ESTADO EN FIRESTORE ====================
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _job_ref(job_id: str):
+    return get_db().collection(Collections.GENERATION_JOBS).document(job_id)
+
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in job.items() if key not in _PRIVATE_FIELDS}
+
+
+async def _transition(job_id: str, updates: Dict[str, Any], expected_update_time) -> Optional[datetime]:
+    """
+    Escribe ``updates`` solo si el job no cambió desde ``expected_update_time``.
+    Retorna el nuevo update_time, o None si otro (p. ej. una cancelación) se adelantó
+    """
+    from google.api_core.exceptions import FailedPrecondition
+
+    try:
+        result = await run_firestore(
+            _job_ref(job_id).update,
+            {**updates, "updated_at": _now()},
+            option=get_db().write_option(last_update_time=expected_update_time),
+            operation="firestore update job"
+        )
+    except FailedPrecondition:
+        return None
+    return result.update_time
+
+
+async def _load(job_id: str, user_email: str):
+    """Snapshot del job; 404 si no existe o es de otro usuario"""
+    snapshot = await run_firestore(_job_ref(job_id).get, operation="firestore get job")
+    if not snapshot.exists or snapshot.to_dict().get("user") != user_email:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return snapshot
+
+
+# ==================== WEBHOOK ====================
+
+class UnsafeCallbackURL(ValueError):
+    """callback_url que apunta a un host no permitido o a una red interna"""
+
+
+def sign(body: bytes) -> str:
+    return "sha256=" + hmac.new(JOB_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def _host_allowed(host: str) -> bool:
+    if not JOB_WEBHOOK_ALLOWED_HOSTS:
+        return True
+    return any(
+        host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+        for allowed in JOB_WEBHOOK_ALLOWED_HOSTS
+    )
+
+
+def _check_address(address: str) -> None:
+    """UnsafeCallbackURL si la IP es loopback, privada, link-local, reservada o multicast"""
+    if JOB_WEBHOOK_ALLOW_PRIVATE_NETWORKS:
+        return
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if getattr(ip, "ipv4_mapped", None) is not None:
+        ip = ip.ipv4_mapped
+    if (
+        ip.is_loopback or ip.is_private or ip.is_link_local or ip.is_reserved
+        or ip.is_multicast or ip.is_unspecified or not ip.is_global
+    ):
+        raise UnsafeCallbackURL(f"callback_url apunta a una dirección no pública ({ip})")
+
+
+def validate_callback_url(url: str) -> None:
+    """
+    Valida el destino de un webhook: http/https, host permitido y todas las IPs
+    a las que resuelve públicas. Bloquea (resuelve DNS): llamar fuera del event loop
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise UnsafeCallbackURL("callback_url debe ser una URL http(s) con host")
+    if parts.username or parts.password:
+        raise UnsafeCallbackURL("callback_url no puede llevar credenciales")
+    if not _host_allowed(host):
+        raise UnsafeCallbackURL(f"callback_url con host no permitido ({host})")
+    try:
+        port = parts.port
+        infos = socket.getaddrinfo(host, port or (443 if parts.scheme == "https" else 80), proto=socket.IPPROTO_TCP)
+    except ValueError:
+        raise UnsafeCallbackURL("callback_url con puerto inválido")
+    except OSError as e:
+        raise UnsafeCallbackURL(f"No se pudo resolver el host de callback_url ({host}): {e}")
+    for info in infos:
+        _check_address(info[4][0])
+
+
+class _CheckedHTTPConnection(http.client.HTTPConnection):
+    """Revisa la IP a la que realmente se conectó (por si el DNS cambió tras validar)"""
+
+    def connect(self):
+        super().connect()
+        _check_address(self.sock.getpeername()[0])
+
+
+class _CheckedHTTPSConnection(http.client.HTTPSConnection):
+    def connect(self):
+        super().connect()
+        _check_address(self.sock.getpeername()[0])
+
+
+class _CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_CheckedHTTPConnection, req)
+
+
+class _CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_CheckedHTTPSConnection, req, context=self._context)
+
+
+def _build_opener() -> urllib.request.OpenerDirector:
+    """Opener sin HTTPRedirectHandler ni proxies: un 3xx cuenta como respuesta final"""
+    opener = urllib.request.OpenerDirector()
+    for handler in (
+        _CheckedHTTPHandler(),
+        _CheckedHTTPSHandler(),
+        urllib.request.HTTPDefaultErrorHandler(),
+        urllib.request.HTTPErrorProcessor(),
+    ):
+        opener.add_handler(handler)
+    return opener
+
+
+_opener = _build_opener()
+
+
+def _post(url: str, body: bytes, headers: Dict[str, str]) -> int:
+    validate_callback_url(url)
+    request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    with _opener.open(request, timeout=JOB_WEBHOOK_TIMEOUT_SECONDS) as response:
+        return response.status
+
+
+async def deliver_webhook(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    POST del estado final del job a su ``callback_url``. Reintenta con backoff
+    los errores de red, 408, 429 y 5xx; no reintenta si el destino dejó de ser
+    seguro. El resultado queda en el campo ``callback``
+    """
+    body = responses.dumps(public_view(job))
+    headers = {"Content-Type": "application/json", "User-Agent": "learning-path-jobs"}
+    if JOB_WEBHOOK_SECRET:
+        headers[SIGNATURE_HEADER] = sign(body)
+
+    status_code = None
+    blocked = None
+    attempts = 0
+    for attempts in range(1, JOB_WEBHOOK_MAX_ATTEMPTS + 1):
+        try:
+            status_code = await asyncio.to_thread(_post, job["callback_url"], body, headers)
+            break
+        except UnsafeCallbackURL as e:
+            blocked = str(e)
+            logger.warning(f"🚫 Webhook del job {job['job_id']} bloqueado: {e}")
+            break
+        except urllib.error.HTTPError as e:
+            status_code = e.code
+            if e.code < 500 and e.code not in (408, 429):
+                break
+        except (urllib.error.URLError, OSError) as e:
+            status_code = None
+            logger.warning(f"⚠️ Webhook del job {job['job_id']} falló (intento {attempts}): {e}")
+        if attempts < JOB_WEBHOOK_MAX_ATTEMPTS:
+            await asyncio.sleep(2 ** (attempts - 1))
+
+    delivered = status_code is not None and 200 <= status_code < 300
+    metrics.increment(f"jobs.webhook.{'delivered' if delivered else 'blocked' if blocked else 'failed'}")
+    callback = {"delivered": delivered, "status_code": status_code, "attempts": attempts}
+    if blocked:
+        callback["blocked"] = blocked
+    try:
+        await run_firestore(_job_ref(job["job_id"]).update, {"callback": callback}, operation="firestore update job")
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo registrar el webhook del job {job['job_id']}: {e}")
+    return callback
+
+
+def _notify(job: Dict[str, Any]) -> Optional["asyncio.Task"]:
+    if not job.get("callback_url"):
+        return None
+    # Fuera del contexto de la petición (sin su deadline): puede seguir después de responder
+    task = asyncio.create_task(deliver_webhook(job), context=detached_context())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+# ==================== POOL DE WORKERS ====================
+
+async def _execute(job: _Job) -> None:
+    update_time = await _transition(job.job_id, {"status": RUNNING, "started_at": _now()}, job.update_time)
+    if update_time is None:
+        logger.info(f"🛑 Job {job.job_id} cancelado antes de empezar")
+        return
+    job.update_time = update_time
+    metrics.observe_latency("jobs.queue_wait", (time.monotonic() - job.enqueued_at) * 1000)
+
+    start = time.perf_counter()
+    task = asyncio.create_task(
+        with_deadline(RUNNERS[job.kind](job.payload, job.user_email), operation=f"job {job.kind}"),
+        context=detached_context(JOB_TIMEOUT_SECONDS)
+    )
+    _running[job.job_id] = task
+    try:
+        updates = {"status": SUCCEEDED, **await task}
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            # Se está apagando el pool: shutdown() marca el job
+            raise
+        # Cancelado con DELETE: el documento ya dice cancelled
+        logger.info(f"🛑 Job {job.job_id} cancelado mientras corría")
+        return
+    except Exception as e:
+        logger.warning(f"⚠️ Job {job.job_id} ({job.kind}) falló: {e}")
+        updates = {"status": FAILED, "error": error_detail(e)}
+    finally:
+        _running.pop(job.job_id, None)
+    metrics.observe_latency(f"jobs.{job.kind}", (time.perf_counter() - start) * 1000)
+
+    finished_at = _now()
+    if await _transition(job.job_id, {**updates, "finished_at": finished_at}, job.update_time) is None:
+        # Cancelado desde otra instancia mientras corría: el resultado se descarta
+        logger.info(f"🛑 Job {job.job_id} cancelado mientras corría; resultado descartado")
+        return
+    metrics.increment(f"jobs.{updates['status']}")
+    _notify({
+        "job_id": job.job_id,
+        "kind": job.kind,
+        "callback_url": job.callback_url,
+        **updates,
+        "finished_at": finished_at,
+    })
+
+
+async def _worker() -> None:
+    while True:
+        job = await _queue.get()
+        if _stopping:
+            # Queda en _jobs: shutdown() lo marca como interrumpido
+            continue
+        try:
+            await _execute(job)
+        except Exception as e:
+            logger.error(f"❌ Error inesperado en el job {job.job_id}: {e}")
+        finally:
+            _jobs.pop(job.job_id, None)
+
+
+def _ensure_workers() -> None:
+    """Arranca el pool en el primer job (y de nuevo si cambió el event loop)"""
+    global _queue, _loop, _workers
+    loop = asyncio.get_running_loop()
+    if _queue is not None and _loop is loop:
+        return
+    _queue = asyncio.Queue()
+    _loop = loop
+    _workers = [
+        asyncio.create_task(_worker(), name=f"job-worker-{n}", context=detached_context())
+        for n in range(JOB_WORKERS)
+    ]
+    logger.info(f"🧵 Pool de jobs iniciado con {JOB_WORKERS} workers")
+
+
+# ==================== API ====================
+
+async def submit_job(
+    kind: str,
+    user_email: str,
+    payload: Dict[str, Any],
+    summary: Dict[str, Any],
+    callback_url: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Registra el job en Firestore y lo encola. ``payload`` es el cuerpo de la
+    ruta síncrona; ``summary`` es lo que se guarda de él (sin el archivo).
+    422 si ``callback_url`` no es un destino seguro; 503 si este proceso ya
+    tiene ``JOB_QUEUE_MAX`` jobs sin terminar
+    """
+    if callback_url:
+        try:
+            await asyncio.to_thread(validate_callback_url, callback_url)
+        except UnsafeCallbackURL as e:
+            metrics.increment("jobs.webhook.rejected")
+            raise HTTPException(status_code=422, detail=str(e))
+
+    if _stopping or len(_jobs) >= JOB_QUEUE_MAX:
+        metrics.increment("jobs.rejected")
+        raise HTTPException(
+            status_code=503,
+            detail="Demasiados jobs en curso; reintentar más tarde",
+            headers={"Retry-After": str(JOB_RETRY_AFTER_SECONDS)}
+        )
+
+    job = _Job(uuid.uuid4().hex, kind, user_email, payload, callback_url)
+    now = _now()
+    data = {
+        "job_id": job.job_id,
+        "kind": kind,
+        "user": user_email,
+        "status": QUEUED,
+        "request": summary,
+        "callback_url": callback_url,
+        "created_at": now,
+        "updated_at": now,
+        "expires_at": now + timedelta(days=JOB_RETENTION_DAYS),
+    }
+    # El lugar se reserva antes de esperar a Firestore
+    _jobs[job.job_id] = job
+    try:
+        result = await run_firestore(_job_ref(job.job_id).create, data, operation="firestore create job")
+    except BaseException:
+        _jobs.pop(job.job_id, None)
+        raise
+    job.update_time = result.update_time
+
+    _ensure_workers()
+    _queue.put_nowait(job)
+    metrics.increment("jobs.submitted")
+    logger.info(f"📥 Job {job.job_id} ({kind}) encolado para {user_email}")
+    return public_view(data)
+
+
+async def get_job(job_id: str, user_email: str) -> Dict[str, Any]:
+    snapshot = await _load(job_id, user_email)
+    return public_view(snapshot.to_dict())
+
+
+async def cancel_job(job_id: str, user_email: str) -> Dict[str, Any]:
+    """
+    Cancela un job en espera o en curso (cancelar uno ya cancelado no hace nada).
+    409 si ya terminó. Si corre en este proceso se corta de inmediato; si corre en
+    otro, su resultado se descarta al terminar
+    """
+    for _ in range(3):
+        snapshot = await _load(job_id, user_email)
+        job = snapshot.to_dict()
+        if job["status"] == CANCELLED:
+            return public_view(job)
+        if job["status"] in TERMINAL:
+            raise HTTPException(status_code=409, detail=f"El job ya terminó ({job['status']})")
+        updates = {"status": CANCELLED, "finished_at": _now()}
+        if await _transition(job_id, updates, snapshot.update_time) is not None:
+            break
+    else:
+        raise HTTPException(status_code=409, detail="El job cambió mientras se cancelaba; reintentar")
+
+    task = _running.get(job_id)
+    if task is not None:
+        task.cancel()
+    metrics.increment("jobs.cancelled")
+    logger.info(f"🛑 Job {job_id} cancelado por {user_email}")
+    job.update(updates)
+    _notify(job)
+    return public_view(job)
+
+
+def queue_report() -> Dict[str, Any]:
+    return {"workers": len(_workers), "pending": len(_jobs), "running": len(_running), "max_pending": JOB_QUEUE_MAX}
+
+
+async def shutdown() -> None:
+    """
+    Deja de aceptar jobs, espera hasta ``JOB_SHUTDOWN_GRACE_SECONDS`` a los que
+    están corriendo y marca como failed (503) los que quedan sin terminar
+    """
+    global _stopping, _queue
+    _stopping = True
+    if _running:
+        await asyncio.wait(list(_running.values()), timeout=JOB_SHUTDOWN_GRACE_SECONDS)
+    interrupted = list(_jobs.values())
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queue = None
+
+    notifications = []
+    for job in interrupted:
+        updates = {
+            "status": FAILED,
+            "error": {"status_code": 503, "detail": "La instancia se apagó antes de terminar; reenviar el job"},
+            "finished_at": _now(),
+        }
+        try:
+            if await _transition(job.job_id, updates, job.update_time) is None:
+                continue
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo marcar el job {job.job_id} como interrumpido: {e}")
+            continue
+        task = _notify({"job_id": job.job_id, "kind": job.kind, "callback_url": job.callback_url, **updates})
+        if task is not None:
+            notifications.append(task)
+    _jobs.clear()
+    if interrupted:
+        logger.warning(f"⚠️ {len(interrupted)} jobs interrumpidos al apagar")
+    if notifications:
+        await asyncio.wait(notifications, timeout=JOB_WEBHOOK_TIMEOUT_SECONDS)
+    _stopping = False
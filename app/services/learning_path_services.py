@@ -1,9 +1,16 @@
+import copy
 import json
+import logging
 import re
 from fastapi import HTTPException
+from app.core.logging_config import log_payload
 from app.services.ai_services import ask_gemini
+from app.services.cache_services import normalize_topic
+from app.services.question_bank_services import parse_questions
 # from app.services.pubsub_services import publish_credit_update  # Comentado temporalmente
 
+logger = logging.getLogger(__name__)
+
 async def process_file_logic(request):
     """
     Lógica para procesar un archivo y obtener temas principales.
@@ -15,8 +22,8 @@ async def process_file_logic(request):
         f"lista con únicamente los 3 temas principales y nada más, es decir: [\"tema1\", \"tema2\", \"tema3\"]"
     )
 
-    themes = await ask_gemini(full_prompt, model="gemini-2.5-flash-lite")
-    print("RESPUESTA DE LA IA", themes)
+    themes = await ask_gemini(full_prompt, task="documents")
+    log_payload(logger, "Temas extraídos por la IA", themes, route="/documents")
     
     match = re.search(r'\[.*?\]', themes, re.DOTALL)
     if not match:
@@ -49,8 +56,8 @@ async def generate_roadmap_logic(request, user_email: str):
         f"De lo que se genere , la longitud de cada subtema y sub-subtema debe ser MÁXIMO 55 caracteres."
     )
 
-    response = await ask_gemini(full_prompt, model="gemini-2.5-flash")
-    print("RESPUESTA DE LA IA", response)
+    response = await ask_gemini(full_prompt, task="roadmap")
+    log_payload(logger, "Roadmap generado por la IA", response, route="/roadmaps")
     cleaned = (
         response.replace("```json", "")
         .replace("```python", "")
@@ -67,7 +74,7 @@ async def generate_roadmap_logic(request, user_email: str):
     try:
         roadmap = json.loads(json_text)
     except Exception as e:
-        print("Error al parsear JSON:", e)
+        logger.warning(f"⚠️ Error al parsear JSON del roadmap: {e}")
         raise HTTPException(status_code=400, detail=f"JSON inválido extraído de la IA: {e}")
 
     second_prompt = (
@@ -77,7 +84,7 @@ async def generate_roadmap_logic(request, user_email: str):
         f"Aquí tienes los datos base: {json_text}"
     )
 
-    second_response = await ask_gemini(full_prompt, model="gemini-2.5-flash")
+    second_response = await ask_gemini(second_prompt, task="roadmap_details")
     cleaned_extra = (
         second_response.replace("```json", "")
         .replace("```python", "")
@@ -97,9 +104,9 @@ async def generate_roadmap_logic(request, user_email: str):
     # Descontar crédito (comentado temporalmente)
     # try:
     #     publish_credit_update(user_email, -1)  
-    #     print(f"💰 Crédito descontado a {user_email}")
+    #     logger.info(f"💰 Crédito descontado a {user_email}")
     # except Exception as e:
-    #     print(f"⚠️ Error publicando descuento de crédito: {e}")
+    #     logger.warning(f"⚠️ Error publicando descuento de crédito: {e}")
 
     return {
         "roadmap": roadmap,
@@ -107,12 +114,14 @@ async def generate_roadmap_logic(request, user_email: str):
     }
 
 
-async def generate_questions_logic(request):
+async def generate_questions_logic(request, node=None):
     """
     Lógica para generar preguntas.
+    Retorna la lista de preguntas validadas: [{"id", "enunciado", "respuesta"}].
     """
+    subject = f"{node} (dentro de {request.topic})" if node else request.topic
     full_prompt = (
-        f"NECESITO UNA RESPUESTA ULTRA RAPIDA Y COMPLETA: Eres un experto en la creación de preguntas de verdadero o falso. Genera una lista de preguntas basadas en los siguientes temas e información: {request.topic}. "
+        f"NECESITO UNA RESPUESTA ULTRA RAPIDA Y COMPLETA: Eres un experto en la creación de preguntas de verdadero o falso. Genera una lista de preguntas basadas en los siguientes temas e información: {subject}. "
         f"El formato de la respuesta debe ser exclusivamente una lista en formato JSON con objetos que contengan un 'enunciado' y una 'respuesta' booleana (true o false). "
         f"No incluyas ninguna otra información, explicaciones adicionales ni texto fuera del formato JSON. "
         f"\n\nEjemplo del formato de respuesta esperado:"
@@ -124,17 +133,20 @@ async def generate_questions_logic(request):
         f"Genera al menos 5 preguntas y un máximo de 10. Cada pregunta debe ser clara, concisa y directamente relacionada con el tema."
     )
 
-    response = await ask_gemini(full_prompt, model="gemini-2.5-flash")
-    print("RESPUESTA DE LA IA", response)
-    parse_response = response.replace("json", "").replace("```", "")
+    response = await ask_gemini(full_prompt, task="questions")
+    log_payload(logger, "Preguntas generadas por la IA", response, route="/questions")
+    questions = parse_questions(response)
+    if not questions:
+        logger.warning(f"⚠️ La IA no devolvió preguntas válidas para: {subject}")
+        raise HTTPException(status_code=500, detail="Error procesando respuesta de IA")
 
-    return parse_response
+    return questions
 
 async def related_topics_logic(request):
     """
     Lógica para obtener temas relacionados a un tema principal.
     """
-    print("ESTO ES LO QUE LLEGA:", request)
+    logger.debug(f"Buscando temas relacionados con: {request.topic}")
     full_prompt = (
         f"Eres un experto en la generación de temas relacionados a un tema principal. "
         f"El tema principal es '{request.topic}'. Quiero que el formato de la respuesta sea una "
@@ -143,15 +155,142 @@ async def related_topics_logic(request):
         f"Cada tema debe tener una longitud máxima de 45 caracteres."
     )
 
-    response = await ask_gemini(full_prompt, model="gemini-2.5-flash")
-    print("RESPUESTA DE LA IA", response)
+    response = await ask_gemini(full_prompt, task="related_topics")
+    log_payload(logger, "Temas relacionados generados por la IA", response, route="/related-topics")
 
     clean_response = response.replace("json", "").replace("```", "").strip()
 
     try:
         topics = json.loads(clean_response)
     except Exception as e:
-        print("Error parseando respuesta de la IA:", e)
+        logger.warning(f"⚠️ Error parseando respuesta de la IA: {e}")
         raise HTTPException(status_code=500, detail="Error procesando respuesta de IA")
 
     return {"related_topics": topics}
+
+
+def _node_names(subtree) -> set:
+    """Nombres de todos los subtemas dentro de un nodo (claves y hojas)"""
+    names = set()
+    if isinstance(subtree, dict):
+        for key, value in subtree.items():
+            names.add(key)
+            names |= _node_names(value)
+    elif isinstance(subtree, list):
+        for item in subtree:
+            if isinstance(item, str):
+                names.add(item)
+            else:
+                names |= _node_names(item)
+    return names
+
+
+def find_roadmap_node(tree, node: str):
+    """
+    Busca ``node`` en el árbol del roadmap (sin distinguir mayúsculas ni tildes).
+    Retorna ``(contenedor, clave_o_índice)`` o None si no existe.
+    """
+    target = normalize_topic(node)
+    if isinstance(tree, dict):
+        for key, value in tree.items():
+            if normalize_topic(key) == target:
+                return tree, key
+            found = find_roadmap_node(value, node)
+            if found is not None:
+                return found
+    elif isinstance(tree, list):
+        for index, item in enumerate(tree):
+            if isinstance(item, str):
+                if normalize_topic(item) == target:
+                    return tree, index
+            else:
+                found = find_roadmap_node(item, node)
+                if found is not None:
+                    return found
+    return None
+
+
+def _merge_subtree(current, new):
+    """Agrega a ``current`` lo que ``new`` trae de más, sin quitar nada"""
+    if isinstance(current, list) and isinstance(new, list):
+        known = {normalize_topic(item) for item in current if isinstance(item, str)}
+        return current + [item for item in new if isinstance(item, str) and normalize_topic(item) not in known]
+    if isinstance(current, dict) and isinstance(new, dict):
+        merged = dict(current)
+        for key, value in new.items():
+            merged[key] = _merge_subtree(merged[key], value) if key in merged else value
+        return merged
+    return current
+
+
+async def regenerate_roadmap_node_logic(topic: str, content: dict, node: str, mode: str = "regenerate", instruction: str = None):
+    """
+    Lógica para regenerar ("regenerate") o ampliar ("enrich") un solo nodo de un roadmap guardado.
+    Hace una sola llamada al modelo con el nodo y sus hijos, y mezcla el resultado en el roadmap.
+    Retorna ``(contenido_nuevo, cambios)`` donde cambios describe solo lo que tocó el nodo.
+    """
+    roadmap = copy.deepcopy(content.get("roadmap") or {})
+    extra_info = dict(content.get("extra_info") or {})
+
+    found = find_roadmap_node(roadmap, node)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"El nodo '{node}' no existe en el roadmap")
+    container, key = found
+    name = key if isinstance(container, dict) else container[key]
+    # Las hojas (sub-subtemas) no tienen hijos: solo se regenera su descripción
+    current = container[key] if isinstance(container, dict) else None
+
+    action = (
+        "ampliar (mantén lo que ya tiene y agrega lo que falte)" if mode == "enrich"
+        else "rehacer desde cero"
+    )
+    shape = (
+        f"Su contenido actual es: {json.dumps(current, ensure_ascii=False)}. "
+        if current is not None else "Es un tema final, sin subtemas. "
+    )
+    full_prompt = (
+        f"NECESITO UNA RESPUESTA ULTRA RAPIDA Y COMPLETA: Eres un experto en la creación de rutas de aprendizaje. "
+        f"En la ruta de aprendizaje sobre {topic} quiero {action} un solo nodo: '{name}'. {shape}"
+        + (f"Indicación del usuario: {instruction}. " if instruction else "")
+        + f"Devuelve exclusivamente un JSON con dos claves: \"subtree\", con el nuevo contenido del nodo en el mismo formato que el actual "
+        f"(null si es un tema final), y \"extra_info\", un diccionario donde la clave sea '{name}' y cada subtema del nodo, "
+        f"y el valor una descripción detallada con tiempo estimado y un link real. "
+        f"La longitud de cada subtema debe ser MÁXIMO 55 caracteres."
+    )
+
+    response = await ask_gemini(full_prompt, task="roadmap_node")
+    log_payload(logger, "Nodo de roadmap generado por la IA", response, route="/roadmaps", node=name)
+
+    match = re.search(r'\{.*\}', response.replace("```json", "").replace("```", ""), re.DOTALL)
+    try:
+        result = json.loads(match.group(0)) if match else None
+    except Exception as e:
+        logger.warning(f"⚠️ Error al parsear JSON del nodo: {e}")
+        result = None
+    if not isinstance(result, dict):
+        raise HTTPException(status_code=500, detail="Error procesando respuesta de IA")
+
+    subtree = result.get("subtree")
+    if current is not None:
+        if type(subtree) is not type(current):
+            logger.warning(f"⚠️ La IA cambió el formato del nodo '{name}'")
+            raise HTTPException(status_code=500, detail="Error procesando respuesta de IA")
+        if mode == "enrich":
+            subtree = _merge_subtree(current, subtree)
+        else:
+            # Las descripciones de subtemas que ya no están se descartan
+            for removed in _node_names(current) - _node_names(subtree):
+                extra_info.pop(removed, None)
+        container[key] = subtree
+    else:
+        subtree = None
+
+    allowed = {name} | _node_names(subtree)
+    new_info = {
+        k: v for k, v in (result.get("extra_info") or {}).items()
+        if k in allowed and isinstance(v, str)
+    }
+    extra_info.update(new_info)
+
+    changes = {"node": name, "mode": mode, "subtree": subtree, "extra_info": new_info}
+    return {"roadmap": roadmap, "extra_info": extra_info}, changes
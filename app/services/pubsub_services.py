@@ -1,16 +1,152 @@
+"""
+Publicación de eventos a Pub/Sub sin bloquear a quien publica.
+
+``publish_event`` entrega el mensaje al cliente de Pub/Sub (que lo agrupa en
+batches según ``PUBSUB_BATCH_*``) y vuelve enseguida; la confirmación se maneja
+en un callback que registra la latencia de publicación en ``app.core.metrics``.
+Los eventos que fallan, o que el control de flujo rechaza, se agregan a un
+outbox local en NDJSON (``PUBSUB_OUTBOX_PATH``) que se vuelve a publicar al
+arrancar el servicio. El outbox es compartido por los workers de uvicorn, así
+que se coordina con locks de archivo (``fcntl``): uno solo re-publica a la vez.
+"""
+import fcntl
+import glob
 import json
+import logging
 import os
-from google.cloud import pubsub_v1
-from google.api_core import retry
+import threading
+import time
+import uuid
+from concurrent import futures
+from typing import Any, Dict, Optional
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
 
 PROJECT_ID = os.getenv("PROJECT_ID")
 TOPIC_ID = os.getenv("TOPIC_ID", "preprocess-topic")
-publisher = pubsub_v1.PublisherClient()
-topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
 
-publish_retry = retry.Retry(initial=1.0, maximum=10.0, multiplier=2.0, deadline=30.0)
+# Batching del cliente: se envía cuando se junta cualquiera de los tres límites
+PUBSUB_BATCH_MAX_MESSAGES = int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", "100"))
+PUBSUB_BATCH_MAX_BYTES = int(os.getenv("PUBSUB_BATCH_MAX_BYTES", str(1024 * 1024)))
+PUBSUB_BATCH_MAX_LATENCY = float(os.getenv("PUBSUB_BATCH_MAX_LATENCY", "0.05"))
+# Control de flujo: por encima de esto los eventos van directo al outbox
+PUBSUB_MAX_OUTSTANDING_MESSAGES = int(os.getenv("PUBSUB_MAX_OUTSTANDING_MESSAGES", "1000"))
+PUBSUB_MAX_OUTSTANDING_BYTES = int(os.getenv("PUBSUB_MAX_OUTSTANDING_BYTES", str(10 * 1024 * 1024)))
+PUBSUB_OUTBOX_PATH = os.getenv("PUBSUB_OUTBOX_PATH", "./data/pubsub_outbox.ndjson")
+
+# El cliente de Pub/Sub se construye en el primer uso, no al importar el módulo
+_publisher = None
+_topic_path = None
+_publisher_lock = threading.Lock()
+_outbox_lock = threading.Lock()
+# Publicaciones sin confirmar, para esperarlas al apagar
+_pending: Dict[futures.Future, Dict[str, Any]] = {}
+_pending_lock = threading.Lock()
+
+
+def get_publisher():
+    """Retorna (publisher, topic_path), creándolos la primera vez"""
+    global _publisher, _topic_path
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                from google.cloud import pubsub_v1
+                from google.cloud.pubsub_v1 import types
+
+                publisher = pubsub_v1.PublisherClient(
+                    batch_settings=types.BatchSettings(
+                        max_messages=PUBSUB_BATCH_MAX_MESSAGES,
+                        max_bytes=PUBSUB_BATCH_MAX_BYTES,
+                        max_latency=PUBSUB_BATCH_MAX_LATENCY,
+                    ),
+                    publisher_options=types.PublisherOptions(
+                        flow_control=types.PublishFlowControl(
+                            message_limit=PUBSUB_MAX_OUTSTANDING_MESSAGES,
+                            byte_limit=PUBSUB_MAX_OUTSTANDING_BYTES,
+                            limit_exceeded_behavior=types.LimitExceededBehavior.ERROR,
+                        )
+                    ),
+                )
+                _topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+                _publisher = publisher
+    return _publisher, _topic_path
+
+
+def _append_outbox(line: str) -> None:
+    """
+    Agrega la línea con el archivo bloqueado. Si un replay lo renombró entre el
+    open y el lock, se abre de nuevo: la línea nunca cae en un archivo ya leído
+    """
+    while True:
+        with open(PUBSUB_OUTBOX_PATH, "a", encoding="utf-8") as outbox:
+            fcntl.flock(outbox, fcntl.LOCK_EX)
+            try:
+                current = os.stat(PUBSUB_OUTBOX_PATH).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(outbox.fileno()).st_ino:
+                continue
+            outbox.write(line)
+            outbox.flush()
+            os.fsync(outbox.fileno())
+            return
+
+
+def _write_outbox(message: Dict[str, Any], reason: str) -> None:
+    """Agrega el evento al outbox (fsync para que sobreviva a un reinicio)"""
+    line = json.dumps(message, ensure_ascii=False) + "\n"
+    try:
+        with _outbox_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(PUBSUB_OUTBOX_PATH)), exist_ok=True)
+            _append_outbox(line)
+        metrics.increment("pubsub.outbox_written")
+        logger.warning(f"📥 Evento {message.get('event')} guardado en el outbox: {reason}",
+                       extra={"event_id": message.get("event_id")})
+    except OSError as e:
+        # Último recurso: que al menos quede en los logs para reconciliar a mano
+        metrics.increment("pubsub.lost")
+        logger.error(f"❌ No se pudo escribir el outbox de Pub/Sub: {e}", extra={"pubsub_message": message})
+
+
+def publish_event(message: Dict[str, Any]) -> Optional[futures.Future]:
+    """
+    Publica un evento sin esperar la confirmación.
+    Retorna el future de Pub/Sub, o None si el evento fue directo al outbox.
+    """
+    message.setdefault("event_id", uuid.uuid4().hex)
+    data = json.dumps(message).encode("utf-8")
+    started = time.perf_counter()
+
+    try:
+        publisher, topic_path = get_publisher()
+        future = publisher.publish(topic_path, data=data)
+    except Exception as e:
+        # Incluye FlowControlLimitError: mejor el outbox que frenar la petición
+        metrics.increment("pubsub.rejected")
+        _write_outbox(message, f"{type(e).__name__}: {e}")
+        return None
 
-def publish_credit_update(email: str, credits_change: int):
+    with _pending_lock:
+        _pending[future] = message
+
+    def _on_done(done: futures.Future) -> None:
+        with _pending_lock:
+            _pending.pop(done, None)
+        metrics.observe_latency("pubsub.publish", (time.perf_counter() - started) * 1000)
+        error = done.exception()
+        if error is not None:
+            metrics.increment("pubsub.failed")
+            _write_outbox(message, str(error))
+        else:
+            metrics.increment("pubsub.published")
+            logger.debug(f"📨 Mensaje publicado a {topic_path}", extra={"event": message.get("event")})
+
+    future.add_done_callback(_on_done)
+    return future
+
+
+def publish_credit_update(email: str, credits_change: int) -> Optional[futures.Future]:
     message = {
         "event": "credit_update",
         "data": {
@@ -18,7 +154,71 @@ def publish_credit_update(email: str, credits_change: int):
             "credits_change": credits_change
         }
     }
-    data = json.dumps(message).encode("utf-8")
-    future = publisher.publish(topic_path, data=data)
-    print(f"📨 Mensaje publicado a {topic_path}: {message}")
-    return future.result()
\ No newline at end of file
+    return publish_event(message)
+
+
+def _replay_file(path: str) -> int:
+    """Re-publica un archivo ``.replay`` y lo borra; retorna cuántos eventos"""
+    replayed = 0
+    with open(path, encoding="utf-8") as outbox:
+        # Espera a un _append_outbox que lo haya abierto antes del renombre
+        fcntl.flock(outbox, fcntl.LOCK_EX)
+        for line in outbox:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logger.warning(f"⚠️ Línea inválida en el outbox de Pub/Sub descartada: {line[:200]}")
+                continue
+            publish_event(message)
+            replayed += 1
+    os.remove(path)
+    return replayed
+
+
+def replay_outbox() -> int:
+    """
+    Vuelve a publicar los eventos del outbox (se corre en el warm-up de arranque).
+    Los que vuelvan a fallar regresan al outbox por el callback. Retorna cuántos.
+    Con varios workers, el primero que toma el lock re-publica y los demás no
+    hacen nada. También retoma los ``.replay`` que dejó un replay cortado a la
+    mitad (el consumidor deduplica por event_id lo que ya se había publicado).
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(PUBSUB_OUTBOX_PATH)), exist_ok=True)
+    with open(f"{PUBSUB_OUTBOX_PATH}.lock", "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("📤 Otro worker está re-publicando el outbox de Pub/Sub")
+            return 0
+
+        # Con el lock tomado, cualquier .replay es de un replay que no terminó
+        pending = sorted(glob.glob(f"{glob.escape(PUBSUB_OUTBOX_PATH)}.*.replay"))
+        replaying = f"{PUBSUB_OUTBOX_PATH}.{int(time.time())}.{os.getpid()}.replay"
+        try:
+            os.replace(PUBSUB_OUTBOX_PATH, replaying)
+            pending.append(replaying)
+        except FileNotFoundError:
+            pass
+        if not pending:
+            return 0
+
+        replayed = sum(_replay_file(path) for path in pending)
+
+    metrics.increment("pubsub.outbox_replayed", replayed)
+    logger.info(f"📤 Outbox de Pub/Sub: {replayed} eventos re-publicados")
+    return replayed
+
+
+def shutdown_publisher(timeout: float = 5.0) -> None:
+    """Espera las publicaciones pendientes; las que no terminan a tiempo van al outbox"""
+    with _pending_lock:
+        pending = dict(_pending)
+    if not pending:
+        return
+    _, not_done = futures.wait(list(pending), timeout=timeout)
+    # Pueden terminar llegando igual: el consumidor deduplica por event_id
+    for future in not_done:
+        _write_outbox(pending[future], "sin confirmar al apagar")
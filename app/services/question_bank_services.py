@@ -0,0 +1,218 @@
+"""
+Banco de preguntas persistente por tema (y nodo del roadmap).
+
+Las preguntas de verdadero/falso generadas por el modelo se validan y se
+acumulan en la colección ``question_banks``. Cada pedido se sirve tomando una
+muestra del banco que excluye las preguntas que el usuario ya vio (registradas
+en ``question_history``); el modelo solo se llama cuando el banco no existe o
+se está quedando corto, y en ese caso en segundo plano.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional, Set
+from fastapi import HTTPException
+from app.core.deadline import detached_context, with_deadline
+from app.db.firestore_client import get_db, run_firestore, Collections
+from app.schemas.requests import TopicRequest
+from app.services.cache_services import normalize_topic
+
+logger = logging.getLogger(__name__)
+
+QUESTION_BANK_MIN_SIZE = int(os.getenv("QUESTION_BANK_MIN_SIZE", "20"))
+QUESTION_BANK_MAX_SIZE = int(os.getenv("QUESTION_BANK_MAX_SIZE", "200"))
+# Si al usuario le quedan menos preguntas sin ver que esto, se rellena el banco
+QUESTION_BANK_LOW_WATERMARK = int(os.getenv("QUESTION_BANK_LOW_WATERMARK", "10"))
+MAX_STATEMENT_CHARS = 300
+
+# Rellenos en curso por banco (uno a la vez por instancia)
+_refilling: Dict[str, "asyncio.Task"] = {}
+_background_tasks: Set["asyncio.Task"] = set()
+
+
+def bank_id(topic: str, node: Optional[str] = None) -> str:
+    key = f"{normalize_topic(topic)}|{normalize_topic(node or '')}"
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def _history_id(user_email: str, bank: str) -> str:
+    return hashlib.sha256(f"{user_email}|{bank}".encode()).hexdigest()[:32]
+
+
+def question_id(statement: str) -> str:
+    return hashlib.sha256(normalize_topic(statement).encode()).hexdigest()[:12]
+
+
+def parse_questions(raw: str) -> List[Dict[str, Any]]:
+    """
+    Extrae y valida la lista de preguntas de la respuesta del modelo.
+    Descarta entradas sin enunciado de texto o sin respuesta booleana, y repetidas.
+    """
+    cleaned = raw.replace("```json", "").replace("```", "").strip()
+    match = re.search(r'\[.*\]', cleaned, re.DOTALL)
+    if not match:
+        return []
+    try:
+        items = json.loads(match.group(0))
+    except ValueError:
+        return []
+
+    questions: Dict[str, Dict[str, Any]] = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        statement = item.get("enunciado")
+        answer = item.get("respuesta")
+        if not isinstance(statement, str) or not isinstance(answer, bool):
+            continue
+        statement = " ".join(statement.split())
+        if not statement or len(statement) > MAX_STATEMENT_CHARS:
+            continue
+        qid = question_id(statement)
+        questions.setdefault(qid, {"id": qid, "enunciado": statement, "respuesta": answer})
+    return list(questions.values())
+
+
+def _load(topic: str, node: Optional[str], user_email: Optional[str]):
+    """Lee el banco y el historial del usuario en una sola llamada (get_all)"""
+    db = get_db()
+    bank = bank_id(topic, node)
+    refs = [db.collection(Collections.QUESTION_BANKS).document(bank)]
+    if user_email:
+        refs.append(db.collection(Collections.QUESTION_HISTORY).document(_history_id(user_email, bank)))
+
+    bank_data, seen = None, []
+    for snapshot in db.get_all(refs):
+        if not snapshot.exists:
+            continue
+        if snapshot.id == bank:
+            bank_data = snapshot.to_dict()
+        else:
+            seen = snapshot.to_dict().get("seen", [])
+    return bank_data, set(seen)
+
+
+def _add_questions(topic: str, node: Optional[str], questions: List[Dict[str, Any]]) -> None:
+    from google.cloud.firestore import ArrayUnion
+
+    get_db().collection(Collections.QUESTION_BANKS).document(bank_id(topic, node)).set({
+        "topic": topic,
+        "node": node,
+        "normalized_topic": normalize_topic(topic),
+        "questions": ArrayUnion(questions),
+        "updated_at": time.time(),
+    }, merge=True)
+
+
+def _mark_seen(user_email: str, topic: str, node: Optional[str], ids: List[str]) -> None:
+    from google.cloud.firestore import ArrayUnion
+
+    bank = bank_id(topic, node)
+    get_db().collection(Collections.QUESTION_HISTORY).document(_history_id(user_email, bank)).set({
+        "user": user_email,
+        "bank_id": bank,
+        "seen": ArrayUnion(ids),
+        "updated_at": time.time(),
+    }, merge=True)
+
+
+async def refill_bank(topic: str, node: Optional[str] = None) -> int:
+    """Genera un lote de preguntas con el modelo y lo agrega al banco. Retorna cuántas"""
+    from app.services.learning_path_services import generate_questions_logic
+
+    questions = await generate_questions_logic(TopicRequest(topic=topic), node=node)
+    await asyncio.to_thread(_add_questions, topic, node, questions)
+    logger.info(f"🧠 Banco de preguntas '{topic}' ({node or 'general'}) +{len(questions)} preguntas")
+    return len(questions)
+
+
+def _run_in_background(coro, description: str) -> "asyncio.Task":
+    # Sin el deadline de la petición que la originó: puede seguir después de responder
+    task = asyncio.create_task(coro, context=detached_context())
+    _background_tasks.add(task)
+
+    def _done(finished: "asyncio.Task"):
+        _background_tasks.discard(finished)
+        if not finished.cancelled() and finished.exception() is not None:
+            logger.warning(f"⚠️ {description} falló: {finished.exception()}")
+
+    task.add_done_callback(_done)
+    return task
+
+
+def schedule_refill(topic: str, node: Optional[str] = None) -> "asyncio.Task":
+    """Rellena el banco en segundo plano (sin duplicar un relleno ya en curso)"""
+    bank = bank_id(topic, node)
+    task = _refilling.get(bank)
+    if task is None or task.done():
+        task = _run_in_background(refill_bank(topic, node), f"Relleno del banco '{topic}'")
+        _refilling[bank] = task
+        task.add_done_callback(lambda _: _refilling.pop(bank, None))
+    return task
+
+
+async def ensure_bank(topic: str, node: Optional[str] = None, min_size: int = QUESTION_BANK_MIN_SIZE) -> bool:
+    """Rellena el banco si tiene menos de ``min_size`` preguntas. Retorna si generó"""
+    bank_data, _ = await asyncio.to_thread(_load, topic, node, None)
+    if bank_data and len(bank_data.get("questions", [])) >= min_size:
+        return False
+    await refill_bank(topic, node)
+    return True
+
+
+async def sample_questions(
+    topic: str,
+    user_email: Optional[str] = None,
+    node: Optional[str] = None,
+    count: int = 5
+) -> Dict[str, Any]:
+    """
+    Muestra de ``count`` preguntas del banco, priorizando las que el usuario no vio.
+
+    Returns:
+        dict: ``{"topic", "node", "questions": [{"id", "enunciado", "respuesta"}], "bank_size"}``
+    """
+    bank_data, seen = await run_firestore(_load, topic, node, user_email, operation="firestore question bank")
+    questions = (bank_data or {}).get("questions", [])
+
+    if not questions:
+        # Primer pedido para este tema: hay que generar antes de responder
+        await with_deadline(asyncio.shield(schedule_refill(topic, node)), "question bank refill")
+        bank_data, seen = await run_firestore(_load, topic, node, user_email, operation="firestore question bank")
+        questions = (bank_data or {}).get("questions", [])
+        if not questions:
+            raise HTTPException(status_code=502, detail="No se pudieron generar preguntas para este tema")
+
+    unseen = [q for q in questions if q["id"] not in seen]
+    picked = random.sample(unseen, min(count, len(unseen)))
+    if len(picked) < count:
+        # El usuario ya vio casi todo: completar con preguntas repetidas
+        repeated = [q for q in questions if q["id"] in seen]
+        picked += random.sample(repeated, min(count - len(picked), len(repeated)))
+
+    remaining = len(unseen) - len(picked)
+    if (
+        len(questions) < QUESTION_BANK_MAX_SIZE
+        and (len(questions) < QUESTION_BANK_MIN_SIZE or remaining < QUESTION_BANK_LOW_WATERMARK)
+    ):
+        schedule_refill(topic, node)
+
+    if user_email and picked:
+        _run_in_background(
+            asyncio.to_thread(_mark_seen, user_email, topic, node, [q["id"] for q in picked]),
+            f"Registro de preguntas vistas de {user_email}"
+        )
+
+    return {
+        "topic": topic,
+        "node": node,
+        "questions": [
+            {"id": q["id"], "enunciado": q["enunciado"], "respuesta": q["respuesta"]} for q in picked
+        ],
+        "bank_size": len(questions),
+    }
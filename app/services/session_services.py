@@ -0,0 +1,187 @@
+"""
+Registro de sesiones de usuario con expiración por inactividad.
+
+Cada usuario tiene un ``session_id`` que agrupa sus conversaciones. La sesión
+rota cuando pasa más de ``SESSION_IDLE_TIMEOUT_SECONDS`` sin actividad. Las
+sesiones vivas se guardan en un LRU acotado en memoria (``SESSION_CACHE_SIZE``)
+y, si ``SESSION_STORE=firestore``, también en la colección ``user_sessions``,
+para que todos los workers e instancias le den al usuario la misma sesión.
+Con varios workers en un nodo, el caché compartido (``shared_cache``) tiene el
+estado más reciente de cada sesión y evita que cada worker rote la suya por su cuenta.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from app.core import responses, shared_cache
+from app.db.firestore_client import get_db, firestore_breaker, Collections
+
+logger = logging.getLogger(__name__)
+
+SESSION_IDLE_TIMEOUT_SECONDS = int(os.getenv("SESSION_IDLE_TIMEOUT_SECONDS", "1800"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_STORE = os.getenv("SESSION_STORE", "firestore").lower()
+# Cada cuánto se persiste el last_seen de una sesión activa (no en cada petición)
+SESSION_TOUCH_INTERVAL_SECONDS = int(os.getenv("SESSION_TOUCH_INTERVAL_SECONDS", "60"))
+# Timeout de las lecturas/escrituras en Firestore (corren en el camino de cada petición)
+SESSION_STORE_TIMEOUT_SECONDS = float(os.getenv("SESSION_STORE_TIMEOUT_SECONDS", "2"))
+
+NODE_NAMESPACE = "session"
+
+
+@dataclass
+class _Session:
+    session_id: str
+    last_seen: float
+    persisted_at: float
+
+
+def _doc_id(user_email: str) -> str:
+    return hashlib.sha256(user_email.encode()).hexdigest()[:32]
+
+
+class SessionRegistry:
+    """
+    LRU de sesiones por email con expiración por inactividad.
+    Con ``shared=True`` las sesiones se leen y escriben en Firestore
+    cuando no están en memoria o cuando hay que refrescar su ``last_seen``.
+    """
+
+    def __init__(
+        self,
+        max_size: int = SESSION_CACHE_SIZE,
+        idle_timeout: float = SESSION_IDLE_TIMEOUT_SECONDS,
+        shared: bool = SESSION_STORE == "firestore",
+        touch_interval: float = SESSION_TOUCH_INTERVAL_SECONDS
+    ):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.shared = shared
+        self.touch_interval = touch_interval
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _is_alive(self, session: _Session, now: float) -> bool:
+        return now - session.last_seen < self.idle_timeout
+
+    def _remember(self, user_email: str, session: _Session) -> None:
+        with self._lock:
+            self._sessions[user_email] = session
+            self._sessions.move_to_end(user_email)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+
+    def _load_shared(self, user_email: str) -> Optional[_Session]:
+        try:
+            doc = firestore_breaker().call_sync(
+                get_db().collection(Collections.USER_SESSIONS).document(_doc_id(user_email)).get,
+                timeout=SESSION_STORE_TIMEOUT_SECONDS
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo leer la sesión compartida de {user_email}: {e}")
+            return None
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        return _Session(data["session_id"], data["last_seen"], data["last_seen"])
+
+    def _save_shared(self, user_email: str, session: _Session) -> None:
+        try:
+            firestore_breaker().call_sync(
+                get_db().collection(Collections.USER_SESSIONS).document(_doc_id(user_email)).set,
+                {
+                    "user": user_email,
+                    "session_id": session.session_id,
+                    "last_seen": session.last_seen,
+                },
+                timeout=SESSION_STORE_TIMEOUT_SECONDS
+            )
+            session.persisted_at = session.last_seen
+        except Exception as e:
+            # La sesión local sigue sirviendo; se reintentará en el próximo toque
+            logger.warning(f"⚠️ No se pudo guardar la sesión compartida de {user_email}: {e}")
+
+    def _load_node(self, user_email: str) -> Optional[_Session]:
+        data = shared_cache.get_json(NODE_NAMESPACE, _doc_id(user_email))
+        return _Session(**data) if data else None
+
+    def _save_node(self, user_email: str, session: _Session) -> None:
+        shared_cache.set_json(NODE_NAMESPACE, _doc_id(user_email), vars(session), self.idle_timeout)
+
+    def _claim_node(self, user_email: str, session: _Session) -> _Session:
+        """Si otro worker creó la sesión al mismo tiempo, se usa esa"""
+        stored = shared_cache.add(
+            NODE_NAMESPACE, _doc_id(user_email), responses.dumps(vars(session)), self.idle_timeout
+        )
+        return _Session(**responses.loads(stored))
+
+    def _lookup_local(self, user_email: str, node_shared: bool) -> Optional[_Session]:
+        """Sesión del caché del nodo o de la memoria del proceso (sin ir a Firestore)"""
+        session = self._load_node(user_email) if node_shared else None
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(user_email)
+                if session is not None:
+                    self._sessions.move_to_end(user_email)
+        return session
+
+    def _resolve(self, user_email: str, session: Optional[_Session], now: float, node_shared: bool) -> _Session:
+        """La sesión viva, o una nueva si no hay o expiró"""
+        if session is None or not self._is_alive(session, now):
+            session = _Session(str(uuid.uuid4()), now, 0.0)
+            if node_shared:
+                session = self._claim_node(user_email, session)
+            logger.debug(f"🆕 Nueva sesión creada para {user_email}: {session.session_id}")
+        else:
+            session.last_seen = now
+        return session
+
+    def _needs_touch(self, session: _Session, now: float) -> bool:
+        return self.shared and now - session.persisted_at >= self.touch_interval
+
+    def _store_locally(self, user_email: str, session: _Session, node_shared: bool) -> None:
+        self._remember(user_email, session)
+        if node_shared:
+            self._save_node(user_email, session)
+
+    def get_or_create(self, user_email: str) -> str:
+        """Versión bloqueante (scripts y jobs); desde el event loop usar ``get_or_create_async``"""
+        now = time.time()
+        node_shared = shared_cache.is_enabled()
+        session = self._lookup_local(user_email, node_shared)
+        if session is None and self.shared:
+            session = self._load_shared(user_email)
+        session = self._resolve(user_email, session, now, node_shared)
+        if self._needs_touch(session, now):
+            self._save_shared(user_email, session)
+        self._store_locally(user_email, session, node_shared)
+        return session.session_id
+
+    async def get_or_create_async(self, user_email: str) -> str:
+        """
+        Igual que ``get_or_create``, pero la lectura y el toque en Firestore corren
+        en un hilo: no frenan el event loop. El camino común (sesión en memoria
+        o en el caché del nodo, sin toque pendiente) no sale del loop
+        """
+        now = time.time()
+        node_shared = shared_cache.is_enabled()
+        session = self._lookup_local(user_email, node_shared)
+        if session is None and self.shared:
+            session = await asyncio.to_thread(self._load_shared, user_email)
+        session = self._resolve(user_email, session, now, node_shared)
+        if self._needs_touch(session, now):
+            await asyncio.to_thread(self._save_shared, user_email, session)
+        self._store_locally(user_email, session, node_shared)
+        return session.session_id
+
+
+registry = SessionRegistry()
@@ -0,0 +1,246 @@
+"""
+Índice local de similitud entre temas, para reutilizar respuestas de temas casi iguales.
+
+"Python", "python desde cero", "Aprender Python" y "python basico" son el
+mismo pedido: el tema se lleva a una forma canónica (sin tildes ni
+puntuación, sin palabras de relleno, palabras ordenadas) y se compara por
+n-gramas de caracteres, lo que además tolera plurales y errores de tipeo.
+Para no comparar contra todos los temas, cada uno tiene una firma MinHash
+repartida en bandas (LSH): solo los temas que comparten alguna banda se
+comparan con Jaccard exacto. En temas cortos un error de tipeo ("Pyhton")
+baja mucho el Jaccard, así que también se buscan por palabras a un error de
+distancia (índice de borrados sobre el vocabulario).
+Un tema parecido solo se acepta si tiene las mismas palabras que el pedido,
+cada una igual o con un error de tipeo: "Machine" no es "Machine learning".
+
+El índice es incremental (``add`` al guardar cada respuesta) y vive en memoria
+de cada instancia; ``cache_services`` lo llena al arrancar desde ``topic_cache``.
+"""
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, FrozenSet, List, Set, Tuple
+
+NGRAM_SIZE = 3
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+_ROWS_PER_BAND = MINHASH_PERMUTATIONS // LSH_BANDS
+
+# Palabras que no cambian qué roadmap se pide. Los verbos de "aprender X" son
+# relleno, pero no los sustantivos que pueden ser parte del tema ("learning",
+# "aprendizaje"): "Machine learning" y "Machine" son pedidos distintos
+STOPWORDS = frozenset({
+    "a", "al", "con", "de", "del", "desde", "el", "en", "la", "las", "lo", "los",
+    "para", "por", "sobre", "un", "una", "y",
+    "aprende", "aprender", "aprenda", "estudiar", "estudia", "learn",
+    "curso", "guia", "introduccion", "nocion", "nociones", "ruta", "roadmap", "tutorial",
+    "basico", "basicos", "basica", "basicas", "cero", "inicial", "principiante", "principiantes",
+    "the", "to", "intro", "basics", "beginner", "beginners",
+})
+# Largo mínimo de una palabra para tolerarle un error de tipeo (letra de más,
+# de menos o dos letras cruzadas) y para tolerarle una letra cambiada, que en
+# palabras cortas suele ser otra palabra ("redes" / "redis")
+TYPO_MIN_LENGTH = 4
+TYPO_SUBSTITUTION_MIN_LENGTH = 7
+
+# Cada "permutación" de MinHash es un XOR con una máscara fija sobre un hash de
+# 64 bits: bastante más barato en Python que (a*x + b) mod p, y suficiente aquí
+# porque los candidatos se confirman con Jaccard exacto
+_rng = random.Random(20240917)
+_MASKS = [_rng.getrandbits(64) for _ in range(MINHASH_PERMUTATIONS)]
+
+
+def canonical_topic(normalized: str) -> str:
+    """
+    Forma canónica de un tema ya normalizado (minúsculas, sin tildes):
+    sin puntuación ni stopwords, plurales simples recortados y palabras ordenadas
+    """
+    words = re.findall(r"[a-z0-9+#]+", normalized)
+    kept = [w for w in words if w not in STOPWORDS] or words
+    stems = {w[:-1] if len(w) > 4 and w.endswith("s") else w for w in kept}
+    return " ".join(sorted(stems))
+
+
+def shingles(canonical: str, size: int = NGRAM_SIZE) -> FrozenSet[str]:
+    padded = f" {canonical} "
+    if len(padded) <= size:
+        return frozenset({padded})
+    return frozenset(padded[i:i + size] for i in range(len(padded) - size + 1))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _typo_tolerant(word: str) -> bool:
+    """Las versiones ("python3", "es6") no se corrigen: otro número es otro tema"""
+    return len(word) >= TYPO_MIN_LENGTH and not any(c.isdigit() for c in word)
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """
+    True si ``a`` y ``b`` difieren en a lo sumo una inserción, borrado o
+    transposición (o un cambio de letra, en palabras largas)
+    """
+    if a == b:
+        return True
+    if not (_typo_tolerant(a) and _typo_tolerant(b)) or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    if a[i + 1:i + 2] == b[i:i + 1] and a[i] == b[i + 1] and a[i + 2:] == b[i + 2:]:
+        return True
+    return len(a) >= TYPO_SUBSTITUTION_MIN_LENGTH and a[i + 1:] == b[i + 1:]
+
+
+def _deletions(word: str) -> Set[str]:
+    """La palabra y sus variantes con una letra menos (dos palabras a un error comparten alguna)"""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def same_words(canonical: str, other: str) -> bool:
+    """
+    True si dos temas canónicos tienen las mismas palabras, cada una igual o con
+    un error de tipeo: un tema parecido no puede agregar ni quitar palabras
+    """
+    words, others = canonical.split(), other.split()
+    if len(words) != len(others):
+        return False
+    pending = list(others)
+    for word in words:
+        match = next((o for o in pending if _within_one_edit(word, o)), None)
+        if match is None:
+            return False
+        pending.remove(match)
+    return True
+
+
+def minhash(grams: FrozenSet[str]) -> List[int]:
+    hashes = [int.from_bytes(hashlib.blake2b(g.encode(), digest_size=8).digest(), "big") for g in grams]
+    return [min(h ^ mask for h in hashes) for mask in _MASKS]
+
+
+def _bands(signature: List[int]) -> List[Tuple[int, Tuple[int, ...]]]:
+    return [
+        (band, tuple(signature[band * _ROWS_PER_BAND:(band + 1) * _ROWS_PER_BAND]))
+        for band in range(LSH_BANDS)
+    ]
+
+
+class TopicIndex:
+    """
+    Args:
+        normalize: Normalización básica del tema (la misma que usan las keys del caché)
+        threshold: Similitud de Jaccard mínima para considerar dos temas iguales
+        max_size: Cantidad máxima de temas (se descartan los menos recientes)
+    """
+
+    def __init__(self, normalize: Callable[[str], str], threshold: float = 0.8, max_size: int = 50000):
+        self.normalize = normalize
+        self.threshold = threshold
+        self.max_size = max_size
+        # canónico -> (tema original, n-gramas, bandas)
+        self._entries: "OrderedDict[str, Tuple[str, FrozenSet[str], list]]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[str]] = defaultdict(set)
+        # palabra -> canónicos que la tienen; borrado -> palabras (para errores de tipeo)
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._typos: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, topic: str) -> None:
+        canonical = canonical_topic(self.normalize(topic))
+        with self._lock:
+            if canonical in self._entries:
+                self._entries.move_to_end(canonical)
+                return
+        grams = shingles(canonical)
+        bands = _bands(minhash(grams))
+        with self._lock:
+            self._entries[canonical] = (topic, grams, bands)
+            for band in bands:
+                self._buckets[band].add(canonical)
+            for word in canonical.split():
+                if word not in self._postings and _typo_tolerant(word):
+                    for variant in _deletions(word):
+                        self._typos[variant].add(word)
+                self._postings[word].add(canonical)
+            while len(self._entries) > self.max_size:
+                old, (_, _, old_bands) = self._entries.popitem(last=False)
+                for band in old_bands:
+                    bucket = self._buckets.get(band)
+                    if bucket is not None:
+                        bucket.discard(old)
+                        if not bucket:
+                            del self._buckets[band]
+                for word in old.split():
+                    self._forget_word(word, old)
+
+    def _forget_word(self, word: str, canonical: str) -> None:
+        postings = self._postings.get(word)
+        if postings is None:
+            return
+        postings.discard(canonical)
+        if postings:
+            return
+        del self._postings[word]
+        for variant in _deletions(word) if _typo_tolerant(word) else ():
+            words = self._typos.get(variant)
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del self._typos[variant]
+
+    def _typo_candidates(self, canonical: str) -> Set[str]:
+        """
+        Temas con alguna palabra a un error de tipeo de la palabra más rara del
+        pedido (``same_words`` confirma el resto)
+        """
+        rarest = None
+        for word in canonical.split():
+            close = {word}
+            if _typo_tolerant(word):
+                for variant in _deletions(word):
+                    close |= self._typos.get(variant, set())
+            size = sum(len(self._postings.get(other, ())) for other in close)
+            if size == 0:
+                return set()
+            if rarest is None or size < rarest[0]:
+                rarest = (size, close)
+        if rarest is None:
+            return set()
+        return set().union(*(self._postings.get(other, ()) for other in rarest[1]))
+
+    def similar(self, topic: str, limit: int = 3) -> List[Tuple[str, float]]:
+        """Temas indexados con similitud >= threshold, del más parecido al menos"""
+        canonical = canonical_topic(self.normalize(topic))
+        grams = shingles(canonical)
+        with self._lock:
+            exact = self._entries.get(canonical)
+            if exact is not None:
+                return [(exact[0], 1.0)]
+        bands = _bands(minhash(grams))
+        with self._lock:
+            candidates = set()
+            for band in bands:
+                candidates |= self._buckets.get(band, set())
+            typo_candidates = self._typo_candidates(canonical)
+            scored = []
+            for candidate in candidates | typo_candidates:
+                stored_topic, stored_grams, _ = self._entries[candidate]
+                score = jaccard(grams, stored_grams)
+                if (score >= self.threshold or candidate in typo_candidates) and same_words(canonical, candidate):
+                    scored.append((stored_topic, score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:limit]
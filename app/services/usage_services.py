@@ -0,0 +1,164 @@
+"""
+Contabilidad de tokens y costo de Gemini, y perfiles de generación por tarea.
+
+``ask_gemini`` reporta cada llamada con ``record_usage``: tokens de prompt y de
+respuesta (incluidos los de "thinking"), latencia y si la respuesta se cortó
+por ``max_output_tokens``. Los totales se acumulan en memoria por
+(día, tarea, modelo) y ``flush_usage`` los suma en la colección ``model_usage``
+con ``Increment`` (varias instancias escriben sobre los mismos documentos).
+
+Cada tarea tiene un perfil de generación (temperatura y tope de tokens). Con
+suficientes muestras, el tope se ajusta al p99 observado de tokens de salida
+más un margen, así las tareas cortas (temas relacionados, extracción de temas)
+no reservan 10000 tokens.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Tuple
+from app.core import metrics
+from app.db.firestore_client import Collections
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_INTERVAL_SECONDS = int(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "60"))
+ADAPTIVE_TOKENS_ENABLED = os.getenv("ADAPTIVE_TOKENS_ENABLED", "true").lower() != "false"
+# Muestras de tokens de salida necesarias antes de ajustar el tope
+ADAPTIVE_MIN_SAMPLES = int(os.getenv("ADAPTIVE_MIN_SAMPLES", "50"))
+ADAPTIVE_HEADROOM = float(os.getenv("ADAPTIVE_HEADROOM", "1.5"))
+ADAPTIVE_WINDOW = 500
+
+# Tarea -> temperatura, tope máximo de tokens de salida y piso del tope adaptativo.
+# Las tareas corresponden a las rutas: documents (/documents), roadmap y
+# roadmap_details (/roadmaps), roadmap_node (PATCH /roadmaps/{id}), questions (/questions), related_topics (/related-topics)
+GENERATION_PROFILES: Dict[str, Dict[str, Any]] = {
+    "documents": {"temperature": 0.2, "max_output_tokens": 2048, "min_output_tokens": 256},
+    "roadmap": {"temperature": 0.3, "max_output_tokens": 4096, "min_output_tokens": 1024},
+    "roadmap_details": {"temperature": 0.3, "max_output_tokens": 10000, "min_output_tokens": 2048},
+    "roadmap_node": {"temperature": 0.3, "max_output_tokens": 4096, "min_output_tokens": 1024},
+    "questions": {"temperature": 0.5, "max_output_tokens": 4096, "min_output_tokens": 1024},
+    "related_topics": {"temperature": 0.3, "max_output_tokens": 2048, "min_output_tokens": 256},
+    "default": {"temperature": 0.3, "max_output_tokens": 10000, "min_output_tokens": 10000},
+}
+
+# Precio de lista en USD por millón de tokens: (entrada, salida)
+MODEL_PRICES_PER_MILLION: Dict[str, Tuple[float, float]] = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+}
+
+_lock = threading.Lock()
+# tarea -> tokens de salida de las llamadas recientes
+_output_samples: Dict[str, Deque[int]] = defaultdict(lambda: deque(maxlen=ADAPTIVE_WINDOW))
+# (día, tarea, modelo) -> totales aún no guardados en Firestore
+_pending: Dict[Tuple[str, str, str], Dict[str, float]] = defaultdict(lambda: defaultdict(int))
+
+
+def get_profile(task: str) -> Dict[str, Any]:
+    return GENERATION_PROFILES.get(task, GENERATION_PROFILES["default"])
+
+
+def max_output_tokens(task: str) -> int:
+    """Tope de tokens de salida para la tarea: p99 observado * margen, dentro del perfil"""
+    profile = get_profile(task)
+    ceiling = profile["max_output_tokens"]
+    if not ADAPTIVE_TOKENS_ENABLED:
+        return ceiling
+    with _lock:
+        samples = sorted(_output_samples.get(task, ()))
+    if len(samples) < ADAPTIVE_MIN_SAMPLES:
+        return ceiling
+    p99 = samples[min(len(samples) - 1, math.ceil(0.99 * len(samples)) - 1)]
+    return max(profile["min_output_tokens"], min(ceiling, math.ceil(p99 * ADAPTIVE_HEADROOM)))
+
+
+def estimate_cost(model: str, prompt_tokens: int, output_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICES_PER_MILLION.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def record_usage(
+    task: str,
+    model: str,
+    prompt_tokens: int,
+    output_tokens: int,
+    latency_s: float,
+    truncated: bool = False
+) -> None:
+    """Registra una llamada al modelo (tokens de salida incluye los de thinking)"""
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    with _lock:
+        # Una respuesta cortada no dice cuánto necesitaba la tarea: no entra a la muestra
+        if not truncated:
+            _output_samples[task].append(output_tokens)
+        totals = _pending[(day, task, model)]
+        totals["calls"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["output_tokens"] += output_tokens
+        totals["latency_ms"] += latency_s * 1000
+        totals["truncated"] += int(truncated)
+        totals["cost_usd"] += estimate_cost(model, prompt_tokens, output_tokens)
+
+    metrics.observe_latency(f"gemini.{task}", latency_s * 1000)
+    metrics.increment(f"gemini.{model}.prompt_tokens", prompt_tokens)
+    metrics.increment(f"gemini.{model}.output_tokens", output_tokens)
+    if truncated:
+        metrics.increment(f"gemini.{task}.truncated")
+
+
+def usage_report() -> Dict[str, Any]:
+    """Totales pendientes de guardar y el tope vigente de cada tarea"""
+    with _lock:
+        pending = [
+            {"day": day, "task": task, "model": model, **dict(totals)}
+            for (day, task, model), totals in _pending.items()
+        ]
+    return {
+        "pending": pending,
+        "max_output_tokens": {task: max_output_tokens(task) for task in GENERATION_PROFILES},
+    }
+
+
+def flush_usage() -> int:
+    """Suma los totales pendientes en ``model_usage`` (un batch). Retorna documentos escritos"""
+    from google.cloud.firestore import Increment
+    from app.db.transactions import BatchWriter
+
+    with _lock:
+        pending = {key: dict(totals) for key, totals in _pending.items()}
+        _pending.clear()
+    if not pending:
+        return 0
+
+    writer = BatchWriter()
+    for (day, task, model), totals in pending.items():
+        writer.add_upsert(Collections.MODEL_USAGE, f"{day}_{task}_{model}", {
+            "day": day,
+            "task": task,
+            "model": model,
+            **{field: Increment(value) for field, value in totals.items()},
+        })
+    result = writer.commit()
+    if not result["success"]:
+        # Se devuelven los totales para el próximo intento
+        with _lock:
+            for key, totals in pending.items():
+                for field, value in totals.items():
+                    _pending[key][field] += value
+        logger.warning(f"⚠️ No se pudo guardar el uso de Gemini: {result['error']}")
+        return 0
+    return len(pending)
+
+
+async def run_flush_loop(interval: float = USAGE_FLUSH_INTERVAL_SECONDS) -> None:
+    """Guarda el uso periódicamente (se lanza desde el lifespan de la app)"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(flush_usage)
+        except Exception as e:
+            logger.warning(f"⚠️ Error guardando el uso de Gemini: {e}")
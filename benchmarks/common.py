@@ -0,0 +1,113 @@
+"""
+Utilidades compartidas por los benchmarks: estadísticas de latencia, memoria,
+tokens de prueba y guardado de resultados.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Valores por defecto para que la app arranque sin .env
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-not-for-production")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("INTERNAL_API_KEY", "internal_service_key_123")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+BENCH_EMAIL = "bench@example.com"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil por interpolación lineal sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    """Resume latencias (en segundos) en RPS y percentiles en milisegundos"""
+    values = sorted(latencies)
+    return {
+        "requests": len(values) + errors,
+        "errors": errors,
+        "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+def peak_rss_mb() -> float:
+    """RSS máximo del proceso (y de sus hijos ya terminados) en MB"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak = max(usage, children)
+    # Linux reporta KB, macOS bytes
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def mint_token(email: str = BENCH_EMAIL, ttl: int = 3600) -> str:
+    """Genera un JWT válido para get_current_user con el SECRET_KEY actual"""
+    import jwt
+
+    payload = {"user_id": "bench-user", "email": email, "exp": int(time.time()) + ttl}
+    return jwt.encode(payload, os.environ["SECRET_KEY"], algorithm=os.environ["ALGORITHM"])
+
+
+def write_results(name: str, payload: Dict[str, Any], output: Optional[str] = None) -> str:
+    """
+    Guarda los resultados como JSON junto con el commit actual.
+    Por defecto en benchmarks/results/<name>-<commit>-<fecha>.json
+    """
+    commit = git_commit()
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    document = {
+        "benchmark": name,
+        "commit": commit,
+        "timestamp": stamp,
+        **payload,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{name}-{commit or 'nocommit'}-{stamp}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+    return output
+
+
+def compare_results(current: Dict[str, Any], baseline_path: str) -> List[str]:
+    """Líneas legibles con la variación de RPS y p95/p99 por ruta contra otra corrida"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    lines = [f"Comparando contra {baseline.get('commit')} ({baseline_path})"]
+    for route, stats in current.get("routes", {}).items():
+        before = baseline.get("routes", {}).get(route)
+        if not before:
+            lines.append(f"  {route}: sin datos en la corrida base")
+            continue
+        parts = []
+        for key in ("rps", "p95_ms", "p99_ms"):
+            old, new = before.get(key) or 0, stats.get(key) or 0
+            delta = ((new - old) / old * 100) if old else 0.0
+            parts.append(f"{key} {old} -> {new} ({delta:+.1f}%)")
+        lines.append(f"  {route}: " + ", ".join(parts))
+    return lines
@@ -0,0 +1,25 @@
+"""
+La app con los dobles ya instalados, para levantarla como servidor real:
+
+    python -m app.serve --app benchmarks.fake_app:app --workers 4
+
+Cada worker importa este módulo y tiene su propio FakeGemini e InMemoryFirestore
+(lo compartido entre workers es solo el caché del nodo). La latencia del modelo
+falso se configura con ``BENCH_MODEL_LATENCY`` y ``BENCH_MODEL_JITTER``.
+"""
+import os
+
+import benchmarks.common  # noqa: F401  (defaults de SECRET_KEY, ALGORITHM, etc.)
+from app.main import app
+from benchmarks.fakes import FakeGemini, FakePublisher, InMemoryFirestore, install_fakes
+
+install_fakes(
+    FakeGemini(
+        latency=float(os.getenv("BENCH_MODEL_LATENCY", "0.05")),
+        jitter=float(os.getenv("BENCH_MODEL_JITTER", "0")),
+    ),
+    InMemoryFirestore(),
+    FakePublisher(),
+)
+
+__all__ = ["app"]
@@ -0,0 +1,650 @@
+"""
+Dobles deterministas de Gemini y Firestore para correr la app sin credenciales.
+
+- FakeGemini reemplaza a ``ask_gemini``: responde JSON válido según el tipo de
+  prompt, con latencia y tamaño de respuesta configurables.
+- InMemoryFirestore implementa el subconjunto del cliente de Firestore que usa
+  la app (documentos, consultas, batches y transacciones) sobre diccionarios,
+  con una latencia por RPC opcional para simular la red.
+- FakePublisher reemplaza al ``PublisherClient`` de Pub/Sub.
+
+``install_fakes`` los conecta a los módulos de la app ya importados.
+"""
+import asyncio
+import copy
+import hashlib
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+
+
+# ==================== GEMINI ====================
+
+class FakeGemini:
+    """
+    Sustituto de ``ask_gemini``. La respuesta depende solo del prompt, así que
+    dos corridas con la misma configuración producen el mismo tráfico.
+
+    Args:
+        latency: Latencia media por llamada en segundos
+        jitter: Variación relativa de la latencia (0.2 = ±20%)
+        payload_bytes: Tamaño aproximado de las respuestas largas (roadmaps)
+        blocking: Si es True duerme con time.sleep, como el SDK síncrono de Vertex
+        profile: Callback opcional ``profile(prompt) -> (latency, payload_bytes)``
+            que tiene prioridad sobre los valores fijos (lo usa el replay)
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.2,
+        payload_bytes: int = 4000,
+        blocking: bool = False,
+        profile: Optional[Callable[[str], Optional[tuple]]] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.payload_bytes = payload_bytes
+        self.blocking = blocking
+        self.profile = profile
+        self.calls = Counter()
+
+    async def __call__(self, prompt: str, model: Optional[str] = None, task: str = "default", **kwargs) -> str:
+        from app.services.ai_services import model_chain
+        model = model or model_chain(task)[0]
+        seed = int(hashlib.sha256(prompt.encode()).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+
+        latency, payload_bytes = self.latency, self.payload_bytes
+        if self.profile is not None:
+            override = self.profile(prompt)
+            if override:
+                latency, payload_bytes = override
+        delay = max(0.0, latency * (1 + self.jitter * (2 * rng.random() - 1)))
+
+        if self.blocking:
+            time.sleep(delay)
+        else:
+            # Respeta el deadline de la petición igual que ask_gemini
+            from app.core.deadline import with_deadline
+            await with_deadline(asyncio.sleep(delay), operation=f"gemini {model} ({task})")
+
+        kind = classify_prompt(prompt)
+        self.calls[(kind, model)] += 1
+        text = json.dumps(_fake_answer(kind, rng, payload_bytes, prompt), ensure_ascii=False)
+
+        # Igual que ask_gemini, para que la captura de tráfico y la contabilidad de
+        # tokens funcionen con el doble (~4 caracteres por token)
+        from app.core.traffic_capture import record_model_call
+        from app.services.usage_services import record_usage
+        record_model_call(model, delay, len(prompt), len(text))
+        record_usage(task, model, len(prompt) // 4, len(text) // 4, delay)
+        return text
+
+
+def classify_prompt(prompt: str) -> str:
+    """Identifica qué lógica de learning_path_services generó el prompt"""
+    if "3 temas principales" in prompt:
+        return "documents"
+    if "verdadero o falso" in prompt:
+        return "questions"
+    if "un solo nodo" in prompt:
+        return "roadmap_node"
+    if "temas relacionados" in prompt:
+        return "related_topics"
+    if "descripción detallada" in prompt:
+        return "roadmap_details"
+    return "roadmap"
+
+
+# Cada llamada devuelve preguntas nuevas, como el modelo real (para que el banco crezca)
+_question_numbers = itertools.count(1)
+
+
+def _fake_answer(kind: str, rng: random.Random, payload_bytes: int, prompt: str = "") -> Any:
+    if kind == "documents":
+        return [f"Tema {i}" for i in range(1, 4)]
+    if kind == "related_topics":
+        return [f"Tema relacionado {i}" for i in range(1, rng.randint(3, 6) + 1)]
+    if kind == "roadmap_node":
+        name = re.search(r"un solo nodo: '(.*?)'", prompt).group(1)
+        children = [f"{name}.{j}" for j in range(1, rng.randint(1, 3) + 1)]
+        return {
+            "subtree": children,
+            "extra_info": {child: f"Descripción de {child}." for child in [name] + children},
+        }
+    if kind == "questions":
+        return [
+            {"enunciado": f"Afirmación de prueba número {next(_question_numbers)}.", "respuesta": bool(rng.getrandbits(1))}
+            for i in range(rng.randint(5, 10))
+        ]
+
+    subtopics = {
+        f"Subtema {i}": [f"Sub-subtema {i}.{j}" for j in range(1, rng.randint(1, 3) + 1)]
+        for i in range(1, rng.randint(3, 6) + 1)
+    }
+    # Rellena las descripciones hasta el tamaño pedido (la etapa 1 también lo usa,
+    # porque el segundo paso del roadmap parsea la misma estructura)
+    entries = len(subtopics) + sum(len(v) for v in subtopics.values())
+    filler = "x" * max(0, payload_bytes // max(entries, 1) - 40)
+    if kind == "roadmap_details":
+        details = {}
+        for name, children in subtopics.items():
+            details[name] = f"Descripción de {name}. {filler}"
+            for child in children:
+                details[child] = f"Descripción de {child}. {filler}"
+        return details
+    return subtopics
+
+
+# ==================== FIRESTORE ====================
+
+def _get_field(data: Dict[str, Any], path: str) -> Any:
+    value: Any = data
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _set_field(data: Dict[str, Any], path: str, value: Any) -> None:
+    parts = path.split(".")
+    target = data
+    for part in parts[:-1]:
+        target = target.setdefault(part, {})
+    target[parts[-1]] = value
+
+
+def _delete_field(data: Dict[str, Any], path: str) -> None:
+    parts = path.split(".")
+    target = data
+    for part in parts[:-1]:
+        target = target.get(part)
+        if not isinstance(target, dict):
+            return
+    target.pop(parts[-1], None)
+
+
+def _resolve_transform(current: Any, value: Any) -> Any:
+    """Aplica los sentinels de Firestore que usa la app (Increment, ArrayUnion, etc.)"""
+    name = type(value).__name__
+    if name == "Increment":
+        return (current or 0) + value.value
+    if name == "ArrayUnion":
+        base = list(current or [])
+        return base + [v for v in value.values if v not in base]
+    if name == "ArrayRemove":
+        return [v for v in (current or []) if v not in value.values]
+    if name == "Sentinel":
+        if "delete" in repr(value).lower():
+            return _DELETE
+        return datetime.now(timezone.utc)
+    if isinstance(value, dict):
+        base = current if isinstance(current, dict) else {}
+        resolved = {k: _resolve_transform(base.get(k), v) for k, v in value.items()}
+        return {k: v for k, v in resolved.items() if v is not _DELETE}
+    return copy.deepcopy(value)
+
+
+_DELETE = object()
+
+
+def _apply_fields(target: Dict[str, Any], data: Dict[str, Any], dotted: bool, merge: bool = False) -> None:
+    for key, value in data.items():
+        if merge and isinstance(value, dict) and isinstance(target.get(key), dict):
+            _apply_fields(target[key], value, dotted=False, merge=True)
+            continue
+        current = _get_field(target, key) if dotted else target.get(key)
+        resolved = _resolve_transform(current, value)
+        if resolved is _DELETE:
+            if dotted:
+                _delete_field(target, key)
+            else:
+                target.pop(key, None)
+        elif dotted:
+            _set_field(target, key, resolved)
+        else:
+            target[key] = resolved
+
+
+class FakeSnapshot:
+    def __init__(self, reference: "FakeDocumentRef", data: Optional[Dict[str, Any]], update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+        self.create_time = update_time
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str) -> Any:
+        return _get_field(self._data or {}, field_path)
+
+
+class FakeDocumentRef:
+    def __init__(self, db: "InMemoryFirestore", collection: str, doc_id: Optional[str] = None):
+        self._db = db
+        self._collection_name = collection
+        self.id = doc_id or uuid.uuid4().hex[:20]
+
+    @property
+    def path(self) -> str:
+        return f"{self._collection_name}/{self.id}"
+
+    def collection(self, name: str) -> "FakeCollection":
+        return FakeCollection(self._db, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None, **kwargs) -> FakeSnapshot:
+        self._db._rpc("reads")
+        return self._db._snapshot(self)
+
+    def set(self, data: Dict[str, Any], merge: bool = False, **kwargs):
+        self._db._rpc("writes")
+        return self._db._write("set", self, data, merge=merge)
+
+    def create(self, data: Dict[str, Any], **kwargs):
+        self._db._rpc("writes")
+        return self._db._write("create", self, data)
+
+    def update(self, data: Dict[str, Any], option=None, **kwargs):
+        self._db._rpc("writes")
+        return self._db._write("update", self, data, option=option)
+
+    def delete(self, option=None, **kwargs):
+        self._db._rpc("writes")
+        self._db._write("delete", self, None)
+
+
+class FakeQuery:
+    def __init__(self, db: "InMemoryFirestore", collection: str):
+        self._db = db
+        self._collection_name = collection
+        self._filters: List[tuple] = []
+        self._orders: List[tuple] = []
+        self._limit: Optional[int] = None
+        self._start_after: Optional[Any] = None
+        self._fields: Optional[List[str]] = None
+
+    def _copy(self) -> "FakeQuery":
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        return query
+
+    def where(self, field_path: str = None, op_string: str = None, value: Any = None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        query = self._copy()
+        query._filters.append((field_path, op_string, value))
+        return query
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING"):
+        query = self._copy()
+        query._orders.append((field_path, str(direction).upper().startswith("DESC")))
+        return query
+
+    def limit(self, count: int):
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def start_after(self, document_fields_or_snapshot):
+        query = self._copy()
+        query._start_after = document_fields_or_snapshot
+        return query
+
+    def select(self, field_paths: Iterable[str]):
+        query = self._copy()
+        query._fields = list(field_paths)
+        return query
+
+    def _matches(self, data: Dict[str, Any]) -> bool:
+        for field, op, expected in self._filters:
+            actual = _get_field(data, field)
+            if op == "==" and actual != expected:
+                return False
+            if op == "!=" and actual == expected:
+                return False
+            if op in ("<", "<=", ">", ">="):
+                if actual is None:
+                    return False
+                if op == "<" and not actual < expected:
+                    return False
+                if op == "<=" and not actual <= expected:
+                    return False
+                if op == ">" and not actual > expected:
+                    return False
+                if op == ">=" and not actual >= expected:
+                    return False
+            if op == "in" and actual not in expected:
+                return False
+            if op == "array_contains" and expected not in (actual or []):
+                return False
+        return True
+
+    def _sort_key(self, item):
+        doc_id, data = item
+        return tuple(
+            _Reversed(_get_field(data, field)) if descending else _Ordered(_get_field(data, field))
+            for field, descending in self._orders
+        ) + (doc_id,)
+
+    def stream(self, transaction=None, **kwargs):
+        self._db._rpc("queries")
+        with self._db._lock:
+            items = [
+                (doc_id, copy.deepcopy(data))
+                for doc_id, data in self._db._collections.get(self._collection_name, {}).items()
+                if self._matches(data)
+            ]
+        items.sort(key=self._sort_key)
+
+        if self._start_after is not None:
+            # Como en Firestore: posición por los valores del snapshot, aunque ya no exista
+            cursor = self._start_after
+            cursor_key = self._sort_key((cursor.id, cursor._data or {}))
+            items = [item for item in items if cursor_key < self._sort_key(item)]
+
+        if self._limit is not None:
+            items = items[:self._limit]
+
+        for doc_id, data in items:
+            if self._fields is not None:
+                data = {f: _get_field(data, f) for f in self._fields}
+            ref = FakeDocumentRef(self._db, self._collection_name, doc_id)
+            yield FakeSnapshot(ref, data, self._db._update_times.get((self._collection_name, doc_id)))
+
+    def get(self, transaction=None, **kwargs) -> List[FakeSnapshot]:
+        return list(self.stream(transaction=transaction))
+
+
+class _Ordered:
+    """Clave de orden que tolera None y tipos mezclados"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def _key(self):
+        value = self.value
+        if isinstance(value, datetime) and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return (value is not None, type(value).__name__ if not isinstance(value, (int, float)) else "num", value)
+
+    def __lt__(self, other):
+        try:
+            return self._key() < other._key()
+        except TypeError:
+            return str(self.value) < str(other.value)
+
+    def __eq__(self, other):
+        return self._key() == other._key()
+
+
+class _Reversed(_Ordered):
+    def __lt__(self, other):
+        return _Ordered.__lt__(other, self)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db: "InMemoryFirestore", name: str):
+        super().__init__(db, name)
+        self.id = name.rsplit("/", 1)[-1]
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocumentRef:
+        return FakeDocumentRef(self._db, self._collection_name, document_id)
+
+    def add(self, data: Dict[str, Any], document_id: Optional[str] = None):
+        ref = self.document(document_id)
+        ref.set(data)
+        return datetime.now(timezone.utc), ref
+
+
+class FakeWriteBatch:
+    def __init__(self, db: "InMemoryFirestore"):
+        self._db = db
+        self._writes: List[tuple] = []
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("set", reference, document_data, {"merge": merge}))
+
+    def create(self, reference, document_data):
+        self._writes.append(("create", reference, document_data, {}))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(("update", reference, field_updates, {"option": option}))
+
+    def delete(self, reference, option=None):
+        self._writes.append(("delete", reference, None, {}))
+
+    def commit(self, **kwargs):
+        self._db._rpc("commits")
+        self._db._commit(self._writes)
+        results = list(self._writes)
+        self._writes = []
+        return results
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Transacción compatible con el decorador ``firestore.transactional``"""
+
+    def __init__(self, db: "InMemoryFirestore", max_attempts: int = 5, read_only: bool = False):
+        super().__init__(db)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    @property
+    def id(self):
+        return self._id
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._db._rpc("transactions")
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        self._db._rpc("commits")
+        self._db._commit(self._writes)
+        results = list(self._writes)
+        self._clean_up()
+        return results
+
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, FakeDocumentRef):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references, **kwargs):
+        return self._db.get_all(references, transaction=self)
+
+
+class InMemoryFirestore:
+    """
+    Cliente de Firestore en memoria y thread-safe.
+
+    Args:
+        rtt: Segundos que se bloquea cada RPC (get, consulta, commit), con
+            time.sleep igual que el cliente real síncrono
+    """
+
+    def __init__(self, rtt: float = 0.0):
+        self.rtt = rtt
+        self.stats = Counter()
+        self._collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._update_times: Dict[tuple, datetime] = {}
+        self._lock = threading.RLock()
+
+    # --- API pública del cliente ---
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> FakeTransaction:
+        return FakeTransaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        self._rpc("reads")
+        return [self._snapshot(ref) for ref in references]
+
+    def write_option(self, **kwargs):
+        return dict(kwargs)
+
+    # --- Internos ---
+
+    def _rpc(self, kind: str):
+        self.stats[kind] += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def _snapshot(self, ref: FakeDocumentRef) -> FakeSnapshot:
+        key = (ref._collection_name, ref.id)
+        with self._lock:
+            data = self._collections.get(ref._collection_name, {}).get(ref.id)
+            return FakeSnapshot(ref, copy.deepcopy(data), self._update_times.get(key))
+
+    def _write(self, op: str, ref: FakeDocumentRef, data, **options):
+        # Como el WriteResult del SDK: el update_time sirve de precondición después
+        return SimpleNamespace(update_time=self._commit([(op, ref, data, options)]))
+
+    def _commit(self, writes: List[tuple]):
+        with self._lock:
+            # Valida todas las precondiciones antes de aplicar nada (atomicidad)
+            for op, ref, _, options in writes:
+                docs = self._collections.get(ref._collection_name, {})
+                exists = ref.id in docs
+                if op == "create" and exists:
+                    raise AlreadyExists(f"Document already exists: {ref.path}")
+                if op == "update" and not exists:
+                    raise NotFound(f"No document to update: {ref.path}")
+                option = options.get("option") or {}
+                expected = option.get("last_update_time") if isinstance(option, dict) else None
+                if expected is not None and self._update_times.get((ref._collection_name, ref.id)) != expected:
+                    raise FailedPrecondition(f"Precondition failed for {ref.path}")
+
+            now = datetime.now(timezone.utc)
+            for op, ref, data, options in writes:
+                docs = self._collections.setdefault(ref._collection_name, {})
+                key = (ref._collection_name, ref.id)
+                if op == "delete":
+                    docs.pop(ref.id, None)
+                    self._update_times.pop(key, None)
+                    continue
+                if op == "update":
+                    _apply_fields(docs[ref.id], data, dotted=True)
+                elif op == "set" and options.get("merge") and ref.id in docs:
+                    _apply_fields(docs[ref.id], data, dotted=False, merge=True)
+                else:
+                    fresh: Dict[str, Any] = {}
+                    _apply_fields(fresh, data, dotted=False)
+                    docs[ref.id] = fresh
+                self._update_times[key] = now
+                self.stats["documents_written"] += 1
+            return now
+
+    def dump(self, collection: str) -> Dict[str, Dict[str, Any]]:
+        """Copia de todos los documentos de una colección (para inspección)"""
+        with self._lock:
+            return copy.deepcopy(self._collections.get(collection, {}))
+
+
+# ==================== PUB/SUB ====================
+
+class FakePublisher:
+    """
+    Reemplazo de ``pubsub_v1.PublisherClient``: cada ``publish`` devuelve un
+    future que se resuelve en otro hilo después de ``latency`` segundos, o falla
+    con probabilidad ``failure_rate``. Los mensajes confirmados quedan en ``published``.
+    """
+
+    def __init__(self, latency: float = 0.02, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.published: List[Dict[str, Any]] = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def topic_path(self, project: str, topic: str) -> str:
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic: str, data: bytes, **attrs):
+        from concurrent.futures import Future
+
+        future: Future = Future()
+        with self._lock:
+            fails = self._rng.random() < self.failure_rate
+
+        def resolve():
+            if fails:
+                future.set_exception(RuntimeError("fake publish failure"))
+                return
+            with self._lock:
+                self.published.append(json.loads(data))
+            future.set_result(uuid.uuid4().hex[:16])
+
+        timer = threading.Timer(self.latency, resolve)
+        timer.daemon = True
+        timer.start()
+        return future
+
+
+# ==================== INSTALACIÓN ====================
+
+def install_fakes(
+    gemini: Optional[FakeGemini] = None,
+    db: Optional[InMemoryFirestore] = None,
+    publisher: Optional[FakePublisher] = None
+):
+    """
+    Conecta los dobles a la app: ``get_db()`` devuelve ``db``, toda referencia a
+    ``ask_gemini`` en los módulos ``app.*`` ya importados apunta a ``gemini`` y
+    ``pubsub_services`` publica en ``publisher``.
+    Debe llamarse después de importar ``app.main``.
+    """
+    if db is not None:
+        import app.db.firestore_client as firestore_client
+        firestore_client._db = db
+
+    if gemini is not None:
+        import app.services.ai_services as ai_services
+        original = ai_services.ask_gemini
+        for name, module in list(sys.modules.items()):
+            if name.startswith("app.") and getattr(module, "ask_gemini", None) is original:
+                module.ask_gemini = gemini
+
+    if publisher is not None:
+        import app.services.pubsub_services as pubsub_services
+        pubsub_services._publisher = publisher
+        pubsub_services._topic_path = publisher.topic_path("bench", pubsub_services.TOPIC_ID)
+    return gemini, db
@@ -0,0 +1,279 @@
+"""
+Prueba de carga offline de learning_path_routes.
+
+Levanta la app en el mismo proceso con FakeGemini e InMemoryFirestore y recorre
+cada ruta con la concurrencia indicada. Reporta RPS, p50/p95/p99 por ruta y el
+RSS máximo, y guarda el resultado como JSON para comparar entre commits.
+
+Uso:
+    python -m benchmarks.load_test --concurrency 20 --requests 200
+    python -m benchmarks.load_test --model-latency 1.5 --blocking-model
+    python -m benchmarks.load_test --compare benchmarks/results/load_test-abc123-....json
+    python -m benchmarks.load_test --url http://localhost:8080   # servidor ya levantado
+"""
+import argparse
+import asyncio
+import base64
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from benchmarks.common import (
+    BENCH_EMAIL,
+    compare_results,
+    mint_token,
+    peak_rss_mb,
+    summarize,
+    write_results,
+)
+from benchmarks.fakes import FakeGemini, FakePublisher, InMemoryFirestore, install_fakes
+
+ROUTE_PREFIX = "/learning_path"
+TOPICS = ["Python", "Bases de datos", "Docker", "Kubernetes", "React", "Machine Learning",
+          "Estructuras de datos", "Redes", "Git", "Álgebra lineal"]
+
+
+class Scenario:
+    """
+    Cómo construir la i-ésima petición para una ruta de learning_path_routes.
+    ``prepare(client, token)`` (opcional) corre una vez por worker antes de
+    empezar y retorna los parámetros de ruta que no son el email (p. ej. el ID
+    de un roadmap creado): cada worker edita lo suyo, como clientes distintos.
+    """
+
+    def __init__(
+        self,
+        method: str,
+        path: str,
+        build: Callable[[int], Dict[str, Any]],
+        prepare: Optional[Callable[[Any, str], Awaitable[Dict[str, str]]]] = None
+    ):
+        self.method = method
+        self.path = path
+        self.build = build
+        self.prepare = prepare
+
+    @property
+    def name(self) -> str:
+        return f"{self.method} {self.path}"
+
+
+def topic_name(i: int, topic_pool: int) -> str:
+    """Temas de un pool fijo (repetidos, cacheables) o únicos si topic_pool es 0"""
+    if topic_pool <= 0:
+        return f"{TOPICS[i % len(TOPICS)]} {i}"
+    pool = TOPICS if topic_pool <= len(TOPICS) else TOPICS + [f"Tema {k}" for k in range(topic_pool - len(TOPICS))]
+    return pool[i % topic_pool]
+
+
+def _document(i: int, file_bytes: int) -> Dict[str, Any]:
+    content = base64.b64encode((f"Documento {i} " * (file_bytes // 12 + 1))[:file_bytes].encode()).decode()
+    return {"json": {"fileName": f"apuntes-{i}.txt", "fileBase64": content}}
+
+
+async def _create_roadmap(client, token: str) -> Dict[str, str]:
+    response = await client.post(
+        ROUTE_PREFIX + "/roadmaps",
+        json={"topic": TOPICS[0]},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    return {"roadmap_id": response.headers.get("x-roadmap-id", "missing")}
+
+
+async def _submit_job(client, token: str) -> Dict[str, str]:
+    response = await client.post(
+        ROUTE_PREFIX + "/jobs/roadmaps",
+        json={"topic": TOPICS[0]},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    return {"job_id": response.json().get("job_id", "missing")}
+
+
+async def _cancelled_job(client, token: str) -> Dict[str, str]:
+    # Cancelar de nuevo un job cancelado responde 200: se mide la ruta sin depender de cuándo termina
+    params = await _submit_job(client, token)
+    await client.delete(ROUTE_PREFIX + "/jobs/{job_id}".format(**params), headers={"Authorization": f"Bearer {token}"})
+    return params
+
+
+def build_scenarios(file_bytes: int, topic_pool: int = len(TOPICS), batch_size: int = 5) -> List[Scenario]:
+    internal = {"headers": {"x-api-key": os.environ["INTERNAL_API_KEY"]}}
+
+    def _topic(i: int) -> Dict[str, Any]:
+        return {"json": {"topic": topic_name(i, topic_pool)}}
+
+    def _topic_batch(i: int) -> Dict[str, Any]:
+        return {"json": {"topics": [topic_name(i * batch_size + k, topic_pool) for k in range(batch_size)]}}
+
+    return [
+        Scenario("POST", "/documents", lambda i: _document(i, file_bytes)),
+        Scenario("POST", "/roadmaps", _topic),
+        Scenario("POST", "/questions", _topic),
+        Scenario("POST", "/related-topics", _topic),
+        Scenario("POST", "/bundle", _topic),
+        Scenario("PATCH", "/roadmaps/{roadmap_id}", lambda i: {"json": {"node": "Subtema 1", "mode": "regenerate"}},
+                 prepare=_create_roadmap),
+        Scenario("POST", "/roadmaps/batch", _topic_batch),
+        Scenario("POST", "/related-topics/batch", _topic_batch),
+        Scenario("POST", "/jobs/roadmaps", _topic),
+        Scenario("POST", "/jobs/documents", lambda i: _document(i, file_bytes)),
+        Scenario("GET", "/jobs/{job_id}", lambda i: {}, prepare=_submit_job),
+        Scenario("DELETE", "/jobs/{job_id}", lambda i: {}, prepare=_cancelled_job),
+        Scenario("GET", "/roadmaps/user/{user_email}", lambda i: internal),
+        Scenario("GET", "/roadmaps/user/{user_email}/latest", lambda i: internal),
+        Scenario("GET", "/conversations/user/{user_email}/export",
+                 lambda i: {**internal, "params": {"gzip": str(i % 2 == 0).lower()}}),
+        Scenario("GET", "/internal/metrics", lambda i: internal),
+        Scenario("GET", "/internal/usage", lambda i: internal),
+    ]
+
+
+def check_coverage(scenarios: List[Scenario]) -> List[str]:
+    """Rutas del router sin escenario (para no olvidar endpoints nuevos)"""
+    from app.api import learning_path_routes
+
+    covered = {(s.method, s.path) for s in scenarios}
+    missing = []
+    for route in learning_path_routes.router.routes:
+        for method in sorted(getattr(route, "methods", None) or []):
+            if (method, route.path) not in covered:
+                missing.append(f"{method} {route.path}")
+    return missing
+
+
+async def run_scenario(
+    client,
+    scenario: Scenario,
+    total: int,
+    concurrency: int,
+    token: str
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    status_codes: Dict[int, int] = {}
+    counter = iter(range(total))
+
+    async def worker(path: str):
+        nonlocal errors
+        for i in counter:
+            kwargs = scenario.build(i)
+            headers = {"Authorization": f"Bearer {token}", **kwargs.get("headers", {})}
+            start = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, path, json=kwargs.get("json"),
+                                                params=kwargs.get("params"), headers=headers)
+                await response.aread()
+                status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+                if response.status_code >= 400:
+                    errors += 1
+                    continue
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    prepared = [
+        await scenario.prepare(client, token) if scenario.prepare else {}
+        for _ in range(concurrency)
+    ]
+    paths = [ROUTE_PREFIX + scenario.path.format(user_email=BENCH_EMAIL, **params) for params in prepared]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(path) for path in paths))
+    elapsed = time.perf_counter() - start
+
+    stats = summarize(latencies, errors, elapsed)
+    stats["status_codes"] = {str(k): v for k, v in sorted(status_codes.items())}
+    return stats
+
+
+def make_client(url: Optional[str], timeout: float):
+    import httpx
+
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=timeout)
+
+    from app.main import app
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=timeout)
+
+
+async def main_async(args) -> Dict[str, Any]:
+    gemini = db = None
+    if not args.url:
+        import app.main  # noqa: F401  (importa todos los módulos antes de instalar los dobles)
+        gemini = FakeGemini(
+            latency=args.model_latency,
+            jitter=args.model_jitter,
+            payload_bytes=args.payload_bytes,
+            blocking=args.blocking_model,
+        )
+        db = InMemoryFirestore(rtt=args.firestore_rtt)
+        install_fakes(gemini, db, FakePublisher())
+
+    scenarios = build_scenarios(args.file_bytes, args.topic_pool, args.batch_size)
+    if not args.url:
+        for missing in check_coverage(scenarios):
+            print(f"⚠️  Ruta sin escenario de carga: {missing}")
+    if args.routes:
+        scenarios = [s for s in scenarios if s.path in args.routes]
+
+    token = mint_token()
+    results: Dict[str, Any] = {}
+    async with make_client(args.url, args.timeout) as client:
+        for scenario in scenarios:
+            results[scenario.name] = await run_scenario(
+                client, scenario, args.requests, args.concurrency, token
+            )
+            stats = results[scenario.name]
+            print(
+                f"{scenario.name:45s} rps={stats['rps']:8.2f} p50={stats['p50_ms']:8.1f}ms "
+                f"p95={stats['p95_ms']:8.1f}ms p99={stats['p99_ms']:8.1f}ms errors={stats['errors']}"
+            )
+
+    payload: Dict[str, Any] = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "routes": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if gemini is not None:
+        payload["model_calls"] = sum(gemini.calls.values())
+        payload["firestore_rpcs"] = dict(db.stats)
+    return payload
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100, help="Peticiones por ruta")
+    parser.add_argument("--routes", nargs="*", help="Limitar a estas rutas (p.ej. /roadmaps)")
+    parser.add_argument("--topic-pool", type=int, default=len(TOPICS),
+                        help="Cantidad de temas distintos (0 = un tema nuevo por petición, sin caché)")
+    parser.add_argument("--batch-size", type=int, default=5, help="Temas por petición en las rutas /batch")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="Segundos por llamada a Gemini")
+    parser.add_argument("--model-jitter", type=float, default=0.2)
+    parser.add_argument("--payload-bytes", type=int, default=4000, help="Tamaño de respuesta de roadmaps")
+    parser.add_argument("--file-bytes", type=int, default=20000, help="Tamaño de los archivos de /documents")
+    parser.add_argument("--firestore-rtt", type=float, default=0.0, help="Segundos por RPC de Firestore")
+    parser.add_argument("--blocking-model", action="store_true",
+                        help="El modelo falso bloquea el hilo como el SDK síncrono")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--url", help="Apuntar a un servidor ya levantado en vez de la app en proceso")
+    parser.add_argument("--output", help="Ruta del JSON de resultados")
+    parser.add_argument("--compare", help="JSON de una corrida anterior para comparar")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    payload = asyncio.run(main_async(args))
+    path = write_results("load_test", payload, args.output)
+    print(f"RSS máximo: {payload['peak_rss_mb']} MB")
+    print(f"📄 Resultados guardados en {path}")
+    if args.compare:
+        for line in compare_results(payload, args.compare):
+            print(line)
+    return payload
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark de persistencia de roadmaps.
+
+Mide la latencia de ``save_roadmap_with_conversation_atomic`` y de
+``update_roadmap_with_log_atomic`` (sin y con precondición de ``update_time``) contra InMemoryFirestore con un RTT fijo por
+RPC (``--rtt``), y cuántos RPCs de cada tipo hace cada llamada. Con RTT de red
+real la latencia es casi RTT × RPCs, así que los conteos son comparables entre commits.
+
+Uso:
+    python -m benchmarks.persistence --saves 200 --rtt 0.02
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from benchmarks.common import BENCH_EMAIL, summarize, write_results
+from benchmarks.fakes import InMemoryFirestore, install_fakes
+
+
+async def _measure(func, calls: int) -> List[float]:
+    latencies = []
+    for i in range(calls):
+        start = time.perf_counter()
+        await func(i)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def main_async(args) -> Dict[str, Any]:
+    import app.main  # noqa: F401  (importa todos los módulos antes de instalar los dobles)
+    from app.services import db_services
+
+    db = InMemoryFirestore(rtt=args.rtt)
+    install_fakes(db=db)
+    roadmap = {"title": "Python", "nodes": [{"name": f"Subtema {k}", "children": []} for k in range(10)]}
+    saved: List[str] = []
+
+    async def save(i: int):
+        result = await db_services.save_roadmap_with_conversation_atomic(
+            user_email=BENCH_EMAIL,
+            roadmap_title=f"Roadmap {i}",
+            roadmap_content=roadmap,
+            prompt="Generar roadmap del tema: Python",
+            response="{}",
+        )
+        saved.append(result["roadmap_id"])
+
+    async def update(i: int):
+        await db_services.update_roadmap_with_log_atomic(
+            roadmap_id=saved[i % len(saved)],
+            user_email=BENCH_EMAIL,
+            updates={"content": roadmap},
+            log_message="Nodo regenerado",
+        )
+
+    async def update_checked(i: int):
+        # Flujo del PATCH: leer el roadmap y actualizarlo con precondición
+        roadmap_id = saved[i % len(saved)]
+        current = await db_services.get_roadmap_by_id(roadmap_id)
+        await db_services.update_roadmap_with_log_atomic(
+            roadmap_id=roadmap_id,
+            user_email=BENCH_EMAIL,
+            updates={"content": roadmap},
+            log_message="Nodo regenerado",
+            expected_update_time=current["_update_time"],
+        )
+
+    results: Dict[str, Any] = {}
+    for name, func in (("save_roadmap", save), ("update_roadmap", update), ("update_checked", update_checked)):
+        before = dict(db.stats)
+        start = time.perf_counter()
+        latencies = await _measure(func, args.saves)
+        stats = summarize(latencies, 0, time.perf_counter() - start)
+        stats["rpcs_per_call"] = {
+            kind: round((count - before.get(kind, 0)) / args.saves, 2)
+            for kind, count in db.stats.items()
+            if kind != "documents_written" and count != before.get(kind, 0)
+        }
+        results[name] = stats
+        print(
+            f"{name:16s} p50={stats['p50_ms']:8.2f}ms p95={stats['p95_ms']:8.2f}ms "
+            f"p99={stats['p99_ms']:8.2f}ms rpcs/llamada={stats['rpcs_per_call']}"
+        )
+
+    linked = db.dump("conversations")
+    results["conversations_linked"] = sum(
+        1 for conversation in linked.values() if conversation.get("metadata", {}).get("roadmap_id") in saved
+    )
+    return {"config": {k: v for k, v in vars(args).items() if k != "output"}, "calls": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--saves", type=int, default=200, help="Llamadas por operación")
+    parser.add_argument("--rtt", type=float, default=0.02, help="Segundos por RPC de Firestore")
+    parser.add_argument("--output", help="Ruta del JSON de resultados")
+    args = parser.parse_args(argv)
+
+    payload = asyncio.run(main_async(args))
+    print(f"📄 Resultados guardados en {write_results('persistence', payload, args.output)}")
+    return payload
+
+
+if __name__ == "__main__":
+    main()
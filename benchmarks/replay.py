@@ -0,0 +1,219 @@
+"""
+Reproduce un archivo de captura (TRAFFIC_CAPTURE_PATH) contra la app en proceso.
+
+Cada hash de tema se convierte en un tema sintético estable ("tema-<hash>"),
+así las repeticiones del tráfico real siguen siendo repeticiones y los cachés
+se comportan igual. El modelo falso reproduce, por tema, la latencia y el
+tamaño de respuesta registrados.
+
+Al final reporta latencias por ruta, llamadas al modelo grabadas vs. hechas
+(lo que ahorraron cachés y coalescencia) y escrituras por segundo en Firestore.
+
+Uso:
+    python -m benchmarks.replay capture.ndjson --concurrency 20
+    python -m benchmarks.replay capture.ndjson --speed 1.0   # respeta los tiempos originales
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+from benchmarks.common import BENCH_EMAIL, mint_token, peak_rss_mb, summarize, write_results
+from benchmarks.fakes import FakeGemini, FakePublisher, InMemoryFirestore, install_fakes
+
+TOKEN_PATTERN = re.compile(r"(tema|doc)-[0-9a-f]{8,16}")
+
+
+def load_records(path: str) -> List[Dict[str, Any]]:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda r: r.get("ts", 0))
+    return records
+
+
+class ReplayProfile:
+    """
+    Perfil del modelo por token (tema o documento): devuelve las latencias y
+    tamaños grabados en orden, ciclando si el replay pide más llamadas.
+    """
+
+    def __init__(self, default_latency: float, default_bytes: int):
+        self.default = (default_latency, default_bytes)
+        self.calls: Dict[str, List[tuple]] = defaultdict(list)
+        self._cursor: Counter = Counter()
+
+    def add(self, token: str, model_calls: List[Dict[str, Any]]) -> None:
+        for call in model_calls:
+            self.calls[token].append((call["latency_ms"] / 1000, call["response_chars"]))
+
+    def __call__(self, prompt: str) -> Optional[tuple]:
+        match = TOKEN_PATTERN.search(prompt)
+        if not match or not self.calls.get(match.group(0)):
+            return self.default
+        token = match.group(0)
+        recorded = self.calls[token]
+        index = self._cursor[token] % len(recorded)
+        self._cursor[token] += 1
+        return recorded[index]
+
+
+def build_request(record: Dict[str, Any], index: int) -> Optional[Dict[str, Any]]:
+    """Convierte un registro en (método, path, json, token para el perfil)"""
+    route = record["route"]
+    method = record.get("method", "POST")
+    headers = {}
+    body = None
+    token = None
+
+    if "topic_hash" in record:
+        token = f"tema-{record['topic_hash']}"
+        # El largo del tema se respeta rellenando con palabras neutras
+        padding = max(0, record.get("topic_chars", 0) - len(token))
+        body = {"topic": token + (" x" * (padding // 2))}
+    elif "topic_hashes" in record:
+        body = {"topics": [f"tema-{h}" for h in record["topic_hashes"]]}
+    elif "file_bytes" in record:
+        token = f"doc-{index:08x}"
+        raw = (token + " ") * (record["file_bytes"] // (len(token) + 1) + 1)
+        body = {"fileName": f"{token}.txt", "fileBase64": base64.b64encode(raw[:record["file_bytes"]].encode()).decode()}
+
+    if "{user_email}" in route:
+        route = route.replace("{user_email}", BENCH_EMAIL)
+        headers["x-api-key"] = os.environ["INTERNAL_API_KEY"]
+    if "{" in route:
+        return None
+
+    return {"method": method, "path": route, "json": body, "headers": headers, "token": token}
+
+
+async def replay(args) -> Dict[str, Any]:
+    import httpx
+    import app.main  # noqa: F401
+    from app.main import app
+
+    records = load_records(args.capture)
+    if args.limit:
+        records = records[:args.limit]
+
+    profile = ReplayProfile(args.default_latency, args.default_bytes)
+    requests = []
+    skipped = 0
+    for index, record in enumerate(records):
+        request = build_request(record, index)
+        if request is None:
+            skipped += 1
+            continue
+        if request["token"]:
+            profile.add(request["token"], record.get("model_calls", []))
+        request["offset"] = record.get("ts", 0) - records[0].get("ts", 0)
+        requests.append(request)
+
+    gemini = FakeGemini(jitter=0.0, profile=profile, blocking=args.blocking_model)
+    db = InMemoryFirestore(rtt=args.firestore_rtt)
+    install_fakes(gemini, db, FakePublisher())
+
+    token = mint_token()
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    start = time.perf_counter()
+
+    async def send(client, request):
+        if args.speed > 0:
+            delay = request["offset"] / args.speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        key = f"{request['method']} {request['path'].replace(BENCH_EMAIL, '{user_email}')}"
+        async with semaphore:
+            began = time.perf_counter()
+            try:
+                response = await client.request(
+                    request["method"], request["path"], json=request["json"],
+                    headers={"Authorization": f"Bearer {token}", **request["headers"]},
+                )
+                await response.aread()
+                if response.status_code >= 400:
+                    errors[key] += 1
+                    return
+            except Exception:
+                errors[key] += 1
+                return
+            latencies[key].append(time.perf_counter() - began)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=args.timeout) as client:
+        await asyncio.gather(*(send(client, r) for r in requests))
+    elapsed = time.perf_counter() - start
+
+    recorded_calls = sum(len(r.get("model_calls", [])) for r in records)
+    made_calls = sum(gemini.calls.values())
+    topic_hashes = [r["topic_hash"] for r in records if "topic_hash" in r]
+
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "requests": len(requests),
+        "skipped": skipped,
+        "elapsed_s": round(elapsed, 2),
+        "routes": {
+            key: summarize(latencies.get(key, []), errors[key], elapsed)
+            for key in sorted(set(latencies) | set(errors))
+        },
+        "workload": {
+            "distinct_topics": len(set(topic_hashes)),
+            "topic_repeat_ratio": round(1 - len(set(topic_hashes)) / len(topic_hashes), 3) if topic_hashes else 0.0,
+        },
+        "model": {
+            "recorded_calls": recorded_calls,
+            "replayed_calls": made_calls,
+            "calls_saved_ratio": round(1 - made_calls / recorded_calls, 3) if recorded_calls else 0.0,
+        },
+        "persistence": {
+            "documents_written": db.stats["documents_written"],
+            "writes_per_s": round(db.stats["documents_written"] / elapsed, 2) if elapsed else 0.0,
+            "rpcs": dict(db.stats),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="Archivo NDJSON generado con TRAFFIC_CAPTURE_PATH")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="1.0 respeta los tiempos grabados, 2.0 va al doble; 0 lo más rápido posible")
+    parser.add_argument("--limit", type=int, help="Reproducir solo los primeros N registros")
+    parser.add_argument("--default-latency", type=float, default=0.5,
+                        help="Latencia del modelo para llamadas sin registro equivalente")
+    parser.add_argument("--default-bytes", type=int, default=2000)
+    parser.add_argument("--firestore-rtt", type=float, default=0.0)
+    parser.add_argument("--blocking-model", action="store_true")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Ruta del JSON de resultados")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    payload = asyncio.run(replay(args))
+    for route, stats in payload["routes"].items():
+        print(f"{route:45s} n={stats['requests']:6d} p50={stats['p50_ms']:8.1f}ms "
+              f"p95={stats['p95_ms']:8.1f}ms p99={stats['p99_ms']:8.1f}ms errors={stats['errors']}")
+    print(f"Llamadas al modelo: {payload['model']['replayed_calls']} de {payload['model']['recorded_calls']} grabadas "
+          f"(ahorro {payload['model']['calls_saved_ratio']:.1%})")
+    print(f"Escrituras: {payload['persistence']['writes_per_s']}/s")
+    print(f"📄 Resultados guardados en {write_results('replay', payload, args.output)}")
+    return payload
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Benchmark de escalado con la cantidad de workers.
+
+Para cada cantidad de workers levanta ``app.serve`` con la app de
+``benchmarks.fake_app`` (modelo y Firestore falsos), espera a que responda y
+le aplica carga durante ``--duration`` segundos desde varios procesos cliente.
+Reporta RPS, p50/p95/p99 y la eficiencia contra un worker
+(``rps_n / (n * rps_1)``; 1.0 es escalado lineal).
+
+Los clientes corren en la misma máquina y también usan CPU: para medir el
+servidor solo, dejar cores libres (``--clients``) o correr con más cores que workers.
+
+Uso:
+    python -m benchmarks.scaling --workers 1 2 4 --duration 15
+    python -m benchmarks.scaling --route /related-topics --clients 2 --concurrency 32
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+from benchmarks.common import mint_token, summarize, write_results
+from benchmarks.load_test import ROUTE_PREFIX, TOPICS
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _cache_path(port: int) -> str:
+    # Cada corrida con su propio caché de nodo, vacío
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"
+    return os.path.join(directory, f"learning_path_bench_{port}.sqlite3")
+
+
+def start_server(workers: int, port: int, model_latency: float) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        BENCH_MODEL_LATENCY=str(model_latency),
+        LOG_LEVEL="WARNING",
+        SHARED_CACHE_PATH=_cache_path(port),
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--app", "benchmarks.fake_app:app",
+         "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--max-requests", "0"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+
+
+def wait_until_healthy(url: str, server: subprocess.Popen, timeout: float = 60) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"El servidor terminó al arrancar:\n{server.stderr.read().decode()[-2000:]}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("El servidor no respondió a /health a tiempo")
+
+
+def stop_server(server: subprocess.Popen, port: int) -> None:
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+    for suffix in ("", "-wal", "-shm"):
+        path = _cache_path(port) + suffix
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def _client_loop(url: str, route: str, token: str, concurrency: int, duration: float, offset: int):
+    import httpx
+
+    latencies: List[float] = []
+    errors = 0
+    stop_at = time.perf_counter() + duration
+    headers = {"Authorization": f"Bearer {token}"}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=30, limits=limits) as client:
+        async def worker(k: int):
+            nonlocal errors
+            i = offset + k
+            while time.perf_counter() < stop_at:
+                i += concurrency
+                start = time.perf_counter()
+                try:
+                    response = await client.post(
+                        ROUTE_PREFIX + route, json={"topic": TOPICS[i % len(TOPICS)]}, headers=headers
+                    )
+                    if response.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker(k) for k in range(concurrency)))
+    return latencies, errors
+
+
+def _client_process(args) -> tuple:
+    return asyncio.run(_client_loop(*args))
+
+
+def measure(workers: int, args) -> Dict[str, Any]:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    server = start_server(workers, port, args.model_latency)
+    try:
+        wait_until_healthy(url, server)
+        token = mint_token()
+        # Calentar: cada tema generado y cacheado antes de medir
+        asyncio.run(_client_loop(url, args.route, token, len(TOPICS), 2.0, 0))
+
+        jobs = [
+            (url, args.route, token, args.concurrency, args.duration, n * args.concurrency)
+            for n in range(args.clients)
+        ]
+        start = time.perf_counter()
+        with multiprocessing.get_context("spawn").Pool(args.clients) as pool:
+            results = pool.map(_client_process, jobs)
+        elapsed = time.perf_counter() - start
+    finally:
+        stop_server(server, port)
+
+    latencies = [latency for chunk, _ in results for latency in chunk]
+    errors = sum(chunk_errors for _, chunk_errors in results)
+    # El tiempo de arranque de los clientes no cuenta: se mide sobre la duración pedida
+    return summarize(latencies, errors, min(elapsed, args.duration))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, os.cpu_count() or 1}), help="Cantidades de workers a medir")
+    parser.add_argument("--route", default="/related-topics", help="Ruta POST con cuerpo {topic}")
+    parser.add_argument("--duration", type=float, default=15.0, help="Segundos de carga por cantidad de workers")
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Procesos generadores de carga")
+    parser.add_argument("--concurrency", type=int, default=32, help="Conexiones por proceso cliente")
+    parser.add_argument("--model-latency", type=float, default=0.05, help="Segundos por llamada al modelo falso")
+    parser.add_argument("--output", help="Ruta del JSON de resultados")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Any] = {}
+    baseline = None
+    for workers in args.workers:
+        stats = measure(workers, args)
+        if baseline is None and workers == 1:
+            baseline = stats["rps"]
+        stats["efficiency"] = round(stats["rps"] / (workers * baseline), 2) if baseline else None
+        results[str(workers)] = stats
+        print(
+            f"workers={workers:3d} rps={stats['rps']:9.2f} p50={stats['p50_ms']:8.1f}ms "
+            f"p95={stats['p95_ms']:8.1f}ms p99={stats['p99_ms']:8.1f}ms errors={stats['errors']} "
+            f"eficiencia={stats['efficiency']}"
+        )
+
+    payload = {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "cpu_count": os.cpu_count(),
+        "workers": results,
+    }
+    print(f"📄 Resultados guardados en {write_results('scaling', payload, args.output)}")
+    return payload
+
+
+if __name__ == "__main__":
+    main()
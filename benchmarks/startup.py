@@ -0,0 +1,115 @@
+"""
+Benchmark de arranque en frío.
+
+Cada corrida es un proceso nuevo que mide:
+  - import_s: tiempo de ``import app.main``
+  - first_health_ms: primera petición a /health tras el startup del lifespan
+  - first_request_ms: primera petición a una ruta de la API (modelo y Firestore falsos)
+  - warmup_s: hasta que el warm-up en paralelo termina (/ready)
+
+Uso:
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --real-firestore   # incluye la inicialización real de Firestore
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+from benchmarks.common import peak_rss_mb, write_results
+
+CHILD = r"""
+import asyncio, json, os, time
+start = time.perf_counter()
+import benchmarks.common
+from app.main import app
+import_s = time.perf_counter() - start
+
+from benchmarks.common import mint_token
+from benchmarks.fakes import FakeGemini, InMemoryFirestore, install_fakes
+import httpx
+
+install_fakes(FakeGemini(latency=0.0), None if os.environ.get("BENCH_REAL_FIRESTORE") else InMemoryFirestore())
+
+async def main():
+    from app.core import startup
+    transport = httpx.ASGITransport(app=app)
+    result = {"import_s": import_s}
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            t = time.perf_counter()
+            await client.get("/health")
+            result["first_health_ms"] = (time.perf_counter() - t) * 1000
+
+            t = time.perf_counter()
+            response = await client.post(
+                "/learning_path/related-topics", json={"topic": "Python"},
+                headers={"Authorization": f"Bearer {mint_token()}"},
+            )
+            result["first_request_ms"] = (time.perf_counter() - t) * 1000
+            result["first_request_status"] = response.status_code
+
+            t = time.perf_counter()
+            while (await client.get("/ready")).status_code != 200 and time.perf_counter() - t < 60:
+                if startup.readiness_report()["status"] == "degraded":
+                    break
+                await asyncio.sleep(0.01)
+            report = startup.readiness_report()
+            result["warmup_s"] = report["warmup_s"]
+            result["components"] = report["components"]
+    print("STARTUP_RESULT " + json.dumps(result))
+
+asyncio.run(main())
+"""
+
+
+def run_once(real_firestore: bool) -> Dict[str, Any]:
+    env = dict(os.environ)
+    if real_firestore:
+        env["BENCH_REAL_FIRESTORE"] = "1"
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], capture_output=True, text=True, env=env, timeout=300
+    )
+    for line in output.stdout.splitlines():
+        if line.startswith("STARTUP_RESULT "):
+            return json.loads(line[len("STARTUP_RESULT "):])
+    raise RuntimeError(f"La corrida de arranque falló:\n{output.stderr[-2000:]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--real-firestore", action="store_true")
+    parser.add_argument("--output", help="Ruta del JSON de resultados")
+    args = parser.parse_args(argv)
+
+    runs: List[Dict[str, Any]] = [run_once(args.real_firestore) for _ in range(args.runs)]
+
+    summary = {}
+    for key in ("import_s", "first_health_ms", "first_request_ms", "warmup_s"):
+        values = [r[key] for r in runs if r.get(key) is not None]
+        if values:
+            summary[key] = {
+                "median": round(statistics.median(values), 4),
+                "min": round(min(values), 4),
+                "max": round(max(values), 4),
+            }
+            print(f"{key:18s} mediana={summary[key]['median']:10.4f} min={summary[key]['min']:10.4f} "
+                  f"max={summary[key]['max']:10.4f}")
+    print(f"Componentes (última corrida): {runs[-1].get('components')}")
+
+    payload = {
+        "config": {"runs": args.runs, "real_firestore": args.real_firestore},
+        "summary": summary,
+        "runs": runs,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(f"📄 Resultados guardados en {write_results('startup', payload, args.output)}")
+    return payload
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Chequeo del índice de temas casi iguales (``topic_index_services``).
+
+Recorre pares de temas que deben servirse con la misma respuesta y pares que
+no, con la normalización y el umbral del caché, y mide cuánto tarda
+``similar`` con el índice lleno. Termina con código 1 si algún par no da lo
+esperado, así sirve de chequeo de regresión al tocar stopwords o el umbral.
+
+Uso:
+    python -m benchmarks.topic_similarity
+    python -m benchmarks.topic_similarity --size 50000
+"""
+import argparse
+import random
+import string
+import sys
+import time
+from typing import List, Tuple
+
+from app.services.cache_services import TOPIC_SIMILARITY_THRESHOLD, normalize_topic
+from app.services.topic_index_services import TopicIndex
+
+# (tema pedido, tema ya generado): deben coincidir
+SAME = [
+    ("python desde cero", "Python"),
+    ("Aprender Python", "Python"),
+    ("python basico", "Python"),
+    ("Aprender Python", "python desde cero"),
+    ("Pyhton", "Python"),
+    ("Curso de Python", "Python"),
+    ("Bases de datos", "base de datos"),
+    ("Kuberentes", "Kubernetes"),
+    ("Machine learning basico", "Machine Learning"),
+]
+
+# (tema pedido, tema ya generado): son pedidos distintos
+DIFFERENT = [
+    ("Machine", "Machine learning"),
+    ("Deep learning", "Machine learning"),
+    ("Learning", "Machine learning"),
+    ("Python2", "Python3"),
+    ("Redis", "Redes"),
+    ("Javascript", "Javascript avanzado"),
+]
+
+
+def check_pairs(threshold: float) -> List[str]:
+    failures = []
+    for pairs, expected in ((SAME, True), (DIFFERENT, False)):
+        for requested, stored in pairs:
+            index = TopicIndex(normalize_topic, threshold)
+            index.add(stored)
+            matches = index.similar(requested)
+            if bool(matches) != expected:
+                failures.append(f"'{requested}' vs '{stored}': esperado {'match' if expected else 'sin match'}, obtenido {matches}")
+    return failures
+
+
+def time_lookups(size: int, threshold: float) -> Tuple[float, float]:
+    """(ms por add, ms por similar) con ``size`` temas indexados"""
+    rng = random.Random(43)
+    vocabulary = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))) for _ in range(size // 2)]
+    topics = [" ".join(rng.sample(vocabulary, rng.randint(1, 3))) for _ in range(size)]
+    index = TopicIndex(normalize_topic, threshold, max_size=size)
+    start = time.perf_counter()
+    for topic in topics:
+        index.add(topic)
+    add_ms = (time.perf_counter() - start) * 1000 / size
+    # Mitad con una letra de menos, mitad temas nuevos
+    queries = [topic[:-1] if n % 2 else topic[::-1] for n, topic in enumerate(topics[:1000])]
+    start = time.perf_counter()
+    for query in queries:
+        index.similar(query)
+    return add_ms, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=10000, help="temas en el índice para medir tiempos")
+    parser.add_argument("--threshold", type=float, default=TOPIC_SIMILARITY_THRESHOLD)
+    args = parser.parse_args()
+
+    failures = check_pairs(args.threshold)
+    total = len(SAME) + len(DIFFERENT)
+    print(f"pares: {total - len(failures)}/{total} ok (umbral {args.threshold})")
+    for failure in failures:
+        print(f"  ✗ {failure}")
+
+    add_ms, similar_ms = time_lookups(args.size, args.threshold)
+    print(f"índice de {args.size} temas: add {add_ms:.3f} ms, similar {similar_ms:.3f} ms")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()